@@ -0,0 +1,290 @@
+"""Time the stages of dobby on synthetic plates and save the results as JSON
+
+Example:
+$ python benchmarks/bench.py run --plates 1,100
+$ python benchmarks/bench.py compare benchmarks/results/abc1234.json \
+    benchmarks/results/def5678.json
+
+Each stage is timed on 1, 100 and 10,000 plates by default, and then run
+again under tracemalloc for its peak memory. Plotting is slow, so only the
+first --plot-limit plates are plotted.
+"""
+import contextlib
+import datetime
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic  # noqa: E402
+
+from dobby import aggregate, cherrypick, heatmap, samplesheet  # noqa: E402
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'results')
+
+STAGES = ('parse', 'regress', 'pick_list', 'plot', 'aggregate',
+          'samplesheet')
+
+TEMPLATE = 'XT-C-01'
+
+
+class Workload:
+    """Synthetic inputs of every stage, made once for a number of plates
+
+    The inputs of a stage are made before it is timed, from the outputs of
+    the stages before it where needed, e.g. "regress" times converting the
+    plates already parsed by "parse".
+    """
+
+    def __init__(self, folder, n_plates, plot_limit):
+        self.folder = folder
+        self.n_plates = n_plates
+        self.plot_limit = plot_limit
+        self.standards = cherrypick._parse_standards(cherrypick.STANDARDS_STR)
+        self.plates = synthetic.write_plates(os.path.join(folder, 'plates'),
+                                             n_plates)
+        self.cherrypicked = synthetic.write_cherrypicked(
+            os.path.join(folder, 'cherrypicked'), n_plates)
+        self._fluorescence = None
+        self._concentrations = None
+        self._picklists = None
+
+    def _output_folder(self, stage):
+        folder = os.path.join(self.folder, 'output', stage)
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+        return folder
+
+    @property
+    def fluorescence(self):
+        if self._fluorescence is None:
+            self.parse()
+        return self._fluorescence
+
+    @property
+    def concentrations(self):
+        if self._concentrations is None:
+            self.regress()
+        return self._concentrations
+
+    @property
+    def picklists(self):
+        if self._picklists is None:
+            self.aggregate()
+        return self._picklists
+
+    def setup(self, stage):
+        """Make the inputs of a stage, so they aren't part of its timing
+
+        Modules imported on first use (scipy, matplotlib) are imported here
+        too, so stages are timed warm
+        """
+        if stage == 'regress':
+            import scipy.stats  # noqa: F401
+        if stage == 'plot':
+            cherrypick._plotting()
+            heatmap._matplotlib()
+        if stage in ('regress', 'plot'):
+            self.fluorescence
+        if stage in ('pick_list', 'plot'):
+            self.concentrations
+        if stage == 'samplesheet':
+            self.picklists
+
+    # Each stage returns the number of items it processed
+
+    def parse(self):
+        self._fluorescence = [cherrypick._parse_fluorescence(filename, 'txt')
+                              for filename in self.plates]
+        return self.n_plates
+
+    def regress(self):
+        self._concentrations = [cherrypick._fluorescence_to_concentration(
+            fluorescence, cherrypick.STANDARDS_COL, self.standards)[0]
+            for fluorescence in self.fluorescence]
+        return self.n_plates
+
+    def pick_list(self):
+        output_folder = self._output_folder('pick_list')
+        for i, concentrations in enumerate(self.concentrations):
+            good_cells = cherrypick._get_good_cells(
+                concentrations, cherrypick.BLANKS_COL,
+                synthetic.plate_name(i), synthetic.mouse_id(i))
+            cherrypick._transform_to_pick_list(
+                good_cells, synthetic.plate_name(i), synthetic.mouse_id(i),
+                'cherrypicked', output_folder=output_folder)
+        return self.n_plates
+
+    def plot(self):
+        output_folder = self._output_folder('plot')
+        n = min(self.n_plates, self.plot_limit)
+        for i in range(n):
+            cherrypick._heatmap(self.concentrations[i],
+                                synthetic.plate_name(i), 'concentrations',
+                                output_folder, fmt='.1f', vmin=0, vmax=1)
+        return n
+
+    def aggregate(self):
+        output_folder = self._output_folder('aggregate')
+        aggregate.aggregate.main(self.cherrypicked + ['--output-folder',
+                                                      output_folder],
+                                 standalone_mode=False)
+        self._picklists = sorted(
+            glob.glob(os.path.join(output_folder, 'echo_picklist_*.csv')))
+        return self.n_plates
+
+    def samplesheet(self):
+        output_folder = self._output_folder('samplesheet')
+        for picklist in self.picklists:
+            samplesheet.write_samplesheet(picklist, TEMPLATE,
+                                          'Combined name', output_folder)
+        return len(self.picklists)
+
+
+def _measure(function, memory):
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        if not memory:
+            start = time.perf_counter()
+            n_items = function()
+            return n_items, time.perf_counter() - start
+        tracemalloc.start()
+        try:
+            function()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+
+def run_stage(workload, stage, memory=True):
+    """Time a stage, and measure its peak memory in a second run"""
+    function = getattr(workload, stage)
+    workload.setup(stage)
+    n_items, seconds = _measure(function, memory=False)
+    result = dict(stage=stage, n_plates=workload.n_plates, n_items=n_items,
+                  seconds=seconds,
+                  seconds_per_item=seconds / n_items if n_items else None,
+                  peak_memory_bytes=None)
+    if memory:
+        result['peak_memory_bytes'] = _measure(function, memory=True)
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, check=True, universal_newlines=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _environment():
+    import numpy
+    import pandas
+    return dict(python=platform.python_version(), numpy=numpy.__version__,
+                pandas=pandas.__version__, machine=platform.machine(),
+                system=platform.system(), processor=platform.processor(),
+                cpus=os.cpu_count())
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--plates', default='1,100,10000',
+              help='Comma-separated numbers of plates to benchmark')
+@click.option('--stages', default=','.join(STAGES),
+              help=f'Comma-separated stages to benchmark, of '
+                   f'{", ".join(STAGES)}')
+@click.option('--plot-limit', default=10,
+              help='Largest number of plates to plot')
+@click.option('--memory/--no-memory', default=True,
+              help='Also measure the peak memory of each stage, by running '
+                   'it again under tracemalloc')
+@click.option('--output', default=None, type=click.Path(dir_okay=False),
+              help='JSON file to save the results to. Defaults to '
+                   'benchmarks/results/<commit>.json')
+@click.option('--keep-data', default=None, type=click.Path(file_okay=False),
+              help='Keep the synthetic data and outputs in this folder')
+def run(plates, stages, plot_limit, memory, output, keep_data):
+    """Benchmark the stages of dobby on synthetic plates"""
+    stages = [stage.strip() for stage in stages.split(',')]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise click.BadParameter(f'unknown stages {", ".join(unknown)}',
+                                 param_hint='--stages')
+    commit = _git_commit()
+    if output is None:
+        output = os.path.join(RESULTS_FOLDER, f'{commit}.json')
+
+    results = []
+    for n_plates in (int(n) for n in plates.split(',')):
+        folder = keep_data or tempfile.mkdtemp(prefix='dobby_bench_')
+        folder = os.path.join(folder, str(n_plates))
+        click.echo(f'Generating {n_plates} synthetic plates ...')
+        workload = Workload(folder, n_plates, plot_limit)
+        for stage in stages:
+            result = run_stage(workload, stage, memory)
+            results.append(result)
+            peak = result['peak_memory_bytes']
+            peak = '' if peak is None else f', peak {peak / 2 ** 20:.1f} MiB'
+            click.echo(f'{n_plates:>6} plates  {stage:<12} '
+                       f'{result["seconds"]:9.3f} s '
+                       f'({result["n_items"]} items){peak}')
+        if keep_data is None:
+            shutil.rmtree(os.path.dirname(folder))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(dict(commit=commit,
+                       date=datetime.datetime.now().isoformat(
+                           timespec='seconds'),
+                       environment=_environment(), results=results),
+                  f, indent=1)
+    click.echo(f'Wrote {output}')
+
+
+def _by_stage(filename):
+    with open(filename) as f:
+        benchmark = json.load(f)
+    return benchmark['commit'], {(r['stage'], r['n_plates']): r
+                                 for r in benchmark['results']}
+
+
+@cli.command()
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('contender', type=click.Path(exists=True, dir_okay=False))
+def compare(baseline, contender):
+    """Compare the stages benchmarked in two results files"""
+    baseline_commit, baseline = _by_stage(baseline)
+    contender_commit, contender = _by_stage(contender)
+    click.echo(f'{"stage":<12} {"plates":>7} {baseline_commit:>10} '
+               f'{contender_commit:>10} {"speedup":>8} {"memory":>8}')
+    for key in sorted(baseline.keys() & contender.keys(),
+                      key=lambda key: (STAGES.index(key[0]), key[1])):
+        old, new = baseline[key], contender[key]
+        speedup = old['seconds'] / new['seconds'] if new['seconds'] else 0
+        memory = ''
+        if old['peak_memory_bytes'] and new['peak_memory_bytes']:
+            ratio = new['peak_memory_bytes'] / old['peak_memory_bytes']
+            memory = f'{ratio:7.2f}x'
+        click.echo(f'{key[0]:<12} {key[1]:>7} {old["seconds"]:>9.3f}s '
+                   f'{new["seconds"]:>9.3f}s {speedup:>7.2f}x {memory:>8}')
+
+
+if __name__ == '__main__':
+    cli()
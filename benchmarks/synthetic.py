@@ -0,0 +1,136 @@
+"""Synthetic plate reader exports and cherrypicked tables, in bulk
+
+Plates look like the SoftMax Pro exports of the cDNA QC: UTF-16 text with a
+header, a row of the column numbers and 16 rows of fluorescence, with the
+standards in column 24 and the blanks in column 23. Fluorescence follows a
+linear standard curve with some noise, and the samples have lognormal
+concentrations with a few empty wells, so that most plates pass cherrypick's
+sanity checks.
+"""
+import csv
+import os
+import string
+
+import numpy as np
+
+N_ROWS = 16
+N_COLUMNS = 24
+ROW_LETTERS = string.ascii_uppercase[:N_ROWS]
+
+STANDARDS = np.array([8, 8, 6, 6, 4, 4, 2, 2, 1, 1, 0.5, 0.5, 0.25, 0.25, 0,
+                      0])
+STANDARDS_COL = 24
+BLANKS_COL = 23
+
+# Fluorescence units per ng/ul, and of an empty well
+SLOPE = 1.5e6
+INTERCEPT = 1.5e5
+
+HEADER = ('##BLOCKS= 1\r\n'
+          'Plate:\tPlate1\t1.3\tPlateFormat\tEndpoint\tFluorescence\tTRUE\t'
+          'Raw\tFALSE\t1\t\t\t\t\t\t1\t540 \t1\t24\t384\t505 \tManual\t\t\t\t'
+          '9\t\t\t\t1\t16\t505 \t\t\r\n'
+          '\tTemperature(¡C)\t'
+          + '\t'.join(str(i) for i in range(1, N_COLUMNS + 1)) + '\t\t\r\n')
+
+TIDY_COLUMNS = ['column_number', 'row_letter', 'concentration', 'well',
+                'plate', 'mouse_id', 'name']
+
+
+def plate_name(i):
+    return f'SYN{i:06d}'
+
+
+def mouse_id(i):
+    return f'{i % 50}_{i % 7}_{"MF"[i % 2]}'
+
+
+def concentrations(rng, empty_fraction=0.05):
+    """Concentrations of a plate, with the standards and blanks"""
+    values = rng.lognormal(mean=0.1, sigma=0.35, size=(N_ROWS, N_COLUMNS))
+    values[rng.random_sample((N_ROWS, N_COLUMNS)) < empty_fraction] = 0
+    values[:, BLANKS_COL - 1] = rng.normal(0.05, 0.02, size=N_ROWS)
+    values[:, STANDARDS_COL - 1] = STANDARDS
+    return values
+
+
+def fluorescence(rng, concentrations, noise=0.03):
+    """Plate reader counts of a plate of concentrations"""
+    values = INTERCEPT + SLOPE * concentrations
+    values *= rng.normal(1, noise, size=values.shape)
+    return np.maximum(values, 0).round()
+
+
+def format_export(values, name):
+    """Text of a plate reader export of a plate of fluorescence"""
+    lines = [HEADER]
+    for i, row in enumerate(values.astype(np.int64)):
+        temperature = '25.5' if i == 0 else ''
+        lines.append(f'\t{temperature}\t'
+                     + '\t'.join(map(str, row)) + '\t\t\r\n')
+    lines.append('\r\n~End\r\n')
+    lines.append(f'Original Filename: {name}; '
+                 f'Date Last Saved: 9/13/2017 4:07:55 PM\r\n')
+    return ''.join(lines)
+
+
+def write_plates(folder, n_plates, seed=0):
+    """Write ``n_plates`` plate reader exports
+
+    Returns
+    -------
+    filenames : list of str
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    filenames = []
+    for i in range(n_plates):
+        name = plate_name(i)
+        values = fluorescence(rng, concentrations(rng))
+        filename = os.path.join(folder, f'{name}.txt')
+        with open(filename, 'w', encoding='utf-16', newline='') as f:
+            f.write(format_export(values, name))
+        filenames.append(filename)
+    return filenames
+
+
+def write_metadata(filename, n_plates):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['plate', 'mouse.id'])
+        writer.writerows((plate_name(i), mouse_id(i))
+                         for i in range(n_plates))
+    return filename
+
+
+def write_cherrypicked(folder, n_plates, seed=0, good_fraction=0.8):
+    """Write ``n_plates`` tidy cherrypicked tables, as "dobby cherrypick" does
+
+    Returns
+    -------
+    filenames : list of str
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    n_samples = BLANKS_COL - 1
+    filenames = []
+    for i in range(n_plates):
+        name, mouse = plate_name(i), mouse_id(i)
+        values = concentrations(rng)[:, :n_samples]
+        is_good = rng.random_sample(values.shape) < good_fraction
+        filename = os.path.join(folder, f'{name}_echo.csv')
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(TIDY_COLUMNS)
+            # Column-major, like the pick lists of cherrypick
+            for column in range(n_samples):
+                for row in range(N_ROWS):
+                    if not is_good[row, column]:
+                        continue
+                    well = f'{ROW_LETTERS[row]}{column + 1}'
+                    concentration = float(values[row, column])
+                    writer.writerow([column + 1, ROW_LETTERS[row],
+                                     repr(concentration), well, name, mouse,
+                                     f'{well}-{name}-{mouse}-1'])
+        filenames.append(filename)
+    return filenames
@@ -1,25 +1,58 @@
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import itertools
 import os
-import string
 import warnings
 
+import numpy as np
+
 with warnings.catch_warnings():
     warnings.simplefilter("ignore")
     import pandas as pd
 
 import click
 
-PLATE_SIZE = 384
+from . import columnar, metrics, packing
+from .echo import (DESIRED_CONCENTRATION, FINALVOLUME, echo_filename,
+                   echo_options, quantize, sample_volumes,
+                   write_echo_transfers)
+from .geometry import GEOMETRIES, PLATE_384, geometry_of
+from .manifest import MANIFEST, AggregateManifest, file_sha256
+from .util import atomic_to_csv, exclusive_lock, reserve_file
+
+PLATE_SIZE = PLATE_384.n_wells
 
-ROWS = string.ascii_uppercase[:16]
-COLS = range(1, 25)
+ROWS = ''.join(PLATE_384.row_names)
+COLS = range(1, PLATE_384.n_columns + 1)
 
 ROUND_VOLUME_TO = 0.5
 
-DESTINATIONS = [f'{row}{col}' for row in ROWS for col in COLS]
+DESTINATIONS = list(PLATE_384.well_names)
+
+# Hidden files of an output folder: the lock of its manifest, and a folder of
+# the pick list numbers taken
+MANIFEST_LOCK = '.aggregate_manifest.lock'
+RESERVED_NUMBERS = '.picklist_numbers'
+
+# Destination plates pick lists can be packed for
+plate_size_option = click.option(
+    '--plate-size', default=str(PLATE_SIZE),
+    type=click.Choice([str(n_wells) for n_wells in GEOMETRIES]),
+    callback=lambda ctx, param, value: geometry_of(value),
+    help='Number of wells of the destination plates, so the number of '
+         'samples in each pick list')
 
-DESIRED_CONCENTRATION = 0.3 #ng/ul
+PACKINGS = ('in-order', 'fewest-sources')
 
-FINALVOLUME = 400
+# How samples are assigned to pick lists
+packing_option = click.option(
+    '--packing', default='in-order', type=click.Choice(PACKINGS),
+    help='"in-order" fills pick lists with samples in the order the files '
+         'are given. "fewest-sources" packs whole source plates together so '
+         'each pick list draws from as few source plates as it can, to cut '
+         'plate swaps on the Echo')
 
 COLUMNS = ['Source well',
  'Plate number',
@@ -41,7 +74,7 @@ def echo_picklist_number(filename):
         number_and_extension = filename.split("_")[2]
         number = number_and_extension.split(".")[0]
         if number.isdigit():
-            return number.strip("0")
+            return str(int(number))
         else:
             return False
     return False
@@ -51,6 +84,9 @@ def largest_enumeration_in_outputfolder(output_folder):
     maximum_number = 0
     numbers = []
     for f in os.listdir(output_folder):
+        if f == MANIFEST or f.startswith('.') \
+                or os.path.isdir(os.path.join(output_folder, f)):
+            continue
         num = echo_picklist_number(f)
         if num:
             numbers.append(int(num))
@@ -78,79 +114,249 @@ def round_partial(value, resolution):
 @click.option('--output-folder', default='.',
               help="Folder to output the aggregated files to",
               type=click.Path(dir_okay=True, writable=True))
-def aggregate(filenames, incomplete_echopicklists_folder, output_folder):
+@click.option('--manifest/--no-manifest', default=True,
+              help="Keep track of the files already packed into the output "
+                   "folder in a manifest, so reruns only pack new files and "
+                   "top up the last incomplete pick list")
+@click.option('--echo-folder', default=None,
+              type=click.Path(dir_okay=True, file_okay=False, writable=True),
+              help="If given, also write an Echo transfer list of each pick "
+                   "list to this folder")
+@plate_size_option
+@packing_option
+@click.option('--prefetch', default=0, type=click.IntRange(min=0),
+              help="Read and hash up to twice this many input files ahead in "
+                   "as many threads, and write pick lists in a background "
+                   "thread, e.g. 8 for folders on a network drive. 0 does one "
+                   "thing at a time")
+@echo_options
+@metrics.metrics_options
+def aggregate(filenames, incomplete_echopicklists_folder, output_folder,
+              manifest=True, echo_folder=None, desired_concentration=None,
+              plate_size=PLATE_384, packing='in-order', prefetch=0,
+              **echo_kwargs):
     """Glue together cherrypick files by 384 samples for an ECHO pick list
 
+    Use --plate-size to pack 96 or 1536 samples per pick list instead, and
+    --packing fewest-sources to keep the samples of each source plate
+    together in as few pick lists as possible. Each file is taken to be one
+    source plate.
+
     \b
     Parameters
     ----------
     filenames : str
-        Tidy files created by "dobby cherrypick" to aggregate
+        Tidy files created by "dobby cherrypick" to aggregate, as CSV,
+        parquet or feather
     """
+    if desired_concentration is None:
+        desired_concentration = DESIRED_CONCENTRATION
+
     if not os.path.exists(output_folder):
         # dobby aggregate test/aggregate_input/* --output-folder test/aggregate_output/ --incomplete-echopicklists test/incomplete_input_aggregate/*
         os.makedirs(output_folder)
 
     plate_num = largest_enumeration_in_outputfolder(output_folder) + 1
-    cherrypick_file_start = 0
-    starting_dataframe = pd.DataFrame()
-    left_over_dataframe = pd.DataFrame()
 
+    incomplete_echopicklist_files = []
     if incomplete_echopicklists_folder:
-        incomplete_echopiclist_files = file_rel_paths(incomplete_echopicklists_folder)
-
-        incomplete_echopicklist_dataframes = dataframe_generator(incomplete_echopiclist_files)
-        incomplete_echopicklist_dataframes_ofsize = dataframes_ofsize_generator(incomplete_echopicklist_dataframes, PLATE_SIZE)
-        for echopicklist_dataframe_ofsize, is_lessthan_desired_size, files_used, left_over_dataframe in incomplete_echopicklist_dataframes_ofsize:
-            if not is_lessthan_desired_size:
-                write_csv_from_dataframe(echopicklist_dataframe_ofsize, plate_num, output_folder, is_lessthan_desired_size)
-                plate_num +=1
-                return # all concatenated incomplete echopicklists make
-
-        # if there is an echopick list that is not the full size
-        incomplete_echopicklist = echopicklist_dataframe_ofsize
-        rows_to_complete = PLATE_SIZE - incomplete_echopicklist.shape[0]
-
-        # complete incomplete echopicklist with cherrypicklists
-        dataframes = dataframe_generator(filenames[cherrypick_file_start:], should_sort=True)
-        dataframes_ofsize = dataframes_ofsize_generator(dataframes, rows_to_complete, starting_dataframe)
-        dataframe, is_lessthan_desired_size, files_used, left_over_dataframe = next(dataframes_ofsize)
-        is_lessthan_desired_size = True
-        formatted_echopick_list = format_echopicklist(
-            dataframe,
-            is_lessthan_desired_size)
-
-        complete = pd.concat([incomplete_echopicklist, formatted_echopick_list])
-        cherrypick_file_start = files_used
-        #make csv file
-        write_csv_from_dataframe(complete, plate_num, output_folder)
-        #increment the plate_num
-        plate_num +=1
-
-        if files_used == len(filenames) and left_over_dataframe.shape[0] > 0:
-            is_lessthan_desired_size = True
+        incomplete_echopicklist_files = file_rel_paths(
+            incomplete_echopicklists_folder)
+
+    # Runs sharing an output folder's manifest take turns, so that each
+    # sees what the others packed
+    lock = exclusive_lock(os.path.join(output_folder, MANIFEST_LOCK)) \
+        if manifest else contextlib.nullcontext()
+    with lock:
+        packed = AggregateManifest(output_folder) if manifest else None
+        files = incomplete_echopicklist_files + list(filenames)
+        sources = []
+        digests = _prefetched(_hash_input if manifest else lambda f: None,
+                              files, prefetch)
+        for f, digest in zip(files, digests):
+            skip_reason = packed.check(f, digest) if manifest else None
+            if skip_reason is not None:
+                print(f'Skipping {f}: {skip_reason}')
+                continue
+            sources.append((f, digest))
+        if manifest and not sources:
+            print('No new files to aggregate')
+            return
+
+        def read_input(f):
+            with metrics.timer('read_inputs'):
+                if f in incomplete_echopicklist_files:
+                    table = unformat_echopicklist(pd.read_csv(f))
+                elif columnar.format_of(f) in columnar.COLUMNAR_FORMATS:
+                    # Already sorted
+                    table = columnar.read_tidy_columnar(f)
+                else:
+                    table = read_tidy_csv(f, should_sort=True)
+            metrics.count('files_read')
+            return table
+
+        def tables():
+            # Rows of incomplete pick lists go first, so they are topped up by
+            # the new cherrypicked files
+            if manifest and packed.open_plate is not None:
+                open_plate = packed.open_plate_columns(TIDY_NUMERIC_COLUMNS)
+                yield _with_source(open_plate, -1)
+            read = _prefetched(read_input, [f for f, _ in sources], prefetch)
+            for i, table in enumerate(read):
+                yield _with_source(table, i)
+
+        def write(dataframe, number, is_lessthan_desired_size):
             formatted_echopick_list = format_echopicklist(
-                left_over_dataframe,
-                is_lessthan_desired_size)
+                dataframe,
+                is_lessthan_desired_size,
+                desired_concentration,
+                plate_size)
+
+            write_csv_from_dataframe(formatted_echopick_list, number, output_folder, is_lessthan_desired_size)
+            # The pick list itself keeps its number taken from now on
+            release_picklist_numbers(output_folder, [number])
+            if echo_folder is not None:
+                os.makedirs(echo_folder, exist_ok=True)
+                write_echo_transfers(
+                    formatted_echopick_list,
+                    picklist_filename(number, output_folder, is_lessthan_desired_size),
+                    echo_folder, **echo_kwargs)
+                incomplete_echo = echo_filename(
+                    picklist_filename(number, output_folder, True), echo_folder)
+                if not is_lessthan_desired_size and os.path.exists(incomplete_echo):
+                    os.remove(incomplete_echo)
+
+            if manifest:
+                incomplete_csv = picklist_filename(number, output_folder, True)
+                if not is_lessthan_desired_size and os.path.exists(incomplete_csv):
+                    os.remove(incomplete_csv)
+
+                open_plate = None
+                if is_lessthan_desired_size:
+                    open_plate = dataframe.drop(columns=SOURCE_COLUMN)
+                with metrics.timer('save_manifest'):
+                    packed.add_picklist(
+                        number, [sources[i] for i in
+                                 np.unique(dataframe[SOURCE_COLUMN]) if i >= 0],
+                        open_plate)
+
+        open_plate_num = None
+        if manifest and packed.open_plate is not None:
+            open_plate_num = packed.open_plate['number']
+
+        if packing == 'fewest-sources':
+            first = 0 if open_plate_num is not None else None
+            dataframes_ofsize = dataframes_packed_generator(
+                tables(), plate_size.n_wells, first)
+        else:
+            dataframes_ofsize = dataframes_ofsize_generator(tables(),
+                                                            plate_size.n_wells)
+        reserved = []
+        try:
+            with _Writer(prefetch) as writer:
+                for dataframe, is_lessthan_desired_size, _, _ in \
+                        dataframes_ofsize:
+                    if open_plate_num is not None:
+                        # Top up the incomplete pick list under its own number
+                        number, open_plate_num = open_plate_num, None
+                    else:
+                        # The next number no other run has taken
+                        number = reserve_picklist_number(output_folder,
+                                                         plate_num)
+                        reserved.append(number)
+                        plate_num = number + 1
+                    writer.submit(write, dataframe, number,
+                                  is_lessthan_desired_size)
+        except BaseException:
+            release_picklist_numbers(output_folder, reserved)
+            raise
+
+        if manifest:
+            # Files without any rows are done too
+            for f, digest in sources:
+                packed.record(f, digest)
+            with metrics.timer('save_manifest'):
+                packed.save()
+
+
+def _hash_input(filename):
+    with metrics.timer('hash_inputs'):
+        return file_sha256(filename)
+
+
+def _prefetched(function, items, n_threads):
+    """Results of ``function`` on each item, in order, computed up to
+    ``2 * n_threads`` items ahead in threads, or in turn if ``n_threads`` is 0
+
+    Reading and hashing files mostly waits on the disk or the network, so
+    they overlap well in threads.
+    """
+    if n_threads <= 0:
+        yield from map(function, items)
+        return
+    with concurrent.futures.ThreadPoolExecutor(n_threads) as executor:
+        pending = collections.deque()
+        items = iter(items)
+        for item in itertools.islice(items, 2 * n_threads):
+            pending.append(executor.submit(function, item))
+        while pending:
+            result = pending.popleft().result()
+            for item in itertools.islice(items, 1):
+                pending.append(executor.submit(function, item))
+            yield result
+
+
+class _Writer:
+    """Write pick lists in a background thread, one after the other
+
+    Pick lists are written in the order they are submitted, so that the
+    manifest always records them in turn. At most ``n_pending`` are waiting
+    to be written, which bounds the memory they take. With ``n_pending`` of
+    0, they are written as they are submitted.
+    """
+
+    def __init__(self, n_pending):
+        self.n_pending = n_pending
+        self.pending = collections.deque()
+        self.executor = None
+        if n_pending > 0:
+            self.executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    def submit(self, function, *args):
+        if self.executor is None:
+            function(*args)
+            return
+        while len(self.pending) >= self.n_pending:
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(function, *args))
+
+    def __enter__(self):
+        return self
 
-            #make csv file
-            write_csv_from_dataframe(formatted_echopick_list, plate_num, output_folder, is_lessthan_desired_size)
+    def __exit__(self, *exc_info):
+        if self.executor is None:
             return
+        if exc_info[0] is not None:
+            for future in self.pending:
+                future.cancel()
+        self.executor.shutdown(wait=True)
+        if exc_info[0] is None:
+            # Raise the first error of a write
+            for future in self.pending:
+                future.result()
 
 
-    dataframes = dataframe_generator(filenames[cherrypick_file_start:], should_sort=True)
-    if not left_over_dataframe.empty:
-        starting_dataframe = left_over_dataframe
-    dataframes_ofsize = dataframes_ofsize_generator(dataframes, PLATE_SIZE, starting_dataframe)
+# Column tracking which input each packed row came from
+SOURCE_COLUMN = '_source'
 
-    for dataframe, is_lessthan_desired_size, files_used, left_over_dataframe in dataframes_ofsize:
-        formatted_echopick_list = format_echopicklist(
-            dataframe,
-            is_lessthan_desired_size)
 
-        write_csv_from_dataframe(formatted_echopick_list, plate_num, output_folder, is_lessthan_desired_size)
-        # Increment the plate number
-        plate_num += 1
+def _with_source(table, source):
+    """Add the index of the input file to every row of a table"""
+    columns = dict(_as_columns(table))
+    n_rows = len(next(iter(columns.values()), ()))
+    columns[SOURCE_COLUMN] = np.full(n_rows, source)
+    return columns
+
 
 def dataframe_generator(files, should_sort=False):
     for f in files:
@@ -161,55 +367,297 @@ def dataframe_generator(files, should_sort=False):
             yield data_frame
 
 
+# Columns of the tidy cherrypicked tables that are numbers. All others are
+# kept as the strings they are in the file
+TIDY_NUMERIC_COLUMNS = {'column_number': np.int64,
+                        'concentration': np.float64}
+
+
+def read_tidy_csv(filename, should_sort=False):
+    """Read a tidy table written by "dobby cherrypick" into numpy columns
+
+    Lighter than pandas.read_csv for the many small files aggregate reads.
+
+    Returns
+    -------
+    columns : dict
+        Mapping of each column name to a numpy array of its values
+    """
+    with open(filename, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+
+    if should_sort:
+        row_letter = header.index('row_letter')
+        column_number = header.index('column_number')
+        rows.sort(key=lambda row: (row[row_letter], int(row[column_number])))
+
+    values = zip(*rows) if rows else [()] * len(header)
+    columns = {}
+    for name, column in zip(header, values):
+        dtype = TIDY_NUMERIC_COLUMNS.get(name, object)
+        columns[name] = np.array(column, dtype=object).astype(dtype)
+    return columns
+
+
+def tidy_csv_generator(files, should_sort=False):
+    for f in files:
+        yield read_tidy_csv(f, should_sort)
+
+
 def file_rel_paths(directory):
     rel_paths = []
     for f in os.listdir(directory):
+        if f == MANIFEST or f.startswith('.'):
+            continue
         rel_paths.append(os.path.join(directory, f))
     return rel_paths
 
 
+def _as_columns(table):
+    """Numpy columns of a DataFrame, or of an already read table"""
+    if isinstance(table, pd.DataFrame):
+        return {name: table[name].to_numpy() for name in table.columns}
+    return table
+
+
+def _buffer_dtype(*dtypes):
+    """Numeric columns keep their dtype, anything else is stored as objects"""
+    if all(dtype.kind in 'biuf' for dtype in dtypes):
+        return np.result_type(*dtypes)
+    return np.dtype(object)
+
+
+class _PlateBuffers:
+    """Preallocated columns for the rows of one pick list
+
+    Rows are copied in from tables of numpy columns with :meth:`fill` until
+    ``size`` rows are filled, and :meth:`flush` hands the columns over as a
+    DataFrame and starts a new set of buffers.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.names = None
+        self.columns = None
+        self.n_filled = 0
+
+    def _allocate(self, columns):
+        if self.names is None:
+            self.names = list(columns)
+        self.columns = {name: np.empty(self.size,
+                                       dtype=_buffer_dtype(columns[name].dtype))
+                        for name in self.names}
+
+    def fill(self, columns, start=0):
+        """Copy rows from ``start`` until the buffers are full
+
+        Returns
+        -------
+        n_copied : int
+            Number of rows copied into the buffers
+        """
+        if self.n_filled == 0:
+            self._allocate(columns)
+        n_rows = len(columns[self.names[0]])
+        n_copied = min(self.size - self.n_filled, n_rows - start)
+        end = self.n_filled + n_copied
+        for name, buffer in self.columns.items():
+            if name in columns:
+                values = columns[name][start:start + n_copied]
+            else:
+                values = np.full(n_copied, None, dtype=object)
+            if not np.can_cast(values.dtype, buffer.dtype, 'same_kind'):
+                buffer = buffer.astype(_buffer_dtype(values.dtype,
+                                                     buffer.dtype))
+                self.columns[name] = buffer
+            buffer[self.n_filled:end] = values
+        self.n_filled = end
+        return n_copied
+
+    @property
+    def is_full(self):
+        return self.n_filled == self.size
+
+    def flush(self):
+        filled = pd.DataFrame({name: buffer[:self.n_filled]
+                               for name, buffer in self.columns.items()})
+        self.n_filled = 0
+        return filled
+
+
 def dataframes_ofsize_generator(dataframes_generator, desired_size, starting_dataframe=None):
-    dataframes_used = 0
-    aggregated = pd.DataFrame()
-    if starting_dataframe is not None:
-        aggregated = starting_dataframe
-
-    for dataframe in dataframes_generator:
-        dataframes_used +=1
-        rows_filled = aggregated.shape[0]
-        end_row_index = desired_size - rows_filled
-        add_now = dataframe.iloc[:end_row_index]
-        add_next_time = dataframe.iloc[end_row_index:]
-        aggregated = pd.concat([aggregated, add_now])
-        is_complete_platesize = aggregated.shape[0] == desired_size
-        if is_complete_platesize:
-            is_lessthan_desired_size = not is_complete_platesize
-            yield aggregated, is_lessthan_desired_size, dataframes_used, add_next_time
-
-            aggregated = add_next_time
-
-    if aggregated.shape[0] > 0:
-        is_lessthan_desired_size = True
-        yield aggregated, is_lessthan_desired_size, dataframes_used, add_next_time
+    """Pack tidy tables, in order, into tables of ``desired_size`` rows
 
+    Rows are streamed into preallocated buffers, so every row is copied once
+    and only one pick list's worth of rows is held at a time, no matter how
+    many tables there are.
 
-def write_csv_from_dataframe(dataframe, plate_num, output_folder, is_incomplete_plate=False):
-    #generate_file
+    Parameters
+    ----------
+    dataframes_generator : iterable
+        Tidy tables, either as DataFrames or as dicts of numpy columns (e.g.
+        from :func:`tidy_csv_generator`)
+    desired_size : int
+        Number of rows of each packed table
+    starting_dataframe : pandas.DataFrame, optional
+        Rows to start the first packed table with
+
+    Yields
+    ------
+    aggregated : pandas.DataFrame
+        ``desired_size`` rows, or fewer for the last one
+    is_lessthan_desired_size : bool
+        True for the last, partially filled table
+    dataframes_used : int
+        Number of tables from ``dataframes_generator`` read so far
+    left_over : pandas.DataFrame
+        Rows of the last table read that didn't fit and start the next one
+    """
+    if starting_dataframe is not None and not starting_dataframe.empty:
+        dataframes_generator = itertools.chain([starting_dataframe],
+                                               dataframes_generator)
+        dataframes_used = -1
+    else:
+        dataframes_used = 0
+
+    buffers = _PlateBuffers(desired_size)
+    for table in dataframes_generator:
+        dataframes_used += 1
+        columns = _as_columns(table)
+        n_rows = len(next(iter(columns.values()), ()))
+        start = 0
+        while start < n_rows:
+            start += buffers.fill(columns, start)
+            if buffers.is_full:
+                left_over = pd.DataFrame({name: values[start:] for name, values
+                                          in columns.items()})
+                yield buffers.flush(), False, dataframes_used, left_over
+
+    if buffers.n_filled > 0:
+        yield buffers.flush(), True, dataframes_used, pd.DataFrame()
+
+
+def dataframes_packed_generator(dataframes_generator, desired_size,
+                                first=None):
+    """Pack tidy tables into tables of ``desired_size`` rows, keeping the
+    rows of each table in as few packed tables as possible
+
+    Unlike :func:`dataframes_ofsize_generator`, every table is read before
+    the first packed table is made, as the plan of
+    :func:`dobby.packing.plan_plates` needs all their sizes. Rows of a table
+    stay in order.
+
+    Parameters
+    ----------
+    dataframes_generator : iterable
+        Tidy tables, each the samples of one source plate, either as
+        DataFrames or as dicts of numpy columns
+    desired_size : int
+        Number of rows of each packed table
+    first : int, optional
+        Table to start the first packed table with, e.g. the rows of an
+        incomplete pick list being topped up
+
+    Yields
+    ------
+    Same as :func:`dataframes_ofsize_generator`, with all tables used and
+    no rows left over
+    """
+    tables = [_as_columns(table) for table in dataframes_generator]
+    sizes = [len(next(iter(columns.values()), ())) for columns in tables]
+    with metrics.timer('plan_packing'):
+        plan = packing.plan_plates(sizes, desired_size, first)
+
+    buffers = _PlateBuffers(desired_size)
+    for i, plate in enumerate(plan):
+        for source, start, stop in plate:
+            buffers.fill({name: values[start:stop]
+                          for name, values in tables[source].items()})
+        is_lessthan_desired_size = not buffers.is_full
+        yield buffers.flush(), is_lessthan_desired_size, len(tables), \
+            pd.DataFrame()
+
+
+def picklist_filename(plate_num, output_folder, is_incomplete_plate=False):
     basename = 'echo_picklist_{}.csv'.format(str(plate_num).zfill(5))
     if is_incomplete_plate:
         basename = 'echo_picklist_{}_incomplete.csv'.format(str(plate_num).zfill(5))
-    csv = os.path.join(output_folder, basename)
-    dataframe.to_csv(csv, index=False)
+    return os.path.join(output_folder, basename)
+
+
+def _picklist_written(number, output_folder):
+    return any(os.path.exists(picklist_filename(number, output_folder,
+                                                is_incomplete))
+               for is_incomplete in (False, True))
+
+
+def reserve_picklist_number(output_folder, number):
+    """Take the first pick list number from ``number`` on for this run
+
+    Each number is reserved by creating a file named after it with
+    exclusive create, so runs writing into the same output folder at the
+    same time, even from other hosts, never write the same pick list.
+    Numbers of pick lists already in the folder are skipped too, checked
+    once the number is reserved, as a run removes its reservation only
+    after its pick list is in place.
+
+    Returns
+    -------
+    number : int
+        The reserved number
+    """
+    folder = os.path.join(output_folder, RESERVED_NUMBERS)
+    os.makedirs(folder, exist_ok=True)
+    while True:
+        reservation = os.path.join(folder, str(number).zfill(5))
+        if reserve_file(reservation):
+            if not _picklist_written(number, output_folder):
+                return number
+            os.remove(reservation)
+        number += 1
+
+
+def release_picklist_numbers(output_folder, numbers):
+    """Remove the reservations of numbers once their pick lists are written,
+    or give them back to the next run if writing them failed"""
+    for number in numbers:
+        reservation = os.path.join(output_folder, RESERVED_NUMBERS,
+                                   str(number).zfill(5))
+        if os.path.exists(reservation):
+            os.remove(reservation)
+
+
+def write_csv_from_dataframe(dataframe, plate_num, output_folder, is_incomplete_plate=False):
+    #generate_file
+    csv = picklist_filename(plate_num, output_folder, is_incomplete_plate)
+    with metrics.timer('write_picklist'):
+        atomic_to_csv(dataframe, csv, index=False)
+    metrics.count('picklists_written')
+    if 'Plate number' in dataframe:
+        metrics.count('source_plates', dataframe['Plate number'].nunique())
+    metrics.count('rows_packed', len(dataframe))
+
+
+def unformat_echopicklist(echopicklist):
+    """Turn a formatted ECHO pick list back into a tidy cherrypicked table"""
+    return echopicklist.rename(columns={
+        "Source well": "well", 'C(ng/ul)': 'concentration',
+        'Plate number': 'plate', "Name": 'name'})[
+        ['well', 'concentration', 'plate', 'name']]
 
 
+@metrics.timer('format_picklist')
 def format_echopicklist(
         aggregated,
-        is_incomplete_plate=False):
-    mass = DESIRED_CONCENTRATION * FINALVOLUME
+        is_incomplete_plate=False,
+        desired_concentration=DESIRED_CONCENTRATION,
+        geometry=PLATE_384):
     aggregated = aggregated.rename(
      columns={"well": "Source well", 'concentration': 'C(ng/ul)',
               'plate': 'Plate number', 'name': "Name", })
-    aggregated['Desired C'] = DESIRED_CONCENTRATION
+    aggregated['Desired C'] = desired_concentration
     aggregated['Final V'] = FINALVOLUME
     aggregated["Verdict"] = 1
     aggregated['Type'] = 'Unknown'
@@ -219,19 +667,20 @@ def format_echopicklist(
 
     # In case the sample volume is bigger than the final volume, take
     # the minimum
-    aggregated['Sample V'] = aggregated['C(ng/ul)'].map(
-     lambda x: min(mass/x, FINALVOLUME))
+    aggregated['Sample V'] = sample_volumes(aggregated['C(ng/ul)'],
+                                            desired_concentration, FINALVOLUME)
     aggregated['Buffer V'] = FINALVOLUME - aggregated['Sample V']
 
-    aggregated['Rounded Sample V'] = aggregated['Sample V'].map(
-     lambda x: round_partial(x, ROUND_VOLUME_TO))
+    aggregated['Rounded Sample V'] = quantize(aggregated['Sample V'],
+                                              ROUND_VOLUME_TO)
     aggregated['Rounded Buffer V'] = FINALVOLUME - \
                                   aggregated['Rounded Sample V']
 
-    well_names = DESTINATIONS
+    # Wells in row-major order, from the geometry's lookup table
+    well_names = geometry.well_names
     if is_incomplete_plate:
         last_index = len(aggregated['Rounded Buffer V'])
-        well_names = DESTINATIONS[:last_index]
+        well_names = geometry.well_names[:last_index]
 
     aggregated['Destination well'] = well_names
     # Reorder the columns
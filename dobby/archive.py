@@ -0,0 +1,297 @@
+"""Archive of every processed plate, memory-mapped for whole-project analyses
+
+An archive is a folder holding the raw fluorescence, the concentrations and
+the standard curve fit of every plate as flat binary arrays, one plate after
+the other, and an index of the plates in ``index.json``::
+
+    archive/
+        index.json            plate name, mouse ID, source file and SHA-256
+                              of the source of each plate, in order
+        fluorescence.f8       (n_plates, 16, 24) float64
+        concentrations.f8     (n_plates, 16, 24) float64
+        fits.f8               (n_plates, 3) float64 slope, intercept, rvalue
+
+Opening an archive maps the arrays into memory instead of reading them, so
+looking at a few plates, or one well of every plate, only reads those bytes
+from disk. New plates are appended to the end of the arrays, and the index is
+written last, so an interrupted append leaves the archive as it was.
+"""
+import json
+import os
+import warnings
+
+import numpy as np
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import pandas as pd
+
+import click
+
+from . import platereader, platestack
+from .cherrypick import (STANDARDS_COL, STANDARDS_STR, _filename_to_plate_name,
+                         _find_plate_files)
+from .manifest import file_sha256
+from .util import atomic_open
+
+INDEX = 'index.json'
+PLATE_ARRAYS = ('fluorescence', 'concentrations')
+FITS = 'fits'
+FIT_COLUMNS = ('slope', 'intercept', 'rvalue')
+DTYPE = np.dtype(np.float64)
+INDEX_COLUMNS = ('plate', 'mouse_id', 'source', 'sha256')
+
+# Plates read and analyzed at once when archiving plate reader exports
+CHUNK_SIZE = 500
+
+
+class PlateArchive:
+    """Fluorescence, concentrations and fits of many plates, memory-mapped
+
+    Parameters
+    ----------
+    folder : str
+        Folder of the archive. It is created if it doesn't exist
+    shape : tuple of int
+        Rows and columns of the plates of a new archive
+    """
+
+    def __init__(self, folder, shape=(platereader.N_ROWS,
+                                      platereader.N_COLUMNS)):
+        self.folder = folder
+        self.index_path = os.path.join(folder, INDEX)
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.shape = tuple(index['shape'])
+            self.plates = index['plates']
+        else:
+            os.makedirs(folder, exist_ok=True)
+            self.shape = tuple(shape)
+            self.plates = []
+        self._positions = {plate['plate']: i
+                           for i, plate in enumerate(self.plates)}
+
+    def __len__(self):
+        return len(self.plates)
+
+    def __contains__(self, plate_name):
+        return plate_name in self._positions
+
+    @property
+    def names(self):
+        return [plate['plate'] for plate in self.plates]
+
+    @property
+    def index(self):
+        """The plates of the archive, as a DataFrame indexed by plate name"""
+        return pd.DataFrame(self.plates,
+                            columns=INDEX_COLUMNS).set_index('plate')
+
+    def _path(self, name):
+        return os.path.join(self.folder, f'{name}.f8')
+
+    def _item_shape(self, name):
+        return (len(FIT_COLUMNS),) if name == FITS else self.shape
+
+    def _map(self, name, mode='r'):
+        shape = (len(self),) + self._item_shape(name)
+        if len(self) == 0:
+            return np.empty(shape, dtype=DTYPE)
+        return np.memmap(self._path(name), dtype=DTYPE, mode=mode,
+                         shape=shape)
+
+    @property
+    def fluorescence(self):
+        """(n_plates, n_rows, n_columns) read-only memory map"""
+        return self._map('fluorescence')
+
+    @property
+    def concentrations(self):
+        """(n_plates, n_rows, n_columns) read-only memory map"""
+        return self._map('concentrations')
+
+    @property
+    def fits(self):
+        """(n_plates, 3) read-only memory map of the slope, intercept and
+        correlation of each plate's standard curve"""
+        return self._map(FITS)
+
+    def positions(self, plate_names):
+        """Positions of plates in the arrays, to index them with
+
+        Raises
+        ------
+        KeyError
+            If a plate isn't in the archive
+        """
+        return np.array([self._positions[name] for name in plate_names],
+                        dtype=np.intp)
+
+    def sha256(self, plate_name):
+        """SHA-256 of the file a plate was archived from, or None"""
+        if plate_name not in self:
+            return None
+        return self.plates[self._positions[plate_name]]['sha256']
+
+    def add(self, plate_names, fluorescence, concentrations, fits,
+            mouse_ids=None, sources=None, digests=None):
+        """Add plates, replacing those already in the archive
+
+        Parameters
+        ----------
+        plate_names : list of str
+        fluorescence, concentrations : numpy.ndarray
+            (n_plates, n_rows, n_columns) arrays
+        fits : numpy.ndarray
+            (n_plates, 3) slope, intercept and correlation of each plate
+        mouse_ids, sources, digests : list of str, optional
+            Mouse ID, source file and SHA-256 of the source of each plate
+        """
+        n = len(plate_names)
+        arrays = {'fluorescence': fluorescence,
+                  'concentrations': concentrations, FITS: fits}
+        for name, values in arrays.items():
+            if np.shape(values) != (n,) + self._item_shape(name):
+                raise ValueError(f'{name} has shape {np.shape(values)}, not '
+                                 f'{(n,) + self._item_shape(name)}')
+        mouse_ids = [None] * n if mouse_ids is None else mouse_ids
+        sources = [None] * n if sources is None else sources
+        digests = [None] * n if digests is None else digests
+
+        replaced = [i for i, name in enumerate(plate_names) if name in self]
+        appended = [i for i, name in enumerate(plate_names)
+                    if name not in self]
+        # Later duplicates replace earlier ones, as if added one by one
+        seen = {}
+        for i in appended:
+            seen[plate_names[i]] = i
+        appended = sorted(seen.values())
+
+        if replaced:
+            positions = self.positions([plate_names[i] for i in replaced])
+            for name, values in arrays.items():
+                mapped = self._map(name, mode='r+')
+                mapped[positions] = np.asarray(values, dtype=DTYPE)[replaced]
+                mapped.flush()
+                del mapped
+
+        if appended:
+            for name, values in arrays.items():
+                item_bytes = DTYPE.itemsize * int(np.prod(
+                    self._item_shape(name)))
+                with open(self._path(name), 'ab') as f:
+                    # Leave out anything an interrupted append left behind
+                    f.truncate(len(self) * item_bytes)
+                    f.write(np.ascontiguousarray(
+                        np.asarray(values, dtype=DTYPE)[appended]).tobytes())
+
+        for i in replaced + appended:
+            plate = dict(plate=plate_names[i], mouse_id=_plain(mouse_ids[i]),
+                         source=sources[i], sha256=digests[i])
+            if plate_names[i] in self:
+                self.plates[self._positions[plate_names[i]]] = plate
+            else:
+                self._positions[plate_names[i]] = len(self.plates)
+                self.plates.append(plate)
+        self._save()
+
+    def _save(self):
+        with atomic_open(self.index_path) as f:
+            json.dump(dict(shape=list(self.shape), plates=self.plates), f,
+                      indent=0)
+
+
+def _plain(value):
+    """Metadata values as JSON can store them"""
+    if value is None:
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+
+def archive_plates(archive, filenames, mouse_ids=None,
+                   standards=STANDARDS_STR, standards_col=STANDARDS_COL,
+                   inner=True, chunk_size=CHUNK_SIZE):
+    """Read, regress and archive plate reader exports, in chunks
+
+    Files already archived with the same contents are skipped
+
+    Returns
+    -------
+    n_added : int
+        Number of plates added or replaced
+    """
+    mouse_ids = {} if mouse_ids is None else mouse_ids
+    new = []
+    for filename in filenames:
+        digest = file_sha256(filename)
+        plate_name = _filename_to_plate_name(filename)
+        if archive.sha256(plate_name) != digest:
+            new.append((filename, plate_name, digest))
+
+    for start in range(0, len(new), chunk_size):
+        chunk = new[start:start + chunk_size]
+        fluorescence = platestack.read_plates([f for f, _, _ in chunk])
+        curves = platestack.fit_standard_curves(fluorescence, standards,
+                                                standards_col, inner)
+        concentrations = platestack.to_concentrations(fluorescence, curves)
+        fits = np.column_stack([curves.slope, curves.intercept,
+                                curves.rvalue])
+        names = [plate_name for _, plate_name, _ in chunk]
+        archive.add(names, fluorescence, concentrations, fits,
+                    mouse_ids=[mouse_ids.get(name) for name in names],
+                    sources=[os.path.abspath(f) for f, _, _ in chunk],
+                    digests=[digest for _, _, digest in chunk])
+    return len(new)
+
+
+@click.command(short_help="Add plate reader exports to a memory-mapped "
+                          "archive of fluorescence and concentrations")
+@click.argument('inputs', nargs=-1, required=True,
+                type=click.Path(exists=True, readable=True))
+@click.option('--archive', 'archive_folder', required=True,
+              type=click.Path(file_okay=False),
+              help='Folder of the archive. Created if it does not exist')
+@click.option('--metadata', default=None,
+              type=click.Path(dir_okay=False, readable=True),
+              help='CSV of plate metadata whose first column is the plate '
+                   'name, to record the mouse ID of each plate')
+@click.option('--mouse-id-col', default='mouse.id',
+              help='Column of the metadata containing the mouse ID')
+@click.option('--pattern', default='*.txt',
+              help='Pattern of plate reader files to use from folders given '
+                   'as inputs')
+@click.option('--standards', default=STANDARDS_STR,
+              help='Concentration of the standard in each row')
+@click.option('--standards-col', default=STANDARDS_COL, type=int,
+              help='Column containing concentration standards')
+@click.option('--inner-standards', default=True, type=bool)
+def archive(inputs, archive_folder, metadata, mouse_id_col, pattern,
+            standards, standards_col, inner_standards):
+    """Archive the fluorescence and concentrations of many plates
+
+    Example:
+    $ dobby archive raw_plate_reader_output/ --archive plates.archive
+
+    Plates already archived from the same file are skipped, and plates
+    archived from a file that has since changed are replaced. The archive
+    can then be opened with ``dobby.archive.PlateArchive``, which maps the
+    arrays of every plate into memory instead of reading them.
+
+    \b
+    Parameters
+    ----------
+    inputs : str
+        Plate reader files, or folders containing them. The plate name is
+        the filename up to the first "."
+    """
+    mouse_ids = None
+    if metadata is not None:
+        mouse_ids = pd.read_csv(metadata, index_col=0)[mouse_id_col].to_dict()
+    plates = PlateArchive(archive_folder)
+    filenames = _find_plate_files(inputs, pattern)
+    n_added = archive_plates(plates, filenames, mouse_ids,
+                             standards=standards, standards_col=standards_col,
+                             inner=inner_standards)
+    click.echo(f'Archived {n_added} plates, skipped {len(filenames) - n_added}'
+               f' unchanged. {archive_folder} has {len(plates)} plates')
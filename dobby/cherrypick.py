@@ -1,23 +1,20 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import glob
 import os
-import string
 import warnings
 import time
 
 import click
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from scipy.stats import linregress
-import seaborn as sns
 
-sns.set(context='paper')
-
-with warnings.catch_warnings():
-    warnings.simplefilter("ignore")
-    mpl.use('agg')
-
-from .util import maybe_make_directory
+from . import columnar, heatmap, metrics, platereader
+from .geometry import PLATE_1536, row_names
+from .flagrecords import FlagRecordStore, defer_exports, deferred_exports
+from .resultcache import ResultCache, cache_key
+from .util import atomic_path, maybe_make_directory
 
 N_EXTRA_LINES = 409
 COLUMNS_TO_PARSE = 'C:Z'
@@ -33,6 +30,8 @@ CONCENTRATIONS_MINIMUM = 0.7
 CONCENTRATIONS_MAXIMUM = 10
 R_MINIMUM = 0.98
 
+SANITY_CHECKS = ('regression', 'blanks', 'samples', 'concentration')
+
 FLAGGED = 'flagged'
 FLAG_FOLDER_PREFIX = 'flag'
 RECORD_FILE = 'record_plate_flagged_timestamp.csv'
@@ -40,62 +39,127 @@ RECORD_FILE = 'record_plate_flagged_timestamp.csv'
 
 def _parse_standards(standards_str):
     values = standards_str.split(',')
-    index = list(string.ascii_uppercase[:len(values)])
+    index = row_names(len(values))
     return pd.Series(values, index=index).astype(float)
 
 
-def _parse_fluorescence(filename, filetype):
+@metrics.timer('parse')
+def _parse_fluorescence(filename, filetype='auto'):
+    """Read the 384-well fluorescence of a plate reader export
+
+    Parameters
+    ----------
+    filename : str
+        Plate reader export
+    filetype : str
+        "excel", or "auto", "txt", "table" or "csv" for text exports, whose
+        encoding and delimiter are detected from the file itself
+
+    Returns
+    -------
+    fluorescence : pandas.DataFrame
+        (16, 24) table of fluorescence with row letters as the index and
+        column numbers as the columns
+    """
     filetype = filetype.lower()
 
-    kwargs = dict(skiprows=ROWS_TO_SKIP)
+    if filetype == 'auto':
+        encoding, _ = platereader.sniff_format(filename)
+        filetype = 'excel' if encoding is None else 'txt'
+
     if filetype == 'excel':
-        parser = pd.read_excel
-        kwargs.update(
-            dict(skip_footer=N_EXTRA_LINES, parse_cols=COLUMNS_TO_PARSE))
-    elif filetype == 'csv':
-        parser = pd.read_csv
-
-        # Use columns 1-24 (25 is not included)
-        kwargs['usecols'] = range(1, 25)
-        kwargs.update
-    elif filetype == 'txt' or filetype == 'table':
-        parser = pd.read_table
-        kwargs.update(dict(nrows=16, encoding='utf-16', skiprows=2,
-                           usecols=range(2, 26)))
-    else:
+        fluorescence = pd.read_excel(filename, skiprows=ROWS_TO_SKIP,
+                                     skipfooter=N_EXTRA_LINES,
+                                     usecols=COLUMNS_TO_PARSE)
+        fluorescence.columns = fluorescence.columns.astype(int)
+        fluorescence.index = row_names(len(fluorescence.index))
+        return fluorescence
+    elif filetype not in ('txt', 'table', 'csv'):
         raise ValueError(f"'{filetype}' is not a supported file type. "
-                         "Only 'csv' and 'excel' are supported")
-    fluorescence = parser(filename, **kwargs)
-    fluorescence.columns = fluorescence.columns.astype(int)
-    fluorescence.index = list(string.ascii_uppercase[:len(fluorescence.index)])
-    return fluorescence
-
-
-def _plot_regression(means, regressed, plate_name, output_folder='.'):
-    fig, ax = plt.subplots()
-    means.name = 'Means of standard concentrations'
-    y = pd.Series(regressed.slope * means.index + regressed.intercept,
-                  index=means.index,
-                  name='Regression')
-
-    ax.plot(means, 'o-', label=means.name)
-    ax.plot(y, 'o-', label=y.name)
+                         "Only 'auto', 'txt', 'csv' and 'excel' are "
+                         "supported")
+
+    values = platereader.read_plate(filename)
+    return pd.DataFrame(values, index=list(platereader.ROW_LETTERS),
+                        columns=range(1, platereader.N_COLUMNS + 1))
+
+
+@functools.lru_cache(maxsize=None)
+def _plotting():
+    """Import and set up matplotlib and seaborn when the first plot is drawn
+
+    They are slow to import, so runs that don't plot never pay for them.
+    """
+    import matplotlib as mpl
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        mpl.use('agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    sns.set(context='paper')
+    return plt, sns
+
+
+_REGRESSION_MARGINS = dict(left=0.1, right=0.97, bottom=0.08, top=0.92)
+
+
+@functools.lru_cache(maxsize=None)
+def _regression_figure():
+    """Figure of the regression plots, made once per process and redrawn
+    with the lines of each plate
+
+    Made without pyplot, so none are kept around by it, with margins fitting
+    its labels set once instead of laid out again for every plate.
+    """
+    _plotting()
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    fig.subplots_adjust(**_REGRESSION_MARGINS)
+    ax = fig.add_subplot()
+    means_line, = ax.plot([], [], 'o-',
+                          label='Means of standard concentrations')
+    regression_line, = ax.plot([], [], 'o-', label='Regression')
     ax.legend()
+    return fig, ax, means_line, regression_line
+
+
+def _plot_regression(means, regressed, plate_name, output_folder='.',
+                     plot_format='pdf', dpi=heatmap.DPI):
+    fig, ax, means_line, regression_line = _regression_figure()
+    x = means.index.to_numpy(dtype=np.float64)
+    means_line.set_data(x, means.to_numpy(dtype=np.float64))
+    regression_line.set_data(x, regressed.slope * x + regressed.intercept)
+    ax.relim()
+    ax.autoscale_view()
 
     # :.5 indicates 5 decimal places
-    plt.title(f'$R^2$ = {regressed.rvalue:.5}')
+    ax.set_title(f'$R^2$ = {regressed.rvalue:.5}')
 
-    pdf = os.path.join(output_folder, 'regression',
-                       f'{plate_name}_regression_lines.pdf')
+    pdf = _regression_path(output_folder, plate_name, plot_format)
     maybe_make_directory(pdf)
-    fig.savefig(pdf)
-    fig.tight_layout()
+    with atomic_path(pdf) as temporary:
+        fig.savefig(temporary, dpi=dpi)
     print(f'{plate_name}: Wrote regression plot to {pdf}')
     return pdf
 
 
+def _regression_path(output_folder, plate_name, plot_format='pdf'):
+    return os.path.join(output_folder, 'regression',
+                        f'{plate_name}_regression_lines.{plot_format}')
+
+
+def _heatmap_path(output_folder, datatype, plate_name, plot_format='pdf'):
+    return os.path.join(output_folder, datatype,
+                        f'{plate_name}_{datatype}_heatmap.{plot_format}')
+
+
 def _heatmap(data, plate_name, datatype, output_folder, title_suffix=None,
-             drop_standards=True, **kwargs):
+             drop_standards=True, plot_format='pdf', dpi=heatmap.DPI,
+             **kwargs):
     """Draw a heatmap of values
 
     Parameters
@@ -113,8 +177,12 @@ def _heatmap(data, plate_name, datatype, output_folder, title_suffix=None,
     drop_standards : bool
         If True, then remove the 24th column which contains standard
         concentrations for plotting
+    plot_format : str
+        "pdf" or "png"
+    dpi : int
+        Resolution of PNGs
     kwargs
-        Any other keyword arguments for seaborn.heatmap
+        "fmt", "vmin" and "vmax" of :meth:`dobby.heatmap.PlateHeatmap.draw`
 
     Returns
     -------
@@ -127,23 +195,25 @@ def _heatmap(data, plate_name, datatype, output_folder, title_suffix=None,
         no_standards = data
 
     title_suffix = '' if title_suffix is None else title_suffix
-    fig, ax = plt.subplots(figsize=(8, 4))
-    sns.heatmap(no_standards, annot=True, ax=ax, annot_kws={"size": 8},
-                **kwargs)
-    plt.title(f'{plate_name} {datatype}' + title_suffix)
-    pdf = os.path.join(output_folder, datatype,
-                       f'{plate_name}_{datatype}_heatmap.pdf')
+    # One figure per shape of plate is reused for every plate
+    plate_heatmap = heatmap.renderer(no_standards.shape)
+    plate_heatmap.draw(no_standards, f'{plate_name} {datatype}' + title_suffix,
+                       **kwargs)
+    pdf = _heatmap_path(output_folder, datatype, plate_name, plot_format)
     maybe_make_directory(pdf)
-    fig.tight_layout()
-    fig.savefig(pdf)
+    with atomic_path(pdf) as temporary:
+        plate_heatmap.save(temporary, dpi=dpi)
     print(f'{plate_name}: Wrote {datatype} heatmap to {pdf}')
     return pdf
 
 
+@metrics.timer('regress')
 def _fluorescence_to_concentration(fluorescence, standards_col, standards,
                                    output_folder='.', r_minimum=R_MINIMUM,
                                    inner=True):
     """Use standards column to regress and convert to concentrations"""
+    from scipy.stats import linregress
+
     standards = pd.Series(standards, index=fluorescence.index)
 
     means = fluorescence[standards_col].groupby(standards).mean()
@@ -162,40 +232,19 @@ def _fluorescence_to_concentration(fluorescence, standards_col, standards,
     return concentrations, means, regressed
 
 def record_flagged_plate_and_determine_folder(output_folder,platename):
-    record_file_dir = os.path.join(output_folder, FLAGGED)
-    record_file_path = os.path.join(record_file_dir, RECORD_FILE)
-    number_of_times_flagged = 1
-
-    #if file doesn't exist make file and add line record for platename
-    if not os.path.exists(record_file_path):
-
-        if not os.path.exists(record_file_dir):
-            os.makedirs(record_file_dir)
-
-        with open(record_file_path, 'w') as record_file:
-            record_file.write(platename + ',' + timestamp() + '\n')
-
-    else: #file does exist
-        with open(record_file_path, 'r') as record_file:
-            record = record_file.readlines()
-
-        plate_in_file = False
-        for index_line, line in enumerate(record):
-            line_to_process = line.rstrip().split(',')
-            if platename == line_to_process[0]:
-                line_to_process.append(timestamp())
-                line_updated = ','.join(line_to_process) + '\n'
-                plate_in_file = True
-                number_of_times_flagged = len(line_to_process) - 1
-                break
-
-        if plate_in_file:
-            record[index_line] = line_updated
-        else:
-            record.append(platename + ',' + timestamp() + '\n')
+    """Record that the plate was flagged and name its flag folder
 
-        with open(record_file_path, 'w') as record_file:
-            record_file.writelines( record )
+    The flags are kept in a :class:`dobby.flagrecords.FlagRecordStore` in
+    the "flagged" folder, which also writes them to ``RECORD_FILE``
+
+    Returns
+    -------
+    flagged_folder : str
+        "flag_N", where N is the number of times the plate has been flagged
+    """
+    record_file_dir = os.path.join(output_folder, FLAGGED)
+    store = FlagRecordStore(record_file_dir, csv=RECORD_FILE)
+    number_of_times_flagged = store.record(platename, timestamp())
 
     flagged_folder = '%s_%s' % (FLAG_FOLDER_PREFIX, str(number_of_times_flagged))
     return flagged_folder
@@ -203,19 +252,27 @@ def record_flagged_plate_and_determine_folder(output_folder,platename):
 def timestamp():
     return time.strftime('%Y-%m-%d %H:%M:%S')
 
-def _adjust_output_if_fail_sanity_check(concentrations, blanks_col,
-                                        good_cells, concentrations_minimum,
-                                        concentration_maximum,
-                                        regressed, r_minimum,
-                                        output_folder, platename, mouse_id):
+def _sanity_checks(concentrations, blanks_col, good_cells,
+                   concentrations_minimum, concentration_maximum,
+                   regressed, r_minimum):
+    """Whether the plate passes each of the sanity checks
+
+    Returns
+    -------
+    checks : tuple of bool
+        Passing the regression, blanks, samples and concentration checks
+    """
     pass_regression = _sanity_check_regression(regressed, r_minimum)
     pass_blanks = _sanity_check_blanks(concentrations, blanks_col)
     pass_samples = _sanity_check_samples(good_cells, concentrations_minimum)
     pass_concentration = _sanity_check_concentration(concentrations,
                                                      concentration_maximum)
 
-    checks = pass_regression, pass_blanks, pass_samples, pass_concentration
+    return pass_regression, pass_blanks, pass_samples, pass_concentration
+
 
+def _adjust_output_if_fail_sanity_check(checks, output_folder, platename,
+                                        mouse_id):
     if sum(checks) < len(checks):
         flag_folder = record_flagged_plate_and_determine_folder(output_folder, platename)
         return _append_flagged_output_folder(output_folder, flag_folder,
@@ -311,8 +368,7 @@ def _sanity_check_samples(good_cells, threshold=CONCENTRATIONS_MINIMUM):
     return pass_sanity_check
 
 
-def _get_good_cells(concentrations, blanks_col, plate_name, mouse_id,
-                    plot=True, output_folder='.'):
+def _get_good_cells(concentrations, blanks_col, plate_name, mouse_id):
     """Use blanks column to determine whether a well has enough fluorescence"""
 
     average_blanks = concentrations[blanks_col].mean()
@@ -330,39 +386,153 @@ def _get_good_cells(concentrations, blanks_col, plate_name, mouse_id,
     good_cells = concentrations[is_cell_good]
 
     without_standards_or_blanks = good_cells.loc[:, :(blanks_col - 1)]
-    if plot:
-        _heatmap(without_standards_or_blanks, plate_name,
-                 'concentrations_cherrypicked_no_standards_or_blanks',
-                 output_folder)
 
     #this is where I should also return the concentrations minus the blank
     return without_standards_or_blanks
 
 
-def _make_pick_list_filename(output_folder, datatype, plate_name):
-    csv = os.path.join(output_folder, datatype, f'{plate_name}_echo.csv')
-    maybe_make_directory(csv)
-    return csv
+def _render_plot(plot_job):
+    function, args, kwargs = plot_job
+    with metrics.timer(f'plot:{function.__name__.lstrip("_")}'):
+        return function(*args, **kwargs)
+
+
+def render_plots(plot_jobs, executor=None):
+    """Draw plots that were queued instead of drawn by :func:`main`
+
+    Parameters
+    ----------
+    plot_jobs : list of tuples
+        (function, args, kwargs) for each plot, as filled in by
+        ``main(..., plot_jobs=[])``
+    executor : concurrent.futures.Executor, optional
+        If given, submit the plots to this pool of (process) workers instead
+        of drawing them here
+
+    Returns
+    -------
+    pdfs : list
+        Filename of each plot, or a future of it if an executor was given
+    """
+    if executor is None:
+        return [_render_plot(plot_job) for plot_job in plot_jobs]
+    return [executor.submit(_render_plot, plot_job) for plot_job in plot_jobs]
+
+
+PICK_LISTS = ('cherrypicked', 'non_cherrypicked', 'minus_blanks')
+
+
+def _pick_list_path(output_folder, datatype, plate_name, fmt='csv'):
+    return os.path.join(output_folder, datatype,
+                        f'{plate_name}_echo{columnar.extension(fmt)}')
+
+
+def _make_pick_list_filename(output_folder, datatype, plate_name, fmt='csv'):
+    filename = _pick_list_path(output_folder, datatype, plate_name, fmt)
+    maybe_make_directory(filename)
+    return filename
+
+
+@functools.lru_cache(maxsize=None)
+def _well_names(row_letters, column_numbers):
+    """Well names of a plate, in the column-major order of unstacking it
+
+    Looked up in the largest plate, which names every well of smaller ones
+    """
+    rows = PLATE_1536.row_positions(row_letters)
+    columns = np.asarray(column_numbers) - 1
+    wells = PLATE_1536.well_index(np.tile(rows, len(columns)),
+                                  np.repeat(columns, len(rows)))
+    return PLATE_1536.names(wells)
+
+
+def _tidy_plate(data, plate_name, mouse_id):
+    """Convert 2d matrix into tall, tidy dataframe with one row per well
+
+    Equivalent to ``data.unstack().reset_index()`` plus the well and sample
+    names, but built from whole columns at once. Empty wells are kept as NaN
+    concentrations so the same frame can be filtered into any pick list.
+    """
+    n_rows, n_columns = data.shape
+    wells = _well_names(tuple(data.index), tuple(data.columns))
+    tidy = pd.DataFrame({
+        'column_number': np.repeat(data.columns.values, n_rows),
+        'row_letter': np.tile(data.index.values, n_columns),
+        'concentration': data.values.ravel(order='F'),
+        'well': wells})
+    tidy['plate'] = plate_name
+    tidy['mouse_id'] = mouse_id
+    tidy['name'] = tidy['well'] + f'-{plate_name}-{mouse_id}-1'
+    return tidy
+
+
+@metrics.timer('make_pick_lists')
+def _make_pick_lists(concentrations, good_cells, plate_name, mouse_id,
+                     blanks_col, datatypes=PICK_LISTS):
+    """Create several ECHO pick lists of a plate from a single tidy table
+
+    Parameters
+    ----------
+    concentrations : pandas.DataFrame
+        The 384-well concentrations of the plate
+    good_cells : pandas.DataFrame
+        Concentrations of the cherrypicked wells, NaN everywhere else
+    plate_name : str
+        Name of the plate
+    mouse_id : str
+        Name of the mouse
+    blanks_col : int
+        Column number containing blanks. It and all columns after it are
+        left out of the "cherrypicked" and "minus_blanks" pick lists
+    datatypes : list of str
+        Which of "cherrypicked", "non_cherrypicked" and "minus_blanks" to
+        create
+
+    Returns
+    -------
+    pick_lists : dict
+        Mapping of each datatype to its tidy pick list
+    """
+    tidy = _tidy_plate(concentrations, plate_name, mouse_id)
+    is_sample = (tidy['column_number'] <= (blanks_col - 1)).values
+    is_measured = tidy['concentration'].notnull().values
+
+    pick_lists = {}
+    for datatype in datatypes:
+        if datatype == 'cherrypicked':
+            good = good_cells.reindex(index=concentrations.index,
+                                      columns=concentrations.columns)
+            is_good = good.notnull().values.ravel(order='F')
+            pick_lists[datatype] = tidy[is_sample & is_good]
+        elif datatype == 'non_cherrypicked':
+            pick_lists[datatype] = tidy[is_measured]
+        elif datatype == 'minus_blanks':
+            minus_blanks = tidy[is_sample & is_measured].copy()
+            average_blanks = concentrations[blanks_col].mean()
+            minus_blanks['concentration'] -= average_blanks
+            pick_lists[datatype] = minus_blanks
+        else:
+            raise ValueError(f"'{datatype}' is not a valid pick list. "
+                             f"Valid pick lists are: {', '.join(PICK_LISTS)}")
+    return pick_lists
+
+
+def _write_pick_list(echo_picks, plate_name, datatype, output_folder='.',
+                     fmt='csv'):
+    filename = _make_pick_list_filename(output_folder, datatype, plate_name,
+                                        fmt)
+    with metrics.timer('write_pick_list'):
+        columnar.write_pick_list(echo_picks, filename, fmt)
+    metrics.count('rows_written', len(echo_picks))
+    print(f'Wrote {datatype} ECHO pick list to {filename}')
+    return filename
 
 
 def _transform_to_pick_list(good_cells, plate_name, mouse_id, datatype,
                             output_folder='.'):
-    # Convert 2d matrix into tall, tidy dataframe
-    echo_picks = good_cells.unstack().reset_index().dropna()
-    echo_picks = echo_picks.rename(
-        columns={'level_0': 'column_number', 'level_1': 'row_letter',
-                 0: 'concentration'})
-    echo_picks['well'] = echo_picks.apply(
-        lambda x: '{row_letter}{column_number}'.format(**x),
-        axis=1)
-    echo_picks['plate'] = plate_name
-    echo_picks['mouse_id'] = mouse_id
-    echo_picks['name'] = echo_picks.apply(
-        lambda x: '{well}-{plate}-{mouse_id}-1'.format(**x),
-        axis=1)
-    filename = _make_pick_list_filename(output_folder, datatype, plate_name)
-    echo_picks.to_csv(filename, index=False)
-    print(f'Wrote {datatype} ECHO pick list to {filename}')
+    echo_picks = _tidy_plate(good_cells, plate_name, mouse_id).dropna()
+    return _write_pick_list(echo_picks, plate_name, datatype,
+                            output_folder=output_folder)
 
 
 def subtract_blank_concentration(concentrations, blanks_col):
@@ -371,43 +541,79 @@ def subtract_blank_concentration(concentrations, blanks_col):
     without_standards_or_blanks = con_minus_blank.loc[:, :(blanks_col - 1)]
     return without_standards_or_blanks
 
+_CHERRYPICK_OPTIONS = [
+    click.option('--filetype', default='auto',
+                 help='One of "auto", "txt", "csv" or "excel". By '
+                      'default, the type is detected from the file'),
+    click.option('--standards-col', default=STANDARDS_COL, type=int,
+                 help='Column containing concentration standards. used for '
+                      'linear regression.'),
+    click.option('--blanks-col', default=BLANKS_COL,
+                 help='Column number containing blanks aka empty wells'),
+    click.option('--standards', default=STANDARDS_STR,
+                 help='Values of the '),
+    click.option('--output-folder', default='.'),
+    click.option('--inner-standards', default=True, type=bool),
+    click.option('--concentrations-minimum', default=CONCENTRATIONS_MINIMUM,
+                 help='Minimum value (in ug/ml) of concentrations for '
+                      '(mean + std) of cherrypicked cells'),
+    click.option('--concentrations-maximum', default=CONCENTRATIONS_MAXIMUM,
+                 help='Minimum value (in ug/ml) of global concentrations for '
+                      'a plate. If any cell in a plate is above this value, '
+                      'the plate is flagged'),
+    click.option('--r-minimum', default=R_MINIMUM,
+                 help='Minimum value of pearson correlation between '
+                      'regression and standards lines'),
+    click.option('--subtract-blank-concentration-csv', default=False,
+                 type=bool,
+                 help='This option will generate a csv with the concentration '
+                      'of every cell minus the concentration of the average '
+                      'blanks'),
+    click.option('--pick-list-format', default='csv',
+                 type=click.Choice(columnar.PICK_LIST_FORMATS),
+                 callback=lambda ctx, param, value:
+                 columnar.check_format(value) or value,
+                 help='Format of the pick lists. parquet and feather, which '
+                      'need pyarrow, are typed and sorted as "dobby '
+                      'aggregate" packs them, so are faster to aggregate'),
+    click.option('--plot-format', default='pdf',
+                 type=click.Choice(heatmap.PLOT_FORMATS),
+                 help='Format of the plots. PNGs are faster to draw and to '
+                      'open'),
+    click.option('--plot-dpi', default=heatmap.DPI, type=int,
+                 help='Resolution of PNG plots, in dots per inch'),
+]
+
+
+def _cherrypick_options(command):
+    """Add the options shared by cherrypick and cherrypick-batch"""
+    for option in reversed(_CHERRYPICK_OPTIONS):
+        command = option(command)
+    return command
+
+
 @click.command(short_help="Use 384-well plate reader fluorescence to choose "
                           "only cells with high enough signals")
 @click.argument('filename', nargs=1,
                 type=click.Path(dir_okay=False, readable=True, file_okay=True))
 @click.argument('plate_name')
 @click.argument('mouse_id')
-@click.option('--filetype', default='txt')
-@click.option('--standards-col', default=STANDARDS_COL, type=int,
-              help='Column containing concentration standards. used for linear'
-                   ' regression.')
-@click.option('--blanks-col', default=BLANKS_COL,
-              help='Column number containing blanks aka empty wells')
-@click.option('--standards', default=STANDARDS_STR,
-              help='Values of the ')
-@click.option('--plot', is_flag=True)
-@click.option('--output-folder', default='.')
-@click.option('--inner-standards', default=True, type=bool)
-@click.option('--concentrations-minimum', default=CONCENTRATIONS_MINIMUM,
-              help='Minimum value (in ug/ml) of concentrations for '
-                   '(mean + std) of cherrypicked cells')
-@click.option('--concentrations-maximum', default=CONCENTRATIONS_MAXIMUM,
-              help='Minimum value (in ug/ml) of global concentrations for a '
-                   'plate. If any cell in a plate is above this value, the '
-                   'plate is flagged')
-@click.option('--r-minimum', default=R_MINIMUM,
-              help='Minimum value of pearson correlation between regression '
-                   'and standards lines')
-@click.option('--subtract-blank-concentration-csv', default=False, type=bool,
-              help='This option will generate a csv with the concentration of every cell minus the concentration of the average blanks')
-def cherrypick(filename, plate_name, mouse_id, subtract_blank_concentration_csv, filetype='txt',
+@click.option('--plot/--no-plot', default=True,
+              help='Whether to draw the regression and heatmap plots')
+@click.option('--cache/--no-cache', default=True,
+              help='Skip plates already cherrypicked into the output folder '
+                   'from the same file with the same parameters')
+@_cherrypick_options
+@metrics.metrics_options
+def cherrypick(filename, plate_name, mouse_id, subtract_blank_concentration_csv, filetype='auto',
                standards_col=STANDARDS_COL, blanks_col=BLANKS_COL,
                standards=STANDARDS_STR,
                plot=True, output_folder='.',
                inner_standards=True,
                concentrations_minimum=CONCENTRATIONS_MINIMUM,
                concentrations_maximum=CONCENTRATIONS_MAXIMUM,
-               r_minimum=R_MINIMUM):
+               r_minimum=R_MINIMUM, cache=True, pick_list_format='csv',
+               plot_format='pdf', plot_dpi=heatmap.DPI):
     """Transform plate of cDNA fluorescence to ECHO pick list
 
     \b
@@ -426,14 +632,21 @@ def cherrypick(filename, plate_name, mouse_id, subtract_blank_concentration_csv,
 
     """
 
-    main(filename, plate_name, mouse_id, subtract_blank_concentration_csv, output_folder=output_folder, plot=True)
+    main(filename, plate_name, mouse_id, subtract_blank_concentration_csv,
+         filetype=filetype, standards_col=standards_col,
+         blanks_col=blanks_col, standards=standards, plot=plot,
+         output_folder=output_folder, inner_standards=inner_standards,
+         concentrations_minimum=concentrations_minimum,
+         concentrations_maximum=concentrations_maximum, r_minimum=r_minimum,
+         cache=cache, pick_list_format=pick_list_format,
+         plot_format=plot_format, plot_dpi=plot_dpi)
 
 
 def main(filename,
          plate_name,
          mouse_id,
-         subtract_blank_concentration_csv,
-         filetype='txt',
+         subtract_blank_concentration_csv=False,
+         filetype='auto',
          standards_col=STANDARDS_COL,
          blanks_col=BLANKS_COL,
          standards=STANDARDS_STR,
@@ -442,51 +655,399 @@ def main(filename,
          inner_standards=True,
          concentrations_minimum=CONCENTRATIONS_MINIMUM,
          concentrations_maximum=CONCENTRATIONS_MAXIMUM,
-         r_minimum=R_MINIMUM):
+         r_minimum=R_MINIMUM,
+         plot_jobs=None,
+         cache=True,
+         pick_list_format='csv',
+         plot_format='pdf',
+         plot_dpi=heatmap.DPI):
+    """Cherrypick one plate, writing its pick lists and then its plots
+
+    Plots are drawn only after all pick lists have been written. If
+    ``plot_jobs`` is a list, the plots are appended to it instead of being
+    drawn, so the caller can draw them later or elsewhere with
+    :func:`render_plots`.
+
+    If ``cache``, a plate already cherrypicked into the output folder from
+    the same file with the same parameters is skipped before it is even
+    parsed, see :mod:`dobby.resultcache`. Any other plate is cherrypicked
+    again, replacing its outputs, and counts as cached only once its pick
+    lists and plots, even queued ones, are all written.
 
+    Returns
+    -------
+    output_folder : str
+        Folder the outputs of the plate were written to, which is inside the
+        "flagged" folder if the plate failed a sanity check
+    """
     standards = _parse_standards(standards)
+    datatypes = ['cherrypicked', 'non_cherrypicked']
+    if subtract_blank_concentration_csv:
+        datatypes.append('minus_blanks')
+
+    if cache:
+        cache = ResultCache(output_folder)
+        key = cache_key(
+            filename, plate_name=plate_name, mouse_id=mouse_id,
+            filetype=filetype, standards=list(standards),
+            standards_col=standards_col, blanks_col=blanks_col,
+            inner_standards=inner_standards,
+            concentrations_minimum=concentrations_minimum,
+            concentrations_maximum=concentrations_maximum,
+            r_minimum=r_minimum, datatypes=datatypes, plot=plot,
+            pick_list_format=pick_list_format, plot_format=plot_format,
+            plot_dpi=plot_dpi)
+        cached = cache.get(key)
+        if cached is not None:
+            print(f'\t{plate_name} unchanged since it was cherrypicked, '
+                  f'skipping ...')
+            metrics.count('plates_cached')
+            return cached
+
     # plate_name = filename_to_plate_name(filename)
     # mouse_id = plate_name_to_mouse_id(plate_name)
     fluorescence = _parse_fluorescence(filename, filetype)
+    plate = cherrypick_plate(
+        fluorescence, plate_name, mouse_id, standards=standards,
+        standards_col=standards_col, blanks_col=blanks_col,
+        inner_standards=inner_standards,
+        concentrations_minimum=concentrations_minimum,
+        concentrations_maximum=concentrations_maximum, r_minimum=r_minimum,
+        datatypes=datatypes)
+    # Outputs of other parameters are replaced, so that they are never
+    # cached as this plate's
+    outputs = []
+    written = write_plate(plate, fluorescence, plate_name, mouse_id,
+                          output_folder=output_folder, plot=plot,
+                          plot_jobs=plot_jobs,
+                          pick_list_format=pick_list_format,
+                          plot_format=plot_format, plot_dpi=plot_dpi,
+                          overwrite=bool(cache), outputs=outputs)
+    if cache:
+        cache.put(key, plate_name, written, outputs)
+    return written
+
+
+CherrypickedPlate = namedtuple('CherrypickedPlate',
+                               ['concentrations', 'means', 'regressed',
+                                'good_cells', 'checks', 'pick_lists'])
+
+
+def cherrypick_plate(fluorescence, plate_name, mouse_id,
+                     standards=STANDARDS_STR, standards_col=STANDARDS_COL,
+                     blanks_col=BLANKS_COL, inner_standards=True,
+                     concentrations_minimum=CONCENTRATIONS_MINIMUM,
+                     concentrations_maximum=CONCENTRATIONS_MAXIMUM,
+                     r_minimum=R_MINIMUM,
+                     datatypes=('cherrypicked', 'non_cherrypicked')):
+    """Regress, sanity check and make the pick lists of a plate in memory
+
+    Nothing is written or recorded, see :func:`write_plate` for that.
 
+    Returns
+    -------
+    plate : CherrypickedPlate
+        The concentrations, standard means and regression of the plate, its
+        good cells, the outcome of each sanity check (see
+        :func:`_sanity_checks`) and the pick lists of each of ``datatypes``
+    """
+    if isinstance(standards, str):
+        standards = _parse_standards(standards)
     concentrations, means, regressed = _fluorescence_to_concentration(
-        fluorescence, standards_col, standards, output_folder=output_folder,
-        inner=inner_standards, r_minimum=r_minimum)
+        fluorescence, standards_col, standards, inner=inner_standards,
+        r_minimum=r_minimum)
+
+    with metrics.timer('qc'):
+        good_cells = _get_good_cells(concentrations, blanks_col, plate_name,
+                                     mouse_id)
+        checks = _sanity_checks(concentrations, blanks_col, good_cells,
+                                concentrations_minimum,
+                                concentrations_maximum, regressed, r_minimum)
+    metrics.count('plates_processed')
+    if not all(checks):
+        metrics.count('plates_flagged')
+    for check, passed in zip(SANITY_CHECKS, checks):
+        if not passed:
+            metrics.count(f'flagged_{check}')
+    pick_lists = _make_pick_lists(concentrations, good_cells, plate_name,
+                                  mouse_id, blanks_col, datatypes)
+    return CherrypickedPlate(concentrations, means, regressed, good_cells,
+                             checks, pick_lists)
+
+
+def write_plate(plate, fluorescence, plate_name, mouse_id, output_folder='.',
+                plot=True, plot_jobs=None, pick_list_format='csv',
+                plot_format='pdf', plot_dpi=heatmap.DPI, overwrite=False,
+                outputs=None):
+    """Write the pick lists and plots of a cherrypicked plate
+
+    Plots are drawn as ``plot_format`` ("pdf" or "png") at ``plot_dpi``.
+
+    Plates failing a sanity check are recorded as flagged and written to a
+    folder inside the "flagged" folder. A plate whose cherrypicked pick list
+    is already there is skipped, unless ``overwrite``, in which case its
+    plots left from before are also removed until they are drawn again. The
+    files written, or queued in ``plot_jobs``, are appended to ``outputs``
+    if it is a list.
 
-    good_cells = _get_good_cells(concentrations, blanks_col, plate_name,
-                                 mouse_id, output_folder=output_folder,
-                                 plot=plot)
+    Returns
+    -------
+    output_folder : str
+        Folder the outputs of the plate were written to
+    """
+    formats = dict(plot_format=plot_format, dpi=plot_dpi)
+    queued_plots = [
+        (_heatmap, (plate.good_cells, plate_name,
+                    'concentrations_cherrypicked_no_standards_or_blanks',
+                    output_folder), formats)]
+    plot_paths = [_heatmap_path(
+        output_folder, 'concentrations_cherrypicked_no_standards_or_blanks',
+        plate_name, plot_format)]
 
     output_folder = _adjust_output_if_fail_sanity_check(
-        concentrations, blanks_col, good_cells,
-        concentrations_minimum, concentrations_maximum,
-        regressed, r_minimum, output_folder, plate_name, mouse_id)
+        plate.checks, output_folder, plate_name, mouse_id)
 
-    if subtract_blank_concentration_csv:
+    outputs = [] if outputs is None else outputs
+    if 'minus_blanks' in plate.pick_lists:
         print("Option provided to subtract blank concentration from main concentration")
-        cons_minus_blanks = subtract_blank_concentration(concentrations, blanks_col)
-        _transform_to_pick_list(cons_minus_blanks, plate_name, mouse_id,
-                                'minus_blanks', output_folder=output_folder)
+        _write_pick_list(plate.pick_lists['minus_blanks'], plate_name,
+                         'minus_blanks', output_folder=output_folder,
+                         fmt=pick_list_format)
+        outputs.append(_pick_list_path(output_folder, 'minus_blanks',
+                                       plate_name, pick_list_format))
 
     picklist_csv = _make_pick_list_filename(output_folder, 'cherrypicked',
-                                            plate_name)
+                                            plate_name, pick_list_format)
 
 
-    if os.path.exists(picklist_csv):
+    if os.path.exists(picklist_csv) and not overwrite:
         print(f'\t{plate_name} already cherrypicked, skipping ...')
-        return
+        return output_folder
+
+    # The cherrypicked pick list goes last, as it marks the plate as done
+    _write_pick_list(plate.pick_lists['non_cherrypicked'], plate_name,
+                     'non_cherrypicked', output_folder=output_folder,
+                     fmt=pick_list_format)
+    _write_pick_list(plate.pick_lists['cherrypicked'], plate_name,
+                     'cherrypicked', output_folder=output_folder,
+                     fmt=pick_list_format)
+    outputs.extend(_pick_list_path(output_folder, datatype, plate_name,
+                                   pick_list_format)
+                   for datatype in ('non_cherrypicked', 'cherrypicked'))
 
     if plot:
-        _plot_regression(means, regressed, plate_name,
-                         output_folder=output_folder)
+        queued_plots.extend([
+            (_plot_regression, (plate.means, plate.regressed, plate_name),
+             dict(output_folder=output_folder, **formats)),
+            (_heatmap, (fluorescence / 1e6, plate_name, 'fluorescence',
+                        output_folder),
+             dict(fmt='.1f',
+                  title_suffix=' (in 100,000 fluorescence units)',
+                  **formats)),
+            (_heatmap, (plate.concentrations, plate_name, 'concentrations',
+                        output_folder),
+             dict(fmt='.1f', vmin=0, vmax=1, **formats))])
+        plot_paths.extend([
+            _regression_path(output_folder, plate_name, plot_format),
+            _heatmap_path(output_folder, 'fluorescence', plate_name,
+                          plot_format),
+            _heatmap_path(output_folder, 'concentrations', plate_name,
+                          plot_format)])
+        if overwrite:
+            for path in plot_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        outputs.extend(plot_paths)
+        if plot_jobs is None:
+            render_plots(queued_plots)
+        else:
+            plot_jobs.extend(queued_plots)
+    return output_folder
 
-        _heatmap(fluorescence / 1e6, plate_name, 'fluorescence', output_folder,
-                 fmt='.1f', title_suffix=' (in 100,000 fluorescence units)')
-        _heatmap(concentrations, plate_name, 'concentrations', output_folder,
-                 fmt='.1f', vmin=0, vmax=1)
 
+def _read_mouse_ids(metadata, mouse_id_col):
+    """Mouse ID of each plate in the metadata CSV, by plate name
 
-    _transform_to_pick_list(good_cells, plate_name, mouse_id, 'cherrypicked',
-                            output_folder=output_folder)
-    _transform_to_pick_list(concentrations, plate_name, mouse_id,
-                            'non_cherrypicked', output_folder=output_folder)
+    Raises :class:`click.BadParameter` if ``mouse_id_col`` isn't a column of
+    the metadata, or a plate has more than one row, before any plate is
+    cherrypicked.
+    """
+    metadata = pd.read_csv(metadata, index_col=0)
+    if mouse_id_col not in metadata.columns:
+        raise click.BadParameter(
+            f'"{mouse_id_col}" is not a column of the metadata. Its columns '
+            f'are: {", ".join(map(str, metadata.columns))}',
+            param_hint='--mouse-id-col')
+    duplicated = metadata.index[metadata.index.duplicated()].unique()
+    if len(duplicated) > 0:
+        raise click.BadParameter(
+            f'Plates with more than one row in the metadata: '
+            f'{", ".join(map(str, duplicated))}', param_hint='--metadata')
+    return metadata[mouse_id_col]
+
+
+def _find_plate_files(paths, pattern='*.txt'):
+    """Expand folders into the plate reader files they contain"""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(glob.glob(os.path.join(path, pattern))))
+        else:
+            filenames.append(path)
+    return filenames
+
+
+def _filename_to_plate_name(filename):
+    return os.path.basename(filename).split('.')[0]
+
+
+def _cherrypick_worker(kwargs):
+    """Cherrypick a single plate and report whether it passed or was flagged
+
+    Returns
+    -------
+    plate_name : str
+        Name of the plate
+    status : str
+        One of "passed", "flagged" or "error"
+    detail : str
+        Folder the outputs were written to, or the error message
+    plot_jobs : list or None
+        Plots left to draw, if a list was given as "plot_jobs" in kwargs
+    flag_records : list
+        Flag record stores whose CSV export is left to the caller to write,
+        once for the whole batch
+    """
+    plate_name = kwargs['plate_name']
+    plot_jobs = kwargs.get('plot_jobs')
+    with deferred_exports() as pending:
+        try:
+            output_folder = main(**kwargs)
+        except Exception as e:
+            output_folder = None
+            detail = f'{type(e).__name__}: {e}'
+        flag_records = list(pending.values())
+        pending.clear()
+
+    if output_folder is None:
+        return plate_name, 'error', detail, None, flag_records
+    flagged_folder = os.path.join(kwargs['output_folder'], FLAGGED)
+    if output_folder.startswith(flagged_folder):
+        return plate_name, 'flagged', output_folder, plot_jobs, flag_records
+    return plate_name, 'passed', output_folder, plot_jobs, flag_records
+
+
+@click.command('cherrypick-batch',
+               short_help="Cherrypick many plates at once using a pool of "
+                          "worker processes")
+@click.argument('inputs', nargs=-1, required=True,
+                type=click.Path(exists=True, readable=True))
+@click.option('--metadata', required=True,
+              type=click.Path(dir_okay=False, readable=True),
+              help='CSV of plate metadata whose first column is the plate '
+                   'name')
+@click.option('--mouse-id-col', default='mouse.id',
+              help='Column of the metadata containing the mouse ID')
+@click.option('--pattern', default='*.txt',
+              help='Pattern of plate reader files to use from folders given '
+                   'as inputs')
+@click.option('--workers', default=None, type=int,
+              help='Number of worker processes. Defaults to the number of '
+                   'CPUs')
+@click.option('--plot/--no-plot', default=True,
+              help='Whether to draw the regression and heatmap plots')
+@click.option('--render-workers', default=0, type=int,
+              help='Number of separate worker processes drawing plots, so '
+                   'that all pick lists are written before waiting on any '
+                   'plot. By default, each plate\'s plots are drawn right '
+                   'after its pick lists')
+@click.option('--cache/--no-cache', default=True,
+              help='Skip plates already cherrypicked into the output folder '
+                   'from the same file with the same parameters')
+@_cherrypick_options
+@metrics.metrics_options
+def cherrypick_batch(inputs, metadata, mouse_id_col, pattern, workers, plot,
+                     render_workers, **kwargs):
+    """Cherrypick every plate reader file in INPUTS in parallel
+
+    \b
+    Parameters
+    ----------
+    inputs : str
+        Plate reader files, or folders containing them. The plate name is
+        the filename up to the first "."
+    """
+    mouse_ids = _read_mouse_ids(metadata, mouse_id_col)
+
+    jobs = []
+    missing = []
+    for filename in _find_plate_files(inputs, pattern):
+        plate_name = _filename_to_plate_name(filename)
+        if plate_name not in mouse_ids.index:
+            missing.append(plate_name)
+            continue
+        mouse_id = mouse_ids[plate_name]
+        job = dict(filename=filename, plate_name=plate_name,
+                   mouse_id=mouse_id, plot=plot, **kwargs)
+        if plot and render_workers > 0:
+            job['plot_jobs'] = []
+        jobs.append(job)
+
+    render_executor = None
+    if plot and render_workers > 0:
+        render_executor = ProcessPoolExecutor(max_workers=render_workers)
+
+    results = []
+    rendered = []
+    # Each worker's metrics come back with its result
+    worker = functools.partial(metrics.measured, _cherrypick_worker)
+    if workers == 1:
+        executor = None
+        worker_results = map(worker, jobs)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        worker_results = executor.map(worker, jobs)
+    with deferred_exports():
+        for (plate_name, status, detail, plot_jobs, flag_records), \
+                worker_metrics in worker_results:
+            metrics.merge(worker_metrics)
+            defer_exports(flag_records)
+            results.append((plate_name, status, detail))
+            if plot_jobs:
+                rendered.extend(
+                    render_executor.submit(metrics.measured, _render_plot,
+                                           plot_job)
+                    for plot_job in plot_jobs)
+    if executor is not None:
+        executor.shutdown()
+    results.extend((plate_name, 'error', 'not found in metadata')
+                   for plate_name in missing)
+
+    click.echo('\nplate\tstatus\tdetail')
+    for plate_name, status, detail in results:
+        click.echo(f'{plate_name}\t{status}\t{detail}')
+
+    statuses = [status for _, status, _ in results]
+    metrics.count('plates_errored', statuses.count('error'))
+    click.echo(f'{statuses.count("passed")} passed, '
+               f'{statuses.count("flagged")} flagged, '
+               f'{statuses.count("error")} errors')
+
+    if render_executor is not None:
+        click.echo(f'All pick lists written, waiting on {len(rendered)} '
+                   f'plots ...')
+        failed_plots = 0
+        for future in rendered:
+            try:
+                _, plot_metrics = future.result()
+                metrics.merge(plot_metrics)
+            except Exception as e:
+                failed_plots += 1
+                click.echo(f'Could not draw plot: {type(e).__name__}: {e}')
+        render_executor.shutdown()
+        if failed_plots:
+            raise click.ClickException(f'{failed_plots} plots could not be '
+                                       f'drawn')
+
+    if 'error' in statuses:
+        raise click.ClickException('Some plates could not be cherrypicked')
@@ -1,14 +1,88 @@
-import click
+import importlib
 
-from dobby.cherrypick import cherrypick
-from dobby.aggregate import aggregate
-# from dobby.selector import selector
-from dobby.samplesheet import samplesheet
+import click
 
 settings = dict(help_option_names=['-h', '--help'])
 
+# Subcommands, as "name: (module:command, short help)". A subcommand's module
+# (and with it pandas, matplotlib, scipy, ...) is only imported when that
+# subcommand is run, so that e.g. "dobby samplesheet" and "dobby -h" start
+# quickly
+SUBCOMMANDS = {
+    'cherrypick': ('dobby.cherrypick:cherrypick',
+                   'Use 384-well plate reader fluorescence to choose only '
+                   'cells with high enough signals'),
+    'cherrypick-batch': ('dobby.cherrypick:cherrypick_batch',
+                         'Cherrypick many plates at once using a pool of '
+                         'worker processes'),
+    'aggregate': ('dobby.aggregate:aggregate',
+                  'Collect cherrypicked files into 384-well ECHO pick list '
+                  'ready files'),
+    'echo': ('dobby.echo:echo',
+             'Write Echo transfer lists for aggregated pick lists'),
+    'check-indexes': ('dobby.indexes:check_indexes_command',
+                      'Check that the indexes of sample sheets pooled in one '
+                      'lane are unique and far enough apart'),
+    'archive': ('dobby.archive:archive',
+                'Add plate reader exports to a memory-mapped archive of '
+                'fluorescence and concentrations'),
+    'qc-sweep': ('dobby.sweep:qc_sweep',
+                 'Count the plates and wells passing QC over a grid of '
+                 'thresholds, without writing any outputs'),
+    'serve': ('dobby.serve:serve',
+              'Keep warm workers running dobby commands sent as jobs over '
+              'HTTP or a Unix socket'),
+    'run': ('dobby.pipeline:run',
+            'Cherrypick plates, aggregate them into ECHO pick lists and make '
+            'their sample sheets in one go'),
+    # 'selector': ('dobby.selector:selector', ''),
+    'samplesheet': ('dobby.samplesheet:samplesheet',
+                    'Create an Illumina sample sheet using a template'),
+    'samplesheet-batch': ('dobby.samplesheet:samplesheet_batch',
+                          'Create the sample sheets of many pick lists at '
+                          'once'),
+}
+
+
+class LazyGroup(click.Group):
+    """Group that imports the module of a subcommand only when it is used"""
+
+    def __init__(self, *args, lazy_subcommands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx))
+                      | set(self.lazy_subcommands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.lazy_subcommands:
+            return super().get_command(ctx, cmd_name)
+        import_path, _ = self.lazy_subcommands[cmd_name]
+        module_name, command_name = import_path.split(':')
+        module = importlib.import_module(module_name)
+        return getattr(module, command_name)
+
+    def format_commands(self, ctx, formatter):
+        # Use the registered short help so that "dobby -h" doesn't import
+        # every subcommand
+        rows = []
+        for cmd_name in self.list_commands(ctx):
+            if cmd_name in self.lazy_subcommands:
+                _, short_help = self.lazy_subcommands[cmd_name]
+            else:
+                command = self.get_command(ctx, cmd_name)
+                if command is None or command.hidden:
+                    continue
+                short_help = command.get_short_help_str()
+            rows.append((cmd_name, short_help))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
 
-@click.group(options_metavar='', subcommand_metavar='<command>',
+@click.group(cls=LazyGroup, lazy_subcommands=SUBCOMMANDS,
+             options_metavar='', subcommand_metavar='<command>',
              context_settings=settings)
 def cli():
     """
@@ -17,10 +91,6 @@ def cli():
     """
     pass
 
-cli.add_command(cherrypick)
-cli.add_command(aggregate)
-# cli.add_command(selector)
-cli.add_command(samplesheet)
 
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,258 @@
+"""Transfer volumes for normalizing cDNA on an Echo liquid handler
+
+Works out, for a whole pick list at once, how much of each sample and how much
+buffer to transfer so that every destination well ends up at the desired
+concentration, in whole droplets of the Echo, and without drawing any source
+well below its dead volume. The transfers are written as an Echo transfer list
+CSV which can be loaded into the instrument as is.
+"""
+import os
+import warnings
+from collections import namedtuple
+
+import numpy as np
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import pandas as pd
+
+import click
+
+from . import metrics
+from .util import atomic_to_csv
+
+# ng/ul
+DESIRED_CONCENTRATION = 0.3
+
+# Volumes are in nL
+FINALVOLUME = 400
+DROPLET_VOLUME = 2.5
+
+# Volume left in a 384PP source well that the Echo can't transfer
+DEAD_VOLUME = 15000
+
+BUFFER_PLATE = 'Buffer'
+BUFFER_WELL = 'A1'
+
+ECHO_COLUMNS = ['Source Plate Name', 'Source Well', 'Destination Plate Name',
+                'Destination Well', 'Transfer Volume']
+
+EchoTransfers = namedtuple('EchoTransfers',
+                           ['samples', 'buffer', 'below_target'])
+
+
+def sample_volumes(concentrations, desired_concentration=DESIRED_CONCENTRATION,
+                   final_volume=FINALVOLUME):
+    """Volume of each sample diluting to the desired concentration
+
+    Parameters
+    ----------
+    concentrations : array-like
+        Concentration of each sample
+    desired_concentration : float or array-like
+        Concentration to dilute to, either one for all the samples or one per
+        sample
+    final_volume : float
+        Volume of each destination well
+
+    Returns
+    -------
+    volumes : numpy.ndarray
+        Volume of each sample, at most ``final_volume`` for samples too dilute
+        to reach the desired concentration
+    """
+    concentrations = np.asarray(concentrations, dtype=np.float64)
+    mass = np.asarray(desired_concentration, dtype=np.float64) * final_volume
+    with np.errstate(divide='ignore', invalid='ignore'):
+        volumes = mass / concentrations
+    volumes = np.where(concentrations <= 0, final_volume, volumes)
+    return np.minimum(volumes, final_volume)
+
+
+def quantize(volumes, resolution):
+    """Round volumes to the closest multiple of ``resolution``"""
+    return np.round(np.asarray(volumes, dtype=np.float64) / resolution) \
+        * resolution
+
+
+def _capped_by_source(droplets, source_wells, available):
+    """Cap droplets so that no source well gives more than it has available
+
+    Transfers drawing from the same source well are served in order: a
+    transfer gets what the ones before it left in the well
+    """
+    wanted = pd.Series(droplets).groupby(source_wells).cumsum().to_numpy()
+    taken = np.minimum(wanted, available)
+    return taken - np.minimum(wanted - droplets, available)
+
+
+def echo_transfers(picklist, destination_plate,
+                   desired_concentration=None, final_volume=FINALVOLUME,
+                   droplet_volume=DROPLET_VOLUME, source_well_volume=None,
+                   dead_volume=DEAD_VOLUME, buffer_plate=BUFFER_PLATE,
+                   buffer_well=BUFFER_WELL):
+    """Echo transfers normalizing the samples of an aggregated pick list
+
+    Parameters
+    ----------
+    picklist : pandas.DataFrame
+        Pick list written by "dobby aggregate", with the columns
+        "Source well", "Plate number", "C(ng/ul)" and "Destination well"
+    destination_plate : str
+        Name of the destination plate in the Echo transfer list
+    desired_concentration : float, optional
+        Concentration to dilute every sample to. If None, the "Desired C"
+        column of the pick list is used for each sample, and if the pick list
+        doesn't have one, ``DESIRED_CONCENTRATION``
+    final_volume : float
+        Volume of each destination well, in nL
+    droplet_volume : float
+        Volume of one droplet of the Echo, in nL. Every transfer is a whole
+        number of droplets
+    source_well_volume : float, optional
+        Volume of sample in each source well, in nL. If given, no more than
+        ``source_well_volume - dead_volume`` is drawn from any source well
+    dead_volume : float
+        Volume the Echo can't draw from a source well, in nL
+    buffer_plate, buffer_well : str
+        Source plate and well of the buffer
+
+    Returns
+    -------
+    transfers : EchoTransfers
+        Transfers of the samples and of the buffer, as DataFrames with the
+        ``ECHO_COLUMNS``, and a boolean array of the samples of the pick list
+        whose transfer is less than needed to reach the desired concentration
+    """
+    if desired_concentration is None:
+        desired_concentration = picklist.get('Desired C',
+                                             DESIRED_CONCENTRATION)
+    concentrations = picklist['C(ng/ul)'].to_numpy(dtype=np.float64)
+    volumes = sample_volumes(concentrations, desired_concentration,
+                             final_volume)
+    # Samples more dilute than the desired concentration can't reach it,
+    # even undiluted
+    too_dilute = ~(concentrations >= np.asarray(desired_concentration))
+
+    # Work in whole droplets from here on
+    final_droplets = int(round(final_volume / droplet_volume))
+    wanted = np.nan_to_num(quantize(volumes, droplet_volume)
+                           / droplet_volume).astype(np.int64)
+    wanted = np.minimum(wanted, final_droplets)
+    droplets = wanted
+
+    source_wells = (picklist['Plate number'].astype(str) + ':'
+                    + picklist['Source well'].astype(str)).to_numpy()
+    if source_well_volume is not None:
+        available = max(int((source_well_volume - dead_volume)
+                            // droplet_volume), 0)
+        droplets = _capped_by_source(wanted, source_wells, available)
+    below_target = too_dilute | (droplets < wanted)
+
+    sample_transfer = droplets > 0
+    samples = pd.DataFrame({
+        'Source Plate Name': picklist['Plate number'].to_numpy(),
+        'Source Well': picklist['Source well'].to_numpy(),
+        'Destination Plate Name': destination_plate,
+        'Destination Well': picklist['Destination well'].to_numpy(),
+        'Transfer Volume': droplets * droplet_volume,
+    })[sample_transfer]
+
+    buffer_droplets = final_droplets - droplets
+    buffer_transfer = buffer_droplets > 0
+    buffer = pd.DataFrame({
+        'Source Plate Name': buffer_plate,
+        'Source Well': buffer_well,
+        'Destination Plate Name': destination_plate,
+        'Destination Well': picklist['Destination well'].to_numpy(),
+        'Transfer Volume': buffer_droplets * droplet_volume,
+    })[buffer_transfer]
+    return EchoTransfers(samples, buffer, below_target)
+
+
+def echo_filename(picklist_filename, output_folder):
+    """Echo transfer list named after its pick list"""
+    basename = os.path.basename(picklist_filename)
+    stem, _ = os.path.splitext(basename)
+    return os.path.join(output_folder, f'{stem}_echo.csv')
+
+
+def write_echo_transfers(picklist, picklist_filename, output_folder, **kwargs):
+    """Write the Echo transfer list of a pick list
+
+    The destination plate is named after the pick list. Keyword arguments are
+    passed to :func:`echo_transfers`
+
+    Returns
+    -------
+    transfers : EchoTransfers
+    """
+    stem, _ = os.path.splitext(os.path.basename(picklist_filename))
+    stem = stem.replace('_incomplete', '')
+    transfers = echo_transfers(picklist, stem, **kwargs)
+    echo_csv = echo_filename(picklist_filename, output_folder)
+    with metrics.timer('write_echo'):
+        atomic_to_csv(pd.concat([transfers.samples, transfers.buffer]),
+                      echo_csv, index=False)
+    n_below = transfers.below_target.sum()
+    if n_below > 0:
+        names = list(picklist['Name'][transfers.below_target]) \
+            if 'Name' in picklist else []
+        if len(names) > 10:
+            names = names[:10] + ['...']
+        print(f'WARNING: {n_below} samples of {picklist_filename} are too '
+              f'dilute, or their source wells too empty, to reach the '
+              f'desired concentration: {", ".join(map(str, names))}')
+    return transfers
+
+
+ECHO_OPTIONS = [
+    click.option('--desired-concentration', type=float, default=None,
+                 help="Concentration (ng/ul) to dilute every sample to. By "
+                      "default, the 'Desired C' column of the pick lists, for "
+                      "each sample"),
+    click.option('--final-volume', type=float, default=FINALVOLUME,
+                 help="Volume of each destination well (nL)"),
+    click.option('--droplet-volume', type=float, default=DROPLET_VOLUME,
+                 help="Volume of one droplet of the Echo (nL)"),
+    click.option('--source-well-volume', type=float, default=None,
+                 help="Volume of sample in each source well (nL). If given, "
+                      "source wells are never drawn below the dead volume"),
+    click.option('--dead-volume', type=float, default=DEAD_VOLUME,
+                 help="Volume the Echo can't draw from a source well (nL)"),
+    click.option('--buffer-plate', default=BUFFER_PLATE,
+                 help="Name of the source plate of the buffer"),
+    click.option('--buffer-well', default=BUFFER_WELL,
+                 help="Source well of the buffer"),
+]
+
+
+def echo_options(function):
+    for option in reversed(ECHO_OPTIONS):
+        function = option(function)
+    return function
+
+
+@click.command(short_help="Write Echo transfer lists for aggregated pick "
+                          "lists")
+@click.argument('picklists', nargs=-1, required=True,
+                type=click.Path(dir_okay=False, readable=True))
+@click.option('--output-folder', default='.',
+              help="Folder to write the Echo transfer lists to",
+              type=click.Path(dir_okay=True, writable=True))
+@echo_options
+def echo(picklists, output_folder, **kwargs):
+    """Turn pick lists from "dobby aggregate" into Echo transfer lists
+
+    \b
+    Parameters
+    ----------
+    picklists : str
+        Pick lists written by "dobby aggregate"
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    for picklist_filename in picklists:
+        picklist = pd.read_csv(picklist_filename)
+        write_echo_transfers(picklist, picklist_filename, output_folder,
+                             **kwargs)
+        print(f'Wrote {echo_filename(picklist_filename, output_folder)}')
@@ -0,0 +1,198 @@
+"""Record of when each plate was flagged, safe to share between processes
+
+The record is kept in a SQLite database next to the CSV that older versions
+of dobby wrote, ``record_plate_flagged_timestamp.csv``. SQLite's locking lets
+several cherrypick runs record flags into the same output folder at once,
+and looking up a plate doesn't mean reading every other plate's record. The
+CSV is still written, in its original layout of one line per plate with each
+time it was flagged, and an existing CSV is imported the first time the
+database is created.
+
+Writing the CSV means reading every flag, so it is written after the write
+lock is released, and batches of plates write it once at the end rather than
+after every plate, see :func:`deferred_exports`.
+"""
+import contextlib
+import os
+import sqlite3
+
+from .util import atomic_open
+
+RECORD_DB = 'record_plate_flagged_timestamp.sqlite'
+
+# Seconds to wait for another process holding the lock on the database
+TIMEOUT = 60
+
+SCHEMA_VERSION = 1
+
+# CSV exports left to write when the block of deferred_exports ends
+_pending = None
+
+
+@contextlib.contextmanager
+def deferred_exports():
+    """Write the CSV exports of stores recorded to in the block once, when
+    it ends, instead of after every record
+
+    Yields
+    ------
+    pending : dict
+        Stores whose CSV is left to write, by CSV filename. Clearing it
+        leaves them to the caller, e.g. to the parent of a worker process
+    """
+    global _pending
+    outer, _pending = _pending, {}
+    try:
+        yield _pending
+    finally:
+        pending, _pending = _pending, outer
+        if outer is not None:
+            outer.update(pending)
+        else:
+            for store in pending.values():
+                store.export_csv()
+
+
+def defer_exports(stores):
+    """Leave the CSV exports of ``stores``, e.g. recorded to by a worker
+    process, to the end of the current :func:`deferred_exports` block, or
+    write them now if there is none"""
+    for store in stores:
+        if _pending is not None:
+            _pending[store.csv_path] = store
+        else:
+            store.export_csv()
+
+
+class FlagRecordStore:
+    """Append-only store of the times each plate was flagged
+
+    Parameters
+    ----------
+    folder : str
+        Folder holding the database and the CSV export
+    csv : str, optional
+        Filename of the CSV export, relative to ``folder``. If None, no CSV is
+        written or imported
+    """
+
+    def __init__(self, folder, csv=None):
+        self.folder = folder
+        self.db_path = os.path.join(folder, RECORD_DB)
+        self.csv_path = None if csv is None else os.path.join(folder, csv)
+        os.makedirs(folder, exist_ok=True)
+        with self._transaction() as connection:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version < SCHEMA_VERSION:
+                self._create(connection)
+
+    def _connect(self):
+        # Autocommit mode, so that transactions are started explicitly with
+        # BEGIN IMMEDIATE, which takes the write lock up front
+        return sqlite3.connect(self.db_path, timeout=TIMEOUT,
+                               isolation_level=None)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Connection holding the database's write lock until committed"""
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            yield connection
+            connection.execute('COMMIT')
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+
+    def _create(self, connection):
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS flags ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'plate TEXT NOT NULL, '
+            'timestamp TEXT NOT NULL)')
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS flags_plate ON flags (plate)')
+        if self.csv_path is not None and os.path.exists(self.csv_path):
+            connection.executemany(
+                'INSERT INTO flags (plate, timestamp) VALUES (?, ?)',
+                self._read_csv(self.csv_path))
+        connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    @staticmethod
+    def _read_csv(csv):
+        with open(csv) as f:
+            for line in f:
+                fields = line.rstrip().split(',')
+                if not fields[0]:
+                    continue
+                for timestamp in fields[1:]:
+                    yield fields[0], timestamp
+
+    def record(self, plate_name, timestamp):
+        """Add a time the plate was flagged
+
+        Returns
+        -------
+        n_flagged : int
+            Number of times the plate has now been flagged
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                'INSERT INTO flags (plate, timestamp) VALUES (?, ?)',
+                (plate_name, timestamp))
+            n_flagged = self._count(connection, plate_name)
+        if self.csv_path is not None:
+            defer_exports([self])
+        return n_flagged
+
+    @staticmethod
+    def _count(connection, plate_name):
+        return connection.execute('SELECT COUNT(*) FROM flags WHERE plate = ?',
+                                  (plate_name,)).fetchone()[0]
+
+    def count(self, plate_name):
+        """Number of times the plate has been flagged"""
+        connection = self._connect()
+        try:
+            return self._count(connection, plate_name)
+        finally:
+            connection.close()
+
+    def timestamps(self, plate_name):
+        """Times the plate was flagged, oldest first"""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                'SELECT timestamp FROM flags WHERE plate = ? ORDER BY id',
+                (plate_name,)).fetchall()
+        finally:
+            connection.close()
+        return [timestamp for timestamp, in rows]
+
+    def export_csv(self, csv=None):
+        """Write the record in the layout of the original CSV
+
+        One line per plate, in the order plates were first flagged, with the
+        plate name followed by every time it was flagged. Written to the CSV
+        export of the store if ``csv`` is None
+        """
+        csv = self.csv_path if csv is None else csv
+        connection = self._connect()
+        try:
+            self._write_csv(connection, csv)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _write_csv(connection, csv):
+        rows = connection.execute(
+            'SELECT plate, timestamp FROM flags ORDER BY id').fetchall()
+        lines = {}
+        for plate_name, timestamp in rows:
+            lines.setdefault(plate_name, [plate_name]).append(timestamp)
+
+        with atomic_open(csv) as f:
+            f.writelines(','.join(line) + '\n' for line in lines.values())
@@ -0,0 +1,157 @@
+"""Rows, columns and well names of 96, 384 and 1536-well plates
+
+A well is identified by its index in the row-major order of its plate (A1,
+A2, ..., B1, ...), which fits in a uint16 for every plate size. Converting
+between indices, (row, column) positions and names goes through lookup
+tables made once per geometry, so whole columns of wells are converted with
+numpy indexing instead of formatting or parsing strings one at a time.
+
+Rows past Z are named like spreadsheet columns, AA to AF for the 32 rows of
+a 1536-well plate.
+"""
+import functools
+import re
+import warnings
+
+import numpy as np
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import pandas as pd
+
+WELL_DTYPE = np.uint16
+
+_WELL_NAME = re.compile(r'^([A-Za-z]+)0*([1-9][0-9]*)$')
+
+
+def row_name(row):
+    """Name of a row from its position starting at 0: A, ..., Z, AA, AB, ..."""
+    name = ''
+    row += 1
+    while row > 0:
+        row, remainder = divmod(row - 1, 26)
+        name = chr(ord('A') + remainder) + name
+    return name
+
+
+def row_names(n_rows):
+    return [row_name(row) for row in range(n_rows)]
+
+
+class PlateGeometry:
+    """Layout of a plate of ``n_rows`` by ``n_columns`` wells
+
+    Parameters
+    ----------
+    n_rows, n_columns : int
+    """
+
+    def __init__(self, n_rows, n_columns):
+        self.n_rows = n_rows
+        self.n_columns = n_columns
+        self.row_names = np.array(row_names(n_rows), dtype=object)
+        self.column_numbers = np.arange(1, n_columns + 1)
+        rows, columns = np.divmod(np.arange(self.n_wells), n_columns)
+        # Lookup table of well names, by well index
+        self.well_names = (self.row_names[rows]
+                           + (columns + 1).astype(str).astype(object))
+
+    @property
+    def n_wells(self):
+        return self.n_rows * self.n_columns
+
+    @property
+    def shape(self):
+        return self.n_rows, self.n_columns
+
+    def __repr__(self):
+        return f'PlateGeometry({self.n_rows}, {self.n_columns})'
+
+    def __eq__(self, other):
+        return isinstance(other, PlateGeometry) and self.shape == other.shape
+
+    def __hash__(self):
+        return hash(self.shape)
+
+    @functools.cached_property
+    def _name_index(self):
+        return pd.Index(self.well_names)
+
+    def well_index(self, rows, columns):
+        """Indices of wells from their rows and columns, starting at 0"""
+        rows = np.asarray(rows)
+        columns = np.asarray(columns)
+        if ((rows < 0) | (rows >= self.n_rows) | (columns < 0)
+                | (columns >= self.n_columns)).any():
+            raise ValueError(f'Wells outside of a {self.n_wells}-well plate')
+        return (rows * self.n_columns + columns).astype(WELL_DTYPE)
+
+    def rows_columns(self, index):
+        """Rows and columns, starting at 0, of wells from their indices"""
+        return np.divmod(np.asarray(index, dtype=np.intp), self.n_columns)
+
+    def names(self, index):
+        """Names of wells from their indices"""
+        return self.well_names[np.asarray(index, dtype=np.intp)]
+
+    def parse(self, names):
+        """Indices of wells from their names, e.g. "A1", "P24" or "AF01"
+
+        Raises
+        ------
+        ValueError
+            If a name is not a well of this plate
+        """
+        names = np.asarray(names, dtype=object)
+        index = self._name_index.get_indexer(names)
+        unknown = np.flatnonzero(index < 0)
+        # Only names that aren't in the lookup table, e.g. zero-padded or
+        # lower case, are parsed one by one
+        for i in unknown:
+            match = _WELL_NAME.match(str(names[i]))
+            if match is not None:
+                row = _row_position(match.group(1).upper())
+                column = int(match.group(2)) - 1
+                if row < self.n_rows and column < self.n_columns:
+                    index[i] = row * self.n_columns + column
+                    continue
+            raise ValueError(f'{names[i]!r} is not a well of a '
+                             f'{self.n_wells}-well plate')
+        return index.astype(WELL_DTYPE)
+
+    def row_positions(self, names):
+        """Positions of rows, starting at 0, from their names"""
+        positions = pd.Index(self.row_names).get_indexer(
+            np.asarray(names, dtype=object))
+        if (positions < 0).any():
+            raise ValueError(f'Rows outside of a {self.n_wells}-well plate')
+        return positions
+
+    def column_major(self):
+        """Indices of all wells in column-major order (A1, B1, ..., A2, ...)"""
+        return np.arange(self.n_wells).reshape(self.shape).ravel(
+            order='F').astype(WELL_DTYPE)
+
+
+def _row_position(name):
+    row = 0
+    for letter in name:
+        row = row * 26 + ord(letter) - ord('A') + 1
+    return row - 1
+
+
+PLATE_96 = PlateGeometry(8, 12)
+PLATE_384 = PlateGeometry(16, 24)
+PLATE_1536 = PlateGeometry(32, 48)
+
+GEOMETRIES = {geometry.n_wells: geometry
+              for geometry in (PLATE_96, PLATE_384, PLATE_1536)}
+
+
+def geometry_of(n_wells):
+    """Geometry of a standard plate from its number of wells"""
+    try:
+        return GEOMETRIES[int(n_wells)]
+    except KeyError:
+        raise ValueError(f'{n_wells} is not a plate size. Plate sizes are: '
+                         f'{", ".join(map(str, GEOMETRIES))}') from None
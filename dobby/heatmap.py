@@ -0,0 +1,155 @@
+"""Heatmaps of plates, drawn with one image and one artist of annotations
+
+``seaborn.heatmap(..., annot=True)`` makes a new figure and one text artist
+per well every time, and laying out and drawing these hundreds of artists is
+most of the time spent plotting a plate. :class:`PlateHeatmap` instead keeps
+one figure per plate shape, with the wells drawn as a single image and their
+values as a single collection of glyph outlines, and only swaps in the
+values, labels and title of each new plate. The outline of every distinct
+label is made once and reused, and as values are formatted to a digit or
+two, few are distinct. Above :data:`ANNOTATE_MAX_WELLS` wells, e.g. for
+1536-well plates, values are too small to read and aren't drawn.
+
+Figures are made without pyplot, so none are kept around by it, and are
+saved as PDF or PNG depending on the extension.
+"""
+import functools
+import warnings
+
+import numpy as np
+
+PLOT_FORMATS = ('pdf', 'png')
+DPI = 150
+ANNOTATE_MAX_WELLS = 384
+CMAP = 'magma'
+FIGSIZE = (8, 4)
+FONTSIZE = 8
+
+_MARGINS = dict(left=0.05, right=0.97, bottom=0.08, top=0.9)
+
+
+@functools.lru_cache(maxsize=None)
+def _matplotlib():
+    import matplotlib as mpl
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        mpl.use('agg')
+    return mpl
+
+
+@functools.lru_cache(maxsize=4096)
+def _label_path(label, size=FONTSIZE):
+    """Outline of a label centered on (0, 0), in points"""
+    mpl = _matplotlib()
+    from matplotlib.textpath import TextPath
+    path = TextPath((0, 0), label, size=size)
+    (x0, y0), (x1, y1) = path.get_extents().get_points()
+    return path.transformed(mpl.transforms.Affine2D().translate(
+        -(x0 + x1) / 2, -(y0 + y1) / 2))
+
+
+def _is_dark(rgba):
+    """Whether colors are dark enough for white text, as seaborn decides"""
+    rgb = np.where(rgba[..., :3] <= 0.03928, rgba[..., :3] / 12.92,
+                   ((rgba[..., :3] + 0.055) / 1.055) ** 2.4)
+    luminance = rgb @ np.array([0.2126, 0.7152, 0.0722])
+    return luminance <= 0.408
+
+
+class PlateHeatmap:
+    """A figure to draw heatmaps of plates of one shape, one after the other
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Rows and columns of the plates
+    figsize : tuple of float
+        Size of the figure, in inches
+    cmap : str
+        Name of the matplotlib colormap
+    """
+
+    def __init__(self, shape, figsize=FIGSIZE, cmap=CMAP):
+        mpl = _matplotlib()
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.collections import PathCollection
+        from matplotlib.figure import Figure
+
+        self.shape = tuple(shape)
+        n_rows, n_columns = self.shape
+        self.figure = Figure(figsize=figsize)
+        FigureCanvasAgg(self.figure)
+        self.figure.subplots_adjust(**_MARGINS)
+        self.ax = self.figure.add_subplot()
+        self.image = self.ax.imshow(np.full(self.shape, np.nan), cmap=cmap,
+                                    aspect='auto', interpolation='nearest')
+        self.colorbar = self.figure.colorbar(self.image, ax=self.ax,
+                                             fraction=0.05, pad=0.02)
+        self.ax.set_xticks(np.arange(n_columns))
+        self.ax.set_yticks(np.arange(n_rows))
+        self.ax.tick_params(length=0)
+        for spine in self.ax.spines.values():
+            spine.set_visible(False)
+        self.title = self.ax.set_title('')
+
+        rows, columns = np.indices(self.shape)
+        self._centers = np.column_stack([columns.ravel(), rows.ravel()])
+        # Labels are outlines in points, placed at the center of their well
+        self.annotations = PathCollection(
+            [], offsets=np.empty((0, 2)), offset_transform=self.ax.transData,
+            transform=mpl.transforms.Affine2D().scale(1 / 72)
+            + self.figure.dpi_scale_trans, linewidths=0)
+        self.ax.add_collection(self.annotations, autolim=False)
+        self.annotate = rows.size <= ANNOTATE_MAX_WELLS
+
+    def draw(self, data, title='', fmt='.2g', vmin=None, vmax=None):
+        """Show the values of a plate
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            Values of the plate, with row names as the index and column
+            numbers as the columns. Missing values are left blank
+        title : str
+        fmt : str
+            Format of the annotated values
+        vmin, vmax : float, optional
+            Range of the colormap, by default that of the values
+        """
+        values = np.asarray(data, dtype=np.float64)
+        if values.shape != self.shape:
+            raise ValueError(f'A {values.shape} plate does not fit a '
+                             f'{self.shape} heatmap')
+        missing = np.isnan(values)
+        self.image.set_data(np.ma.masked_array(values, missing))
+        if missing.all():
+            low, high = 0, 1
+        else:
+            low, high = np.nanmin(values), np.nanmax(values)
+        self.image.set_clim(low if vmin is None else vmin,
+                            high if vmax is None else vmax)
+        self.ax.set_xticklabels([str(column) for column in data.columns])
+        self.ax.set_yticklabels([str(row) for row in data.index], rotation=0)
+        self.title.set_text(title)
+
+        if self.annotate:
+            present = ~missing.ravel()
+            labels = [format(value, fmt)
+                      for value in values.ravel()[present]]
+            colors = self.image.to_rgba(values.ravel()[present])
+            self.annotations.set_paths([_label_path(label)
+                                        for label in labels])
+            self.annotations.set_offsets(self._centers[present])
+            self.annotations.set_facecolors(
+                np.where(_is_dark(colors)[:, np.newaxis],
+                         (1., 1., 1., 1.), (0.15, 0.15, 0.15, 1.)))
+
+    def save(self, filename, dpi=DPI):
+        """Save as PDF or PNG, depending on the extension of ``filename``"""
+        self.figure.savefig(filename, dpi=dpi)
+
+
+@functools.lru_cache(maxsize=None)
+def renderer(shape):
+    """The heatmap figure of plates of this shape, made once per process"""
+    return PlateHeatmap(shape)
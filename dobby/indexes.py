@@ -0,0 +1,346 @@
+"""Check that the dual indexes of samples pooled in one lane can be told apart
+
+Index sequences are packed two bits per base into one uint64 per index, so
+that the Hamming distance between two indexes is an XOR and a popcount, and
+every pair of samples in a lane is compared with a few vectorized numpy
+operations.
+
+Two samples can only be told apart when demultiplexing if at least one of
+their two indexes differs enough: with ``m`` mismatches allowed per index,
+that is by at least ``2m + 1`` bases. The distance between two samples here is
+therefore the larger of the distances between their i7 and between their i5
+indexes.
+
+Indexes of the same length are compared over their whole length. Sheets of
+different index lengths can share a lane, e.g. 8 base XT-C indexes and 12
+base i5/i7 ones, and a pair of indexes of different lengths is compared over
+the bases they share, from the start of the shorter one.
+"""
+import os
+import warnings
+
+import numpy as np
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import pandas as pd
+
+import click
+
+from .samplesheet import TEMPLATE_WELL_COL, TEMPLATES, template_sample_id_col
+from .util import atomic_to_csv
+
+I7_COL = 'index'
+I5_COL = 'index2'
+
+# Enough to tell samples apart with one mismatch allowed per index, the
+# default of bcl2fastq
+MIN_DISTANCE = 3
+
+# Largest index that fits in a uint64 at two bits per base
+MAX_LENGTH = 32
+
+# Rows of the pairwise distance matrix computed at once
+BLOCK_SIZE = 1024
+
+_BASE_CODES = np.full(256, 255, dtype=np.uint8)
+for _code, _base in enumerate('ACGT'):
+    _BASE_CODES[ord(_base)] = _code
+    _BASE_CODES[ord(_base.lower())] = _code
+
+# Low bit of every base
+_LOW_BITS = np.uint64(0x5555555555555555)
+
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)],
+                          dtype=np.uint8)
+
+
+def _popcount(x):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    counts = _BYTE_POPCOUNT[x.view(np.uint8)]
+    return counts.reshape(x.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def pack_indexes(sequences, length=None):
+    """Pack index sequences two bits per base into uint64s
+
+    Parameters
+    ----------
+    sequences : list of str
+        Index sequences, of A, C, G and T
+    length : int, optional
+        Number of bases to pack from the start of each sequence. Defaults to
+        the length of the shortest sequence
+
+    Returns
+    -------
+    packed : numpy.ndarray
+        One uint64 per sequence
+    """
+    sequences = [str(sequence) for sequence in sequences]
+    if length is None:
+        length = min(map(len, sequences), default=0)
+    if length > MAX_LENGTH:
+        raise ValueError(f'Indexes of {length} bases are too long to pack, '
+                         f'the maximum is {MAX_LENGTH}')
+    if not sequences or length == 0:
+        return np.zeros(len(sequences), dtype=np.uint64)
+
+    raw = np.frombuffer(''.join(sequence[:length] for sequence in sequences)
+                        .encode('ascii', errors='replace'),
+                        dtype=np.uint8).reshape(len(sequences), length)
+    codes = _BASE_CODES[raw]
+    invalid = (codes == 255).any(axis=1)
+    if invalid.any():
+        bad = [sequences[i] for i in np.flatnonzero(invalid)[:5]]
+        raise ValueError(f'Indexes can only contain A, C, G and T, not '
+                         f'{", ".join(bad)}')
+
+    shifts = np.arange(2 * (length - 1), -1, -2, dtype=np.uint64)
+    return np.bitwise_or.reduce(codes.astype(np.uint64) << shifts, axis=1)
+
+
+def hamming(a, b):
+    """Number of bases differing between packed indexes, broadcasting"""
+    x = np.bitwise_xor(a, b)
+    # Set the low bit of every base that differs, then count them
+    x |= x >> x.dtype.type(1)
+    x &= _LOW_BITS.astype(x.dtype)
+    return _popcount(x)
+
+
+def _narrowest(*packed):
+    """Indexes of up to 16 bases fit in half the memory, and compare faster"""
+    if any(len(x) and x.max() >= 2 ** 32 for x in packed):
+        return packed
+    return tuple(x.astype(np.uint32) for x in packed)
+
+
+def close_pairs(i7, i5=None, min_distance=MIN_DISTANCE):
+    """Pairs of samples whose dual indexes are closer than ``min_distance``
+
+    Parameters
+    ----------
+    i7, i5 : numpy.ndarray
+        Packed indexes of each sample, from :func:`pack_indexes`. If ``i5`` is
+        None, samples are single indexed
+
+    Returns
+    -------
+    first, second : numpy.ndarray
+        Positions of the two samples of each close pair, with first < second
+    distance_i7, distance_i5 : numpy.ndarray
+        Hamming distances between their i7 and i5 indexes
+    min_distance : int
+        Smallest distance between any two samples, or -1 if there are fewer
+        than two samples
+    """
+    return _pairs(i7, i5, i7, i5, min_distance, triangle=True)
+
+
+def close_pairs_between(i7, i5, other_i7, other_i5,
+                        min_distance=MIN_DISTANCE):
+    """Pairs of a sample and another sample closer than ``min_distance``
+
+    As :func:`close_pairs`, but comparing every sample of one set to every
+    sample of another, e.g. indexes of different lengths packed to the bases
+    they share. ``first`` are positions in the first set and ``second`` in
+    the other one
+    """
+    return _pairs(i7, i5, other_i7, other_i5, min_distance, triangle=False)
+
+
+def _pairs(i7, i5, other_i7, other_i5, min_distance, triangle):
+    n = len(i7)
+    if i5 is None:
+        i5 = np.zeros(n, dtype=np.uint64)
+    if other_i5 is None:
+        other_i5 = np.zeros(len(other_i7), dtype=np.uint64)
+    i7, other_i7 = _narrowest(i7, other_i7)
+    i5, other_i5 = _narrowest(i5, other_i5)
+    found = []
+    smallest = -1
+    for start in range(0, n - 1 if triangle else n, BLOCK_SIZE):
+        stop = min(start + BLOCK_SIZE, n)
+        # Compare each sample to the ones after it, or to all the others
+        offset = start + 1 if triangle else 0
+        if offset >= len(other_i7):
+            break
+        distance_i7 = hamming(i7[start:stop, np.newaxis],
+                              other_i7[np.newaxis, offset:])
+        distance_i5 = hamming(i5[start:stop, np.newaxis],
+                              other_i5[np.newaxis, offset:])
+        distance = np.maximum(distance_i7, distance_i5)
+        if triangle:
+            # Leave out the pairs of the block with samples before themselves
+            size = stop - start
+            before = np.arange(size - 1)[np.newaxis, :] \
+                < np.arange(size)[:, np.newaxis]
+            distance[:, :size - 1][before] = np.iinfo(distance.dtype).max
+
+        block_smallest = int(distance.min())
+        smallest = block_smallest if smallest < 0 \
+            else min(smallest, block_smallest)
+        row, column = np.nonzero(distance < min_distance)
+        found.append((row + start, column + offset,
+                      distance_i7[row, column], distance_i5[row, column]))
+
+    if not found:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty, empty, smallest
+    first, second, distance_i7, distance_i5 = (np.concatenate(x)
+                                               for x in zip(*found))
+    return first, second, distance_i7, distance_i5, int(smallest)
+
+
+def read_sheet(name):
+    """Samples and indexes of a sample sheet or template
+
+    Parameters
+    ----------
+    name : str
+        A CSV file of a sample sheet, or the name of a template. Rows without
+        a sample ID are left out of filled in sample sheets
+
+    Returns
+    -------
+    samples : pandas.DataFrame
+        With the columns "sheet", "well", "sample", "index" and "index2"
+    """
+    if os.path.exists(name):
+        table = pd.read_csv(name)
+        label = os.path.basename(name)
+    else:
+        table = TEMPLATES[name]
+        label = name
+    if I7_COL not in table:
+        raise ValueError(f'{name} has no "{I7_COL}" column')
+
+    sample_id_col = template_sample_id_col(table)
+    samples = table.get(sample_id_col)
+    if samples is not None and samples.notnull().any():
+        table = table[samples.notnull()]
+    wells = table[TEMPLATE_WELL_COL] if TEMPLATE_WELL_COL in table \
+        else pd.Series(np.arange(1, len(table) + 1), index=table.index)
+    return pd.DataFrame({
+        'sheet': label,
+        'well': wells.astype(str).to_numpy(),
+        'sample': table.get(sample_id_col,
+                            pd.Series(index=table.index, dtype=object)
+                            ).to_numpy(),
+        I7_COL: table[I7_COL].astype(str).to_numpy(),
+        I5_COL: table[I5_COL].astype(str).to_numpy() if I5_COL in table
+        else None,
+    })
+
+
+def check_indexes(sheets, min_distance=MIN_DISTANCE):
+    """Find the samples of pooled sheets whose indexes are too close
+
+    Parameters
+    ----------
+    sheets : list of str
+        Sample sheet CSVs or template names, pooled in one lane
+    min_distance : int
+        Smallest acceptable distance between two samples
+
+    Returns
+    -------
+    close : pandas.DataFrame
+        One row per pair of samples closer than ``min_distance``, with the
+        sheets and wells of both samples and the distances of their indexes
+    smallest : int
+        Smallest distance between any two samples
+    """
+    samples = pd.concat([read_sheet(sheet) for sheet in sheets],
+                        ignore_index=True)
+    dual = samples[I5_COL].notnull().all()
+    length_i7 = samples[I7_COL].str.len()
+    length_i5 = samples[I5_COL].str.len() if dual else 0 * length_i7
+    # Positions of the samples with each length of indexes
+    groups = sorted((key, positions) for key, positions in samples.groupby(
+        [length_i7, length_i5]).indices.items())
+
+    found = []
+    smallest = -1
+    for g, ((length_a, length2_a), a) in enumerate(groups):
+        for (length_b, length2_b), b in groups[g:]:
+            # Over the bases both indexes of a pair have
+            length = min(length_a, length_b)
+            length2 = min(length2_a, length2_b)
+            i7_a = pack_indexes(samples[I7_COL].iloc[a], length)
+            i5_a = pack_indexes(samples[I5_COL].iloc[a], length2) \
+                if dual else None
+            if b is a:
+                first, second, distance_i7, distance_i5, group_smallest = \
+                    close_pairs(i7_a, i5_a, min_distance)
+            else:
+                i7_b = pack_indexes(samples[I7_COL].iloc[b], length)
+                i5_b = pack_indexes(samples[I5_COL].iloc[b], length2) \
+                    if dual else None
+                first, second, distance_i7, distance_i5, group_smallest = \
+                    close_pairs_between(i7_a, i5_a, i7_b, i5_b, min_distance)
+            if group_smallest >= 0:
+                smallest = group_smallest if smallest < 0 \
+                    else min(smallest, group_smallest)
+            first, second = a[first], b[second]
+            found.append((np.minimum(first, second),
+                          np.maximum(first, second),
+                          distance_i7, distance_i5))
+    first, second, distance_i7, distance_i5 = (
+        np.concatenate(x) for x in zip(*found)) if found \
+        else (np.array([], dtype=np.int64),) * 4
+    order = np.lexsort((second, first))
+    first, second = first[order], second[order]
+    distance_i7, distance_i5 = distance_i7[order], distance_i5[order]
+
+    a = samples.iloc[first].reset_index(drop=True)
+    b = samples.iloc[second].reset_index(drop=True)
+    close = pd.DataFrame({
+        'sheet_1': a['sheet'], 'well_1': a['well'],
+        'sheet_2': b['sheet'], 'well_2': b['well'],
+        I7_COL: a[I7_COL], I5_COL: a[I5_COL],
+        'distance_i7': distance_i7, 'distance_i5': distance_i5,
+    })
+    return close, smallest
+
+
+@click.command(name='check-indexes',
+               short_help="Check that the indexes of sample sheets pooled "
+                          "in one lane are unique and far enough apart")
+@click.argument('sheets', nargs=-1, required=True)
+@click.option('--min-distance', default=MIN_DISTANCE, type=int,
+              help='Smallest number of differing bases, in the i7 or the i5 '
+                   'index, between any two samples')
+@click.option('--output', default=None,
+              type=click.Path(dir_okay=False, writable=True),
+              help='Write every pair of samples that is too close to this '
+                   'CSV')
+def check_indexes_command(sheets, min_distance, output):
+    """Check the dual indexes of sample sheets that share a lane
+
+    Example:
+    $ dobby check-indexes XT-C-04 XT-C-05 echo_picklist_00001_samplesheet.csv
+
+    \b
+    Parameters
+    ----------
+    sheets : str
+        Sample sheet CSVs, or the names of templates
+    """
+    close, smallest = check_indexes(sheets, min_distance)
+    print(f'Smallest distance between two samples: {smallest}')
+    if output is not None:
+        atomic_to_csv(close, output, index=False)
+    if close.empty:
+        print('All indexes are far enough apart')
+        return
+
+    collisions = close[(close['distance_i7'] == 0)
+                       & (close['distance_i5'] == 0)]
+    print(close.to_string(index=False, max_rows=50))
+    raise click.ClickException(
+        f'{len(close)} pairs of samples are closer than {min_distance} '
+        f'bases, of which {len(collisions)} have identical indexes')
+
@@ -0,0 +1,147 @@
+"""Record of what "dobby aggregate" has already packed into an output folder
+
+The manifest is a JSON file in the output folder listing every input file
+(by path and SHA-256 of its contents) with the pick lists its rows went to,
+and the rows of the last, incomplete pick list. Rerunning aggregate over a
+whole folder of cherrypicked files then only packs the new files, starting
+by topping up that incomplete pick list.
+
+Rewriting the whole manifest after every pick list would take longer the more
+files it lists, so while a run packs, each pick list is appended to a hidden
+journal next to it instead. The manifest is rewritten once, at the end of the
+run, and a run that crashed before then is picked up from the journal.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .util import atomic_open
+
+MANIFEST = 'aggregate_manifest.json'
+JOURNAL = '.aggregate_manifest.journal'
+
+
+def file_sha256(filename):
+    """Hex SHA-256 digest of the contents of a file"""
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class AggregateManifest:
+    """Inputs packed into an output folder, and its open (incomplete) plate
+
+    Parameters
+    ----------
+    output_folder : str
+        Folder of the echo pick lists, where the manifest is kept
+    """
+
+    def __init__(self, output_folder):
+        self.filename = os.path.join(output_folder, MANIFEST)
+        self.journal = os.path.join(output_folder, JOURNAL)
+        self.inputs = {}
+        self.open_plate = None
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                manifest = json.load(f)
+            self.inputs = manifest['inputs']
+            self.open_plate = manifest['open_plate']
+        if os.path.exists(self.journal):
+            # Pick lists of a run that stopped before saving
+            with open(self.journal) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Cut short by the crash
+                        break
+                    self._apply(entry)
+            self.save()
+
+    def check(self, filename, digest):
+        """Whether a file's rows are already in a pick list
+
+        Returns
+        -------
+        reason : str or None
+            Why the file should be skipped, or None if it is new
+        """
+        record = self.inputs.get(os.path.abspath(filename))
+        if record is None:
+            return None
+        if record['sha256'] != digest:
+            return 'changed since it was packed'
+        return 'already packed'
+
+    def record(self, filename, digest, picklist_number=None):
+        """Note that (some of) the file's rows went into this pick list"""
+        path = os.path.abspath(filename)
+        record = self.inputs.setdefault(path, dict(sha256=digest,
+                                                   picklists=[]))
+        if (picklist_number is not None
+                and picklist_number not in record['picklists']):
+            record['picklists'].append(picklist_number)
+
+    def add_picklist(self, picklist_number, sources, dataframe=None):
+        """Record a pick list as soon as it is written, in the journal
+
+        Parameters
+        ----------
+        picklist_number : int
+        sources : list of (filename, digest)
+            Files with rows in the pick list
+        dataframe : pandas.DataFrame, optional
+            Rows of the pick list if it is incomplete, see
+            :meth:`set_open_plate`
+        """
+        entry = dict(number=picklist_number,
+                     inputs=[[os.path.abspath(filename), digest]
+                             for filename, digest in sources],
+                     open_plate=None)
+        if dataframe is not None:
+            entry['open_plate'] = _open_plate(picklist_number, dataframe)
+        self._apply(entry)
+        with open(self.journal, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def _apply(self, entry):
+        for filename, digest in entry['inputs']:
+            self.record(filename, digest, entry['number'])
+        self.open_plate = entry['open_plate']
+
+    def set_open_plate(self, picklist_number, dataframe):
+        """Keep the rows of the incomplete pick list to top it up next time"""
+        self.open_plate = None if dataframe is None \
+            else _open_plate(picklist_number, dataframe)
+
+    def open_plate_columns(self, dtypes=None):
+        """Rows of the incomplete pick list as numpy columns"""
+        dtypes = {} if dtypes is None else dtypes
+        return {name: np.array(values, dtype=dtypes.get(name, object))
+                for name, values in self.open_plate['columns'].items()}
+
+    def save(self):
+        """Write the whole manifest, which the journal is then part of"""
+        with atomic_open(self.filename) as f:
+            json.dump(dict(inputs=self.inputs, open_plate=self.open_plate), f,
+                      indent=1)
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+
+
+def _open_plate(picklist_number, dataframe):
+    columns = {name: _to_json_list(dataframe[name])
+               for name in dataframe.columns}
+    return dict(number=picklist_number, columns=columns)
+
+
+def _to_json_list(series):
+    values = series.to_numpy()
+    if values.dtype.kind in 'biuf':
+        return values.tolist()
+    return [None if value is None else str(value) for value in values]
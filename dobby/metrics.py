@@ -0,0 +1,169 @@
+"""Timers and counters of where the time of a run goes
+
+Stages are timed by wrapping them in :func:`timer`, either as a context
+manager or as a decorator, and events are counted with :func:`count`::
+
+    with metrics.timer('parse'):
+        fluorescence = _parse_fluorescence(filename)
+    metrics.count('plates_processed')
+
+Both go to the metrics of the current run, which commands decorated with
+:func:`metrics_options` reset before running and can dump as JSON with
+--metrics-json. Work done in worker processes is measured with
+:func:`measured`, which returns the metrics of a call so the parent can
+:func:`merge` them into its own, along with the files the call wrote.
+"""
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+import click
+
+from .util import atomic_open, record_outputs, recording_outputs
+
+
+class Metrics:
+    """Total time, number of calls and longest call of each timer, and the
+    value of each counter
+
+    Timers and counters can be added to from several threads at once.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds, calls=1, longest=None):
+        longest = seconds if longest is None else longest
+        with self._lock:
+            total, n, slowest = self.timers.get(name, (0.0, 0, 0.0))
+            self.timers[name] = (total + seconds, n + calls,
+                                 max(slowest, longest))
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other):
+        """Add the timers and counters of :meth:`as_dict` to these"""
+        for name, timer in other['timers'].items():
+            self.add_time(name, timer['seconds'], timer['calls'],
+                          timer['max_seconds'])
+        for name, n in other['counters'].items():
+            self.count(name, n)
+
+    def as_dict(self):
+        timers = {name: dict(seconds=total, calls=calls, max_seconds=longest)
+                  for name, (total, calls, longest)
+                  in sorted(self.timers.items())}
+        return dict(timers=timers, counters=dict(sorted(self.counters.items())))
+
+
+_current = Metrics()
+
+
+def current():
+    """Metrics of the current run"""
+    return _current
+
+
+def reset():
+    global _current
+    _current = Metrics()
+    return _current
+
+
+@contextlib.contextmanager
+def timer(name):
+    """Add the time spent in the block, or the decorated function, to
+    ``name``"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current.add_time(name, time.perf_counter() - start)
+
+
+def count(name, n=1):
+    _current.count(name, n)
+
+
+def merge(other):
+    """Add metrics from :func:`measured` to the current run, and the files
+    written in the call to those being recorded"""
+    _current.merge(other)
+    record_outputs(other.get('outputs', ()))
+
+
+def measured(function, *args, **kwargs):
+    """Call a function with metrics of its own, e.g. in a worker process
+
+    Returns
+    -------
+    result
+        What the function returned
+    metrics : dict
+        Timers and counters of the call, see :meth:`Metrics.as_dict`, and
+        as "outputs" the files it wrote, see
+        :func:`dobby.util.recording_outputs`
+    """
+    global _current
+    outer, _current = _current, Metrics()
+    try:
+        with recording_outputs() as outputs:
+            result = function(*args, **kwargs)
+        return result, dict(_current.as_dict(), outputs=list(outputs))
+    finally:
+        _current = outer
+
+
+def write_json(filename, command_name, wall_seconds):
+    """Write the metrics of the current run to a JSON file"""
+    report = dict(command=command_name, pid=os.getpid(),
+                  wall_seconds=wall_seconds, **_current.as_dict())
+    with atomic_open(filename) as f:
+        json.dump(report, f, indent=1)
+
+
+def metrics_options(command):
+    """Add --metrics-json and --profile to a command
+
+    The metrics are written even if the command fails, so a slow or failing
+    batch can be looked into afterwards.
+    """
+    @functools.wraps(command)
+    def wrapper(*args, metrics_json=None, profile=None, **kwargs):
+        reset()
+        profiler = None
+        if profile is not None:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            return command(*args, **kwargs)
+        finally:
+            wall_seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile)
+                click.echo(f'Wrote profile to {profile}')
+            if metrics_json is not None:
+                name = click.get_current_context().info_name
+                write_json(metrics_json, name, wall_seconds)
+                click.echo(f'Wrote metrics to {metrics_json}')
+
+    wrapper = click.option(
+        '--profile', default=None, type=click.Path(dir_okay=False),
+        help='Run under cProfile and write its stats to this file, e.g. to '
+             'look at with "python -m pstats". Only the main process is '
+             'profiled')(wrapper)
+    wrapper = click.option(
+        '--metrics-json', default=None, type=click.Path(dir_okay=False),
+        help='Write the time spent in each stage, and counts of plates and '
+             'rows processed, to this JSON file')(wrapper)
+    return wrapper
@@ -0,0 +1,138 @@
+"""Pack the samples of source plates into as few source plates per pick list
+
+Every source plate the Echo needs for a destination plate is a plate swap,
+so pick lists drawing each from a few source plates transfer faster than
+pick lists filled with samples in the order their files come in. Packing
+still fills every destination plate but the last, and keeps the samples of
+a source plate together wherever it can:
+
+1. A source plate with at least a destination plate's worth of samples
+   fills whole destination plates on its own, one after the other.
+2. The samples left over from each source plate are packed whole, largest
+   first, each into the destination plate it fills best (best-fit
+   decreasing), opening a new one if it fits nowhere.
+3. Destination plates still not full are topped up, fullest first, with
+   the source plates of the emptiest ones, splitting at most one source
+   plate per destination plate. The one left partially filled is last.
+
+Only the sizes of the source plates are needed to plan, so a plan for
+thousands of source plates takes a fraction of a second.
+"""
+import bisect
+
+
+def plan_plates(sizes, capacity, first=None):
+    """Plan which samples of which source plates go to each destination plate
+
+    Parameters
+    ----------
+    sizes : list of int
+        Number of samples of each source plate
+    capacity : int
+        Number of wells of a destination plate
+    first : int, optional
+        Source plate to start the first destination plate with, whole, e.g.
+        the samples already in an incomplete pick list being topped up
+
+    Returns
+    -------
+    plates : list of list of (source, start, stop)
+        Destination plates, each a list of the ranges of samples of source
+        plates, in order, that go into it. Every plate but the last is full
+    """
+    if capacity <= 0:
+        raise ValueError(f'Destination plates need wells, not {capacity}')
+    if first is not None and sizes[first] > capacity:
+        raise ValueError(f'The first source plate has {sizes[first]} '
+                         f'samples, more than the {capacity} wells of a '
+                         f'destination plate')
+    if first is not None and sizes[first] == 0:
+        first = None
+
+    full = []
+    bins = []
+    fills = []
+    gaps = []
+    if first is not None:
+        bins.append([(first, 0, sizes[first])])
+        fills.append(sizes[first])
+
+    # 1. Whole destination plates from the largest source plates
+    remainders = []
+    for source, size in enumerate(sizes):
+        if source == first:
+            continue
+        start = 0
+        while size - start >= capacity:
+            full.append([(source, start, start + capacity)])
+            start += capacity
+        if start < size:
+            remainders.append((size - start, source, start))
+
+    # 2. Best-fit decreasing of what's left, ties in source order. The bins
+    # with wells left are kept sorted by how many wells they have left
+    if bins and fills[0] < capacity:
+        gaps.append((capacity - fills[0], 0))
+    remainders.sort(key=lambda remainder: (-remainder[0], remainder[1]))
+    for size, source, start in remainders:
+        i = bisect.bisect_left(gaps, (size, -1))
+        if i < len(gaps):
+            gap, b = gaps.pop(i)
+        else:
+            gap, b = capacity, len(bins)
+            bins.append([])
+            fills.append(0)
+        bins[b].append((source, start, start + size))
+        fills[b] += size
+        if gap > size:
+            bisect.insort(gaps, (gap - size, b))
+
+    # 3. Top up the fullest bins from the emptiest ones, the bin of the
+    # first source plate first, so that it's never split
+    open_bins = sorted((b for b in range(len(bins)) if fills[b] < capacity),
+                       key=lambda b: (b != 0 or first is None, -fills[b], b))
+    full += [bins[b] for b in range(len(bins)) if fills[b] == capacity]
+    receivers = [bins[b] for b in open_bins]
+    while len(receivers) > 1:
+        _top_up(receivers[0], receivers[-1], capacity)
+        if not receivers[-1]:
+            receivers.pop()
+        if _fill(receivers[0]) == capacity:
+            full.append(receivers.pop(0))
+
+    first_plate = bins[0] if first is not None else None
+    partial = receivers[0] if receivers else None
+    if partial is not None and partial is first_plate and full:
+        # The first destination plate can't be the partial one, so it
+        # takes samples from the last full plate, which becomes it
+        partial = full.pop()
+        _top_up(first_plate, partial, capacity)
+        full.append(first_plate)
+
+    plates = [plate for plate in full if plate is first_plate]
+    plates += [plate for plate in full if plate is not first_plate]
+    if partial is not None:
+        plates.append(partial)
+    return [_in_order(plate, first) for plate in plates if plate]
+
+
+def _top_up(receiver, donor, capacity):
+    """Move samples from the end of a donor bin until a bin is full"""
+    wanted = capacity - _fill(receiver)
+    while wanted > 0 and donor:
+        source, start, stop = donor.pop()
+        moved = min(wanted, stop - start)
+        receiver.append((source, start, start + moved))
+        if start + moved < stop:
+            donor.append((source, start + moved, stop))
+        wanted -= moved
+
+
+def _fill(plate):
+    return sum(stop - start for _, start, stop in plate)
+
+
+def _in_order(plate, first=None):
+    """Samples of a destination plate by source plate, the first one first"""
+    return sorted(plate, key=lambda part: (part[0] != first, part[0],
+                                           part[1]))
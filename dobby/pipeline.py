@@ -0,0 +1,243 @@
+"""Go from plate reader exports to ECHO pick lists and sample sheets in one go
+
+"dobby run" does what "dobby cherrypick", "dobby aggregate" and "dobby
+samplesheet" do one after the other, but passes the tables from one step to
+the next in memory instead of writing them to CSVs and reading them back. Only
+the final pick lists and sample sheets are written, plus the per-plate
+outputs of "dobby cherrypick" if asked for.
+"""
+import os
+
+import numpy as np
+
+import click
+
+from . import aggregate as agg
+from . import cherrypick as cp
+from . import heatmap, metrics
+from .flagrecords import deferred_exports
+from .geometry import PLATE_384
+from .samplesheet import TEMPLATES, fill_template, samplesheet_filename
+from .util import atomic_to_csv
+
+INTERMEDIATES_FOLDER = 'cherrypicked'
+
+
+def cherrypick_plates(jobs, intermediates_folder=None, plot=False,
+                      **kwargs):
+    """Cherrypick plates one by one, keeping the pick lists in memory
+
+    Parameters
+    ----------
+    jobs : list of (filename, plate_name, mouse_id)
+        Plate reader exports to cherrypick
+    intermediates_folder : str, optional
+        If given, also write the pick lists (and plots, if ``plot``) of each
+        plate here, and record flagged plates, as "dobby cherrypick" does
+    kwargs
+        Options of "dobby cherrypick", such as ``standards`` or
+        ``r_minimum``
+
+    Returns
+    -------
+    pick_lists : list of pandas.DataFrame
+        Tidy cherrypicked tables of the plates passing every sanity check
+    results : list of (plate_name, status, detail)
+        Where status is one of "passed", "flagged" or "error"
+    """
+    filetype = kwargs.pop('filetype', 'auto')
+    pick_list_format = kwargs.pop('pick_list_format', 'csv')
+    plot_formats = dict(plot_format=kwargs.pop('plot_format', 'pdf'),
+                        plot_dpi=kwargs.pop('plot_dpi', heatmap.DPI))
+    kwargs['standards'] = cp._parse_standards(
+        kwargs.get('standards', cp.STANDARDS_STR))
+
+    pick_lists = []
+    results = []
+    # The CSV of the flag record is written once, after every plate
+    with deferred_exports():
+        for filename, plate_name, mouse_id in jobs:
+            try:
+                fluorescence = cp._parse_fluorescence(filename, filetype)
+                plate = cp.cherrypick_plate(fluorescence, plate_name,
+                                            mouse_id, **kwargs)
+                detail = ''
+                if intermediates_folder is not None:
+                    detail = cp.write_plate(
+                        plate, fluorescence, plate_name, mouse_id,
+                        intermediates_folder, plot=plot,
+                        pick_list_format=pick_list_format, **plot_formats)
+            except Exception as e:
+                results.append((plate_name, 'error',
+                                f'{type(e).__name__}: {e}'))
+                continue
+
+            if all(plate.checks):
+                pick_lists.append(plate.pick_lists['cherrypicked']
+                                  .sort_values(['row_letter',
+                                                'column_number']))
+                results.append((plate_name, 'passed', detail))
+            else:
+                failed = [check for check, passed
+                          in zip(cp.SANITY_CHECKS, plate.checks)
+                          if not passed]
+                results.append((plate_name, 'flagged',
+                                f'failed {", ".join(failed)}'))
+    return pick_lists, results
+
+
+def pack_pick_lists(pick_lists, first_number=1,
+                    desired_concentration=agg.DESIRED_CONCENTRATION,
+                    geometry=PLATE_384, packing='in-order'):
+    """Pack tidy pick lists into formatted ECHO pick lists, one per
+    destination plate of ``geometry``, in order or with the fewest source
+    plates per pick list (``packing='fewest-sources'``)
+
+    Returns
+    -------
+    picklists : list of (number, is_incomplete, pandas.DataFrame)
+    """
+    packed = []
+    number = first_number
+    if packing == 'fewest-sources':
+        packed_tables = agg.dataframes_packed_generator(iter(pick_lists),
+                                                        geometry.n_wells)
+    else:
+        packed_tables = agg.dataframes_ofsize_generator(iter(pick_lists),
+                                                        geometry.n_wells)
+    for dataframe, is_lessthan_desired_size, _, _ in packed_tables:
+        packed.append((number, is_lessthan_desired_size,
+                       agg.format_echopicklist(dataframe,
+                                               is_lessthan_desired_size,
+                                               desired_concentration,
+                                               geometry)))
+        number += 1
+    return packed
+
+
+def _n_picklists(pick_lists, plate_size=agg.PLATE_SIZE):
+    n_samples = sum(len(pick_list) for pick_list in pick_lists)
+    return int(np.ceil(n_samples / plate_size))
+
+
+@click.command(short_help="Cherrypick plates, aggregate them into ECHO pick "
+                          "lists and make their sample sheets in one go")
+@click.argument('inputs', nargs=-1, required=True,
+                type=click.Path(exists=True, readable=True))
+@click.option('--metadata', required=True,
+              type=click.Path(dir_okay=False, readable=True),
+              help='CSV of plate metadata whose first column is the plate '
+                   'name')
+@click.option('--mouse-id-col', default='mouse.id',
+              help='Column of the metadata containing the mouse ID')
+@click.option('--pattern', default='*.txt',
+              help='Pattern of plate reader files to use from folders given '
+                   'as inputs')
+@click.option('--templates', default=None,
+              help='Comma-separated sample sheet templates, one per pick '
+                   'list in the order the pick lists are numbered. If not '
+                   'given, no sample sheets are made')
+@click.option('--sample-id-col', default="Combined name",
+              help='Column of the pick lists with the sample ID to be used in '
+                   'the sample sheets')
+@click.option('--desired-concentration', default=agg.DESIRED_CONCENTRATION,
+              type=float, help='Concentration (ng/ul) to dilute samples to')
+@click.option('--intermediates/--no-intermediates', default=False,
+              help='Also write the outputs of "dobby cherrypick" for each '
+                   'plate, in a "cherrypicked" folder in the output folder')
+@click.option('--plot/--no-plot', default=False,
+              help='Draw the plots of each plate. Only with --intermediates')
+@agg.plate_size_option
+@agg.packing_option
+@cp._cherrypick_options
+@metrics.metrics_options
+def run(inputs, metadata, mouse_id_col, pattern, templates, sample_id_col,
+        desired_concentration, intermediates, plot, plate_size, packing,
+        output_folder, subtract_blank_concentration_csv, **kwargs):
+    """Turn plate reader exports into ECHO pick lists and sample sheets
+
+    Plates are cherrypicked in the order given (files in folders are
+    sorted), the ones passing every sanity check are packed into pick lists
+    of --plate-size wells as --packing says, numbered after those already
+    in the output folder, and each pick list gets a sample sheet from the
+    next of --templates.
+
+    \b
+    Parameters
+    ----------
+    inputs : str
+        Plate reader files, or folders containing them. The plate name is
+        the filename up to the first "."
+    """
+    mouse_ids = cp._read_mouse_ids(metadata, mouse_id_col)
+    template_names = []
+    if templates is not None:
+        template_names = [name.strip() for name in templates.split(',')]
+        unknown = [name for name in template_names if name not in TEMPLATES]
+        if unknown:
+            raise click.BadParameter(
+                f'{", ".join(unknown)} are not valid templates. Available '
+                f'templates are: {TEMPLATES.names_str}',
+                param_hint='--templates')
+
+    jobs = []
+    results = []
+    for filename in cp._find_plate_files(inputs, pattern):
+        plate_name = cp._filename_to_plate_name(filename)
+        if plate_name not in mouse_ids.index:
+            results.append((plate_name, 'error', 'not found in metadata'))
+            continue
+        jobs.append((filename, plate_name, mouse_ids[plate_name]))
+
+    os.makedirs(output_folder, exist_ok=True)
+    intermediates_folder = None
+    if intermediates:
+        intermediates_folder = os.path.join(output_folder,
+                                            INTERMEDIATES_FOLDER)
+        if subtract_blank_concentration_csv:
+            kwargs['datatypes'] = cp.PICK_LISTS
+    pick_lists, plate_results = cherrypick_plates(
+        jobs, intermediates_folder, plot=plot, **kwargs)
+    results = plate_results + results
+
+    click.echo('\nplate\tstatus\tdetail')
+    for plate_name, status, detail in results:
+        click.echo(f'{plate_name}\t{status}\t{detail}')
+    statuses = [status for _, status, _ in results]
+    metrics.count('plates_errored', statuses.count('error'))
+    click.echo(f'{statuses.count("passed")} passed, '
+               f'{statuses.count("flagged")} flagged, '
+               f'{statuses.count("error")} errors\n')
+
+    n_picklists = _n_picklists(pick_lists, plate_size.n_wells)
+    if template_names and len(template_names) < n_picklists:
+        raise click.ClickException(
+            f'{n_picklists} pick lists need sample sheets, but only '
+            f'{len(template_names)} templates were given')
+
+    first_number = agg.largest_enumeration_in_outputfolder(output_folder) + 1
+    packed = pack_pick_lists(pick_lists, first_number, desired_concentration,
+                             plate_size, packing)
+    for (number, is_incomplete, picklist), template_name in zip(
+            packed, template_names + [None] * len(packed)):
+        # Numbers taken by other runs since are skipped
+        number = agg.reserve_picklist_number(output_folder, number)
+        try:
+            agg.write_csv_from_dataframe(picklist, number, output_folder,
+                                         is_incomplete)
+        finally:
+            # Written or not, the number no longer needs its reservation
+            agg.release_picklist_numbers(output_folder, [number])
+        csv = agg.picklist_filename(number, output_folder, is_incomplete)
+        click.echo(f'Wrote {csv}')
+        if template_name is None:
+            continue
+        sheet = fill_template(picklist, TEMPLATES[template_name],
+                              sample_id_col)
+        sheet_csv = samplesheet_filename(csv, output_folder)
+        with metrics.timer('write_samplesheet'):
+            atomic_to_csv(sheet, sheet_csv, index=False)
+        click.echo(f'Wrote {sheet_csv} using {template_name}')
+
+    if 'error' in statuses:
+        raise click.ClickException('Some plates could not be cherrypicked')
@@ -0,0 +1,189 @@
+"""Read the fluorescence block out of plate reader exports
+
+Plate reader exports (e.g. SoftMax Pro "txt" exports, which are UTF-16
+encoded, or CSVs) have a few lines of header, then a row of the column
+numbers 1-24 and then one line per plate row. This reader sniffs the encoding
+and delimiter from the first bytes of the file, finds that header row and
+reads only the 16 x 24 block of values after it.
+"""
+import codecs
+import io
+
+import numpy as np
+
+from .geometry import PLATE_384, row_names
+
+N_ROWS = PLATE_384.n_rows
+N_COLUMNS = PLATE_384.n_columns
+ROW_LETTERS = ''.join(PLATE_384.row_names)
+
+# Bytes used to guess the encoding and delimiter
+SNIFF_SIZE = 512
+
+BOMS = ((codecs.BOM_UTF8, 'utf-8-sig'),
+        (codecs.BOM_UTF16_LE, 'utf-16'),
+        (codecs.BOM_UTF16_BE, 'utf-16'))
+
+EXCEL_MAGIC = (b'PK\x03\x04', b'\xd0\xcf\x11\xe0')
+
+
+class PlateReaderFormatError(ValueError):
+    """Raised when a plate reader export does not have the expected layout"""
+    pass
+
+
+def sniff_encoding(head):
+    """Guess the text encoding of a file from its first bytes
+
+    Parameters
+    ----------
+    head : bytes
+        The first few hundred bytes of the file
+
+    Returns
+    -------
+    encoding : str or None
+        Name of the encoding, or None if this looks like an Excel file
+    """
+    if head.startswith(EXCEL_MAGIC):
+        return None
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    # UTF-16 without a byte order mark has a zero byte in every other
+    # position for ASCII text
+    if head and head[1::2].count(0) > len(head) // 4:
+        return 'utf-16-le'
+    if head and head[0::2].count(0) > len(head) // 4:
+        return 'utf-16-be'
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Could just be a multi-byte character cut off at the end of the head
+        if e.start < len(head) - 3:
+            return 'latin-1'
+    return 'utf-8'
+
+
+def sniff_format(filename):
+    """Guess the encoding and delimiter of a plate reader export
+
+    Returns
+    -------
+    encoding : str or None
+        Text encoding, or None if the file is an Excel workbook
+    delimiter : str or None
+        Either a tab or a comma, or None for Excel workbooks
+    """
+    with open(filename, 'rb') as f:
+        head = f.read(SNIFF_SIZE)
+    encoding = sniff_encoding(head)
+    if encoding is None:
+        return None, None
+    text = head.decode(encoding, errors='ignore')
+    delimiter = '\t' if text.count('\t') >= text.count(',') else ','
+    return encoding, delimiter
+
+
+def _column_numbers_offset(fields, n_columns=N_COLUMNS):
+    """Position of the "1" of a 1, 2, ..., n_columns header, or None"""
+    expected = [str(i) for i in range(1, n_columns + 1)]
+    fields = [field.strip().strip('"') for field in fields]
+    for offset in range(len(fields) - n_columns + 1):
+        if fields[offset:offset + n_columns] == expected:
+            return offset
+    return None
+
+
+def read_block(lines, delimiter, filename='<plate>', n_rows=N_ROWS,
+               n_columns=N_COLUMNS):
+    """Read the block of values following the row of column numbers
+
+    Parameters
+    ----------
+    lines : iterable of str
+        Lines of the export
+    delimiter : str
+        Field separator
+    filename : str
+        Used in error messages
+    n_rows, n_columns : int
+        Shape of the plate
+
+    Returns
+    -------
+    values : numpy.ndarray
+        (n_rows, n_columns) array of float64 values
+    """
+    lines = iter(lines)
+    offset = None
+    for line_number, line in enumerate(lines, start=1):
+        offset = _column_numbers_offset(line.rstrip('\r\n').split(delimiter),
+                                        n_columns)
+        if offset is not None:
+            break
+    if offset is None:
+        raise PlateReaderFormatError(
+            f'{filename}: could not find the header row with the column '
+            f'numbers 1-{n_columns}. Is this a plate reader export?')
+
+    values = np.empty((n_rows, n_columns), dtype=np.float64)
+    for i, row_letter in enumerate(row_names(n_rows)):
+        line = next(lines, None)
+        if line is None or not line.strip() or line.startswith('~End'):
+            raise PlateReaderFormatError(
+                f'{filename}: found only {i} of {n_rows} rows of values '
+                f'after the header on line {line_number}. Is the export '
+                f'truncated?')
+        fields = line.rstrip('\r\n').split(delimiter)
+        row = fields[offset:offset + n_columns]
+        if len(row) < n_columns:
+            raise PlateReaderFormatError(
+                f'{filename}: row {row_letter} has only {len(row)} of '
+                f'{n_columns} values. Is the export truncated?')
+        try:
+            values[i] = row
+        except ValueError:
+            column = next(j for j, field in enumerate(row, start=1)
+                          if not _is_number(field))
+            raise PlateReaderFormatError(
+                f'{filename}: could not read {row[column - 1]!r} in row '
+                f'{row_letter}, column {column} as a number. Is the export '
+                f'truncated or shifted?') from None
+    return values
+
+
+def _is_number(field):
+    try:
+        float(field)
+    except ValueError:
+        return False
+    return True
+
+
+def read_plate(filename, n_rows=N_ROWS, n_columns=N_COLUMNS):
+    """Read the plate of values from a text plate reader export
+
+    Parameters
+    ----------
+    filename : str
+        A tab- or comma-separated plate reader export, in any of UTF-8,
+        UTF-16 or Latin-1
+
+    Returns
+    -------
+    values : numpy.ndarray
+        (n_rows, n_columns) array of float64 values
+
+    Raises
+    ------
+    PlateReaderFormatError
+        If the file is an Excel workbook, or the block of values is missing,
+        truncated or shifted
+    """
+    encoding, delimiter = sniff_format(filename)
+    if encoding is None:
+        raise PlateReaderFormatError(
+            f'{filename} is an Excel workbook, not a text export')
+    with io.open(filename, encoding=encoding, newline='') as f:
+        return read_block(f, delimiter, filename, n_rows, n_columns)
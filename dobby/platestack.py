@@ -0,0 +1,174 @@
+"""Regression and sanity checks for many plates at once
+
+Works on a stack of plates, a (n_plates, 16, 24) array of fluorescence, and
+computes the same standard curves, concentrations, good cells and sanity
+checks as :mod:`dobby.cherrypick` does for one plate, with a handful of numpy
+operations for the whole stack instead of a pandas pipeline per plate.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from . import platereader
+from .cherrypick import (BLANKS_COL, CONCENTRATIONS_MAXIMUM,
+                         CONCENTRATIONS_MINIMUM, R_MINIMUM, STANDARDS_COL,
+                         STANDARDS_STR)
+
+CHECKS = ('regression', 'blanks', 'samples', 'concentration')
+
+StandardCurves = namedtuple('StandardCurves',
+                            ['standards', 'means', 'slope', 'intercept',
+                             'rvalue'])
+
+StackResult = namedtuple('StackResult',
+                         ['curves', 'concentrations', 'blanks_mean',
+                          'blanks_std', 'is_good', 'checks', 'passed'])
+
+
+def read_plates(filenames):
+    """Read plate reader exports into a (n_plates, 16, 24) array"""
+    stack = np.empty((len(filenames), platereader.N_ROWS,
+                      platereader.N_COLUMNS), dtype=np.float64)
+    for i, filename in enumerate(filenames):
+        stack[i] = platereader.read_plate(filename)
+    return stack
+
+
+def _parse_standards(standards):
+    if isinstance(standards, str):
+        standards = standards.split(',')
+    return np.asarray(standards, dtype=np.float64)
+
+
+def fit_standard_curves(fluorescence, standards=STANDARDS_STR,
+                        standards_col=STANDARDS_COL, inner=True):
+    """Regress the standards column of every plate against the standards
+
+    Parameters
+    ----------
+    fluorescence : numpy.ndarray
+        (n_plates, n_rows, n_columns) fluorescence
+    standards : str or list of float
+        Known concentration of the standard in each row
+    standards_col : int
+        Column number (starting from 1) containing the standards
+    inner : bool
+        If True, don't use the smallest and largest standards for regressing
+
+    Returns
+    -------
+    curves : StandardCurves
+        The unique standards used, the (n_plates, n_standards) mean
+        fluorescence of each standard, and the slope, intercept and
+        correlation of each plate's regression line
+    """
+    standards = _parse_standards(standards)
+    levels, inverse = np.unique(standards, return_inverse=True)
+
+    # Averaging matrix from rows to the unique standards, so that the means of
+    # every plate are one matrix product
+    averaging = np.zeros((len(standards), len(levels)))
+    averaging[np.arange(len(standards)), inverse] = 1
+    averaging /= averaging.sum(axis=0)
+
+    means = fluorescence[:, :, standards_col - 1] @ averaging
+    if inner:
+        levels = levels[1:-1]
+        means = means[:, 1:-1]
+
+    x = levels - levels.mean()
+    y = means - means.mean(axis=1, keepdims=True)
+    ssx = (x ** 2).sum()
+    ssy = (y ** 2).sum(axis=1)
+    ssxy = y @ x
+
+    slope = ssxy / ssx
+    intercept = means.mean(axis=1) - slope * levels.mean()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rvalue = np.clip(ssxy / np.sqrt(ssx * ssy), -1, 1)
+    return StandardCurves(levels, means, slope, intercept, rvalue)
+
+
+def to_concentrations(fluorescence, curves):
+    """Convert fluorescence to concentrations with each plate's own curve"""
+    slope = curves.slope[:, np.newaxis, np.newaxis]
+    intercept = curves.intercept[:, np.newaxis, np.newaxis]
+    return (fluorescence - intercept) / slope
+
+
+def blank_stats(concentrations, blanks_col=BLANKS_COL):
+    """Mean and (sample) standard deviation of each plate's blanks"""
+    blanks = concentrations[:, :, blanks_col - 1]
+    return np.nanmean(blanks, axis=1), np.nanstd(blanks, axis=1, ddof=1)
+
+
+def good_cells(concentrations, blanks_mean, blanks_std, blanks_col=BLANKS_COL,
+               n_std=1):
+    """Wells brighter than the blanks, without standards or blanks
+
+    Returns
+    -------
+    is_good : numpy.ndarray
+        (n_plates, n_rows, blanks_col - 1) boolean array, True for wells
+        whose concentration is more than ``n_std`` standard deviations above
+        the mean of the blanks
+    """
+    threshold = blanks_mean + n_std * blanks_std
+    samples = concentrations[:, :, :blanks_col - 1]
+    return samples > threshold[:, np.newaxis, np.newaxis]
+
+
+def good_cells_stats(concentrations, is_good):
+    """Mean and (population) standard deviation of each plate's good cells"""
+    samples = concentrations[:, :, :is_good.shape[2]]
+    n_good = is_good.sum(axis=(1, 2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(is_good, samples, 0).sum(axis=(1, 2)) / n_good
+        deviations = samples - mean[:, np.newaxis, np.newaxis]
+        variance = np.where(is_good, deviations ** 2, 0).sum(axis=(1, 2))
+        std = np.sqrt(variance / n_good)
+    return mean, std
+
+
+def analyze(fluorescence, standards=STANDARDS_STR,
+            standards_col=STANDARDS_COL, blanks_col=BLANKS_COL, inner=True,
+            r_minimum=R_MINIMUM, concentrations_minimum=CONCENTRATIONS_MINIMUM,
+            concentrations_maximum=CONCENTRATIONS_MAXIMUM):
+    """Regress, convert and sanity check a whole stack of plates
+
+    Parameters
+    ----------
+    fluorescence : numpy.ndarray
+        (n_plates, 16, 24) fluorescence, e.g. from :func:`read_plates`
+
+    Other parameters are the same as for ``dobby.cherrypick.main``
+
+    Returns
+    -------
+    result : StackResult
+        Standard curves, concentrations, blank statistics and good cells of
+        every plate, and the outcome of each sanity check in ``CHECKS`` as a
+        dict of (n_plates,) boolean arrays. ``passed`` is True for plates
+        passing every check, i.e. the ones that would not be flagged
+    """
+    fluorescence = np.asarray(fluorescence, dtype=np.float64)
+    if fluorescence.ndim == 2:
+        fluorescence = fluorescence[np.newaxis]
+
+    curves = fit_standard_curves(fluorescence, standards, standards_col,
+                                 inner)
+    concentrations = to_concentrations(fluorescence, curves)
+    blanks_mean, blanks_std = blank_stats(concentrations, blanks_col)
+    is_good = good_cells(concentrations, blanks_mean, blanks_std, blanks_col)
+    good_mean, good_std = good_cells_stats(concentrations, is_good)
+
+    checks = {
+        'regression': curves.rvalue >= r_minimum,
+        'blanks': blanks_mean > 0,
+        'samples': good_mean + good_std > concentrations_minimum,
+        'concentration': np.all(concentrations <= concentrations_maximum,
+                                axis=(1, 2)),
+    }
+    passed = np.logical_and.reduce([checks[check] for check in CHECKS])
+    return StackResult(curves, concentrations, blanks_mean, blanks_std,
+                       is_good, checks, passed)
@@ -0,0 +1,119 @@
+"""Cache of plates already cherrypicked into an output folder
+
+Each plate is keyed on the SHA-256 of its plate reader export and every
+parameter that changes its outputs (plate name, mouse ID, standards, columns
+and thresholds), so rerunning cherrypick over a folder of plates skips the
+ones already done before even parsing them, and redoes only those whose
+file or parameters changed. The cache is a SQLite database in the output
+folder, so that the workers of "dobby cherrypick-batch" can share it.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+
+from . import __version__
+from .flagrecords import TIMEOUT
+from .manifest import file_sha256
+
+CACHE_DB = 'cherrypick_cache.sqlite'
+
+SCHEMA_VERSION = 1
+
+
+def cache_key(filename, **parameters):
+    """Key of a plate reader export cherrypicked with some parameters
+
+    Parameters are hashed as JSON, so they should be plain values. Results
+    of other versions of dobby never match.
+    """
+    keyed = dict(parameters, input_sha256=file_sha256(filename),
+                 dobby=__version__)
+    encoded = json.dumps(keyed, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class ResultCache:
+    """Output folder of each plate cherrypicked, by :func:`cache_key`
+
+    Parameters
+    ----------
+    folder : str
+        Output folder of cherrypick, holding the database
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.db_path = os.path.join(folder, CACHE_DB)
+        os.makedirs(folder, exist_ok=True)
+        with self._transaction() as connection:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version < SCHEMA_VERSION:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS results ('
+                    'key TEXT PRIMARY KEY, '
+                    'plate TEXT NOT NULL, '
+                    'output_folder TEXT NOT NULL, '
+                    'outputs TEXT NOT NULL)')
+                connection.execute(
+                    f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=TIMEOUT,
+                               isolation_level=None)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            yield connection
+            connection.execute('COMMIT')
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+
+    def get(self, key):
+        """Output folder of a cached plate, if its outputs are all still there
+
+        Returns
+        -------
+        output_folder : str or None
+            None if the plate isn't cached, or any of its outputs was removed
+        """
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT output_folder, outputs FROM results WHERE key = ?',
+                (key,)).fetchone()
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        output_folder, outputs = row
+        paths = [os.path.join(self.folder, path)
+                 for path in json.loads(outputs)]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        if output_folder == os.curdir:
+            return self.folder
+        return os.path.join(self.folder, output_folder)
+
+    def put(self, key, plate_name, output_folder, outputs):
+        """Record the output folder and output files of a plate
+
+        Paths are stored relative to the cache's folder, so it can be moved
+        """
+        def relative(path):
+            return os.path.relpath(path, self.folder)
+
+        with self._transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO results '
+                '(key, plate, output_folder, outputs) VALUES (?, ?, ?, ?)',
+                (key, plate_name, relative(output_folder),
+                 json.dumps([relative(path) for path in outputs])))
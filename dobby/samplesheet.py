@@ -1,31 +1,150 @@
 import os
-import glob
 
 import click
+import numpy as np
 import pandas as pd
 
-from .util import maybe_make_directory
+from .geometry import PLATE_1536
+from .util import atomic_to_csv, maybe_make_directory
 
-TEMPLATE_SAMPLE_ID_COL = 'SampleID'
+TEMPLATE_SAMPLE_ID_COL = 'Sample_ID'
+# The XT-C templates name the sample ID column as Illumina does, and the
+# i5/i7 templates without the underscore
+TEMPLATE_SAMPLE_ID_COLS = (TEMPLATE_SAMPLE_ID_COL, 'SampleID')
 TEMPLATE_SAMPLE_NAME_COL = 'Sample_Name'
+TEMPLATE_WELL_COL = 'well_id'
+
+PICKLIST_WELL_COL = 'Destination well'
 
 TEMPLATE_FOLDER = os.path.join(os.path.dirname(__file__),
                                'samplesheet_templates')
 
-AVAILABLE_TEMPLATES = [os.path.basename(x).split('.csv')[0] for x in
-                       glob.iglob(os.path.join(TEMPLATE_FOLDER, '*.csv'))]
 
-AVAILABLE_TEMPLATES_STR = ', '.join([f'"{x}"' for x in AVAILABLE_TEMPLATES])
+class TemplateRegistry:
+    """Sample sheet templates, each read only once and only when first used
+
+    Parameters
+    ----------
+    folder : str
+        Folder of template CSVs, named after the template
+    """
+
+    def __init__(self, folder=TEMPLATE_FOLDER):
+        self.folder = folder
+        self._names = None
+        self._templates = {}
+
+    @property
+    def names(self):
+        if self._names is None:
+            self._names = sorted(os.path.splitext(f)[0]
+                                 for f in os.listdir(self.folder)
+                                 if f.endswith('.csv'))
+        return self._names
+
+    @property
+    def names_str(self):
+        return ', '.join([f'"{x}"' for x in self.names])
+
+    def __contains__(self, template_name):
+        return template_name in self.names
+
+    def __getitem__(self, template_name):
+        """A copy of the template, safe to fill in"""
+        if template_name not in self._templates:
+            if template_name not in self:
+                raise FileNotFoundError(f'{template_name} is not a valid '
+                                        f'template. Available templates '
+                                        f'are: {self.names_str}')
+            csv = os.path.join(self.folder, f'{template_name}.csv')
+            self._templates[template_name] = pd.read_csv(csv)
+        return self._templates[template_name].copy()
+
+
+TEMPLATES = TemplateRegistry()
+
+
+def __getattr__(name):
+    # Only list the template folder when these are asked for
+    if name == 'AVAILABLE_TEMPLATES':
+        return TEMPLATES.names
+    if name == 'AVAILABLE_TEMPLATES_STR':
+        return TEMPLATES.names_str
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def template_sample_id_col(table):
+    """The sample ID column of a template or sample sheet
+
+    The first of :data:`TEMPLATE_SAMPLE_ID_COLS` that ``table`` has, or
+    :data:`TEMPLATE_SAMPLE_ID_COL` if it has none of them
+    """
+    for col in TEMPLATE_SAMPLE_ID_COLS:
+        if col in table:
+            return col
+    return TEMPLATE_SAMPLE_ID_COL
 
 
 def _get_template(template_name):
-    try:
-        csv = os.path.join(TEMPLATE_FOLDER, f'{template_name}.csv')
-        return pd.read_csv(csv)
-    except FileNotFoundError:
-        raise FileNotFoundError(f'{template_name} is not a valid template. '
-                                f'Available templates are: '
-                                f'{AVAILABLE_TEMPLATES_STR}')
+    return TEMPLATES[template_name]
+
+
+def fill_template(samples, template, sample_id_col="Combined name"):
+    """Put the samples into the rows of the template for their wells
+
+    Parameters
+    ----------
+    samples : pandas.DataFrame
+        Samples, with their names in ``sample_id_col``. If there is a
+        "Destination well" column, as in the pick lists of "dobby aggregate",
+        each sample goes in the template row of its destination well.
+        Otherwise, samples are taken to be in the order of the template
+    template : pandas.DataFrame
+        Sample sheet template with a row per well
+    sample_id_col : str
+        Column of ``samples`` containing the sample names
+
+    Returns
+    -------
+    samplesheet : pandas.DataFrame
+        The template, with the names of the samples filled in
+    """
+    if PICKLIST_WELL_COL in samples and TEMPLATE_WELL_COL in template:
+        # Wells as indices into the largest plate, which names every well of
+        # smaller ones, so "A01" and "A1" are the same well
+        wells = PLATE_1536.parse(samples[PICKLIST_WELL_COL])
+        template_wells = PLATE_1536.parse(template[TEMPLATE_WELL_COL])
+        unknown = PLATE_1536.names(wells[~np.isin(wells, template_wells)])
+        if len(unknown) > 0:
+            raise ValueError(f'Wells {", ".join(unknown)} are not in the '
+                             f'template')
+        names = np.full(PLATE_1536.n_wells, None, dtype=object)
+        names[wells] = samples[sample_id_col].to_numpy()
+        names = names[template_wells]
+    else:
+        names = samples[sample_id_col]
+    template[template_sample_id_col(template)] = names
+    template[TEMPLATE_SAMPLE_NAME_COL] = names
+    return template
+
+
+def samplesheet_filename(filename, output_folder):
+    basename = os.path.basename(filename)
+    return os.path.join(output_folder,
+                        basename.replace('.csv', '_samplesheet.csv'))
+
+
+def write_samplesheet(filename, template_name, sample_id_col, output_folder):
+    """Fill in a template with the samples of a file and write it"""
+    input_df = pd.read_csv(filename)
+    template = fill_template(input_df, _get_template(template_name),
+                             sample_id_col)
+
+    csv = samplesheet_filename(filename, output_folder)
+    maybe_make_directory(csv)
+    atomic_to_csv(template, csv, index=False)
+    print(f'Wrote {csv}')
+    return csv
 
 
 @click.command(short_help="Create an Illumina sample sheet using a template")
@@ -38,39 +157,110 @@ def _get_template(template_name):
               help='Where to output the sample sheet')
 def samplesheet(filename, template_name, sample_id_col, output_folder):
     """Create sample sheets from included templates
-    
+
     Example:
     $ dobby samplesheet --output-folder test_samplesheet \
         test_aggregate/echo_picklist_00015.csv XT-C-04
-        
+
     Parameters
     ----------
     filename : str
-        Name of the file with the samples sorted in correct order, containing 
-        a column specified by --sample-id-col that has the sample names
+        Name of the file with the samples, containing a column specified by
+        --sample-id-col that has the sample names. Samples go in the template
+        rows of their "Destination well", or if there is no such column, in
+        the order of the template
     template_name : str
         Name of a sample sheet template. Available templates:
-        "XT-C-01", "XT-C-02", "XT-C-03", "XT-C-04", "XT-C-05", "XT-C-06", 
-        "XT-C-07", "XT-C-08", "XT-C-09", "XT-C-10", "XT-C-11", "XT-C-12", 
-        "XT-C-13", "XT-C-14", "XT-C-15", "XT-C-16", "XT-C-17", "XT-C-18", 
-        "XT-C-19", "XT-C-20", "XT-C-21", "XT-C-22", "XT-C-23"
+        "XT-C-01", "XT-C-02", "XT-C-03", "XT-C-04", "XT-C-05", "XT-C-06",
+        "XT-C-07", "XT-C-08", "XT-C-09", "XT-C-10", "XT-C-11", "XT-C-12",
+        "XT-C-13", "XT-C-14", "XT-C-15", "XT-C-16", "XT-C-17", "XT-C-18",
+        "XT-C-19", "XT-C-20", "XT-C-21", "XT-C-22", "XT-C-23", and
+        "i5_01-i7_02" to "i5_20-i7_01"
 
     Returns
     -------
-    Writes a sample sheet to the output folder, with the name 
+    Writes a sample sheet to the output folder, with the name
     $filename_samplesheet.csv, where $filename means the input filename
     """
+    write_samplesheet(filename, template_name, sample_id_col, output_folder)
 
-    input_df = pd.read_csv(filename)
-    samples = input_df[sample_id_col]
 
-    template = _get_template(template_name)
-    template[TEMPLATE_SAMPLE_ID_COL] = samples
-    template[TEMPLATE_SAMPLE_NAME_COL] = samples
+def _read_mapping(mapping):
+    """Pairs of (filename, template name) from a two-column CSV"""
+    table = pd.read_csv(mapping)
+    if not {'filename', 'template'} <= set(table.columns):
+        raise click.BadParameter('needs the columns "filename" and '
+                                 '"template"', param_hint='--mapping')
+    folder = os.path.dirname(mapping)
+    return [(os.path.join(folder, filename), template)
+            for filename, template in zip(table['filename'],
+                                          table['template'])]
 
-    basename = os.path.basename(filename)
-    csv = os.path.join(output_folder,
-                       basename.replace('.csv', '_samplesheet.csv'))
-    maybe_make_directory(csv)
-    template.to_csv(csv, index=False)
-    print(f'Wrote {csv}')
\ No newline at end of file
+
+@click.command(short_help="Create the sample sheets of many pick lists at "
+                          "once")
+@click.argument('filenames', nargs=-1,
+                type=click.Path(dir_okay=False, readable=True))
+@click.option('--templates', default=None,
+              help='Comma-separated template names, one per file, in the '
+                   'same order as the files')
+@click.option('--mapping', default=None,
+              type=click.Path(dir_okay=False, readable=True),
+              help='CSV with the columns "filename" and "template", giving '
+                   'the template of each file. Filenames are relative to '
+                   'the CSV')
+@click.option('--sample-id-col', default="Combined name",
+              help='Name of the column containing the sample ID to be used in'
+                   ' the sample sheet')
+@click.option('--output-folder', default='.',
+              help='Where to output the sample sheets')
+@click.option('--check/--no-check', default=False,
+              help='Check that the indexes of all the sample sheets, pooled '
+                   'in one lane, are unique and far enough apart, as '
+                   '"dobby check-indexes" does')
+def samplesheet_batch(filenames, templates, mapping, sample_id_col,
+                      output_folder, check=False):
+    """Create the sample sheets of a whole sequencing run
+
+    Example:
+    $ dobby samplesheet-batch --templates XT-C-01,XT-C-02 \
+        echo_picklist_00001.csv echo_picklist_00002.csv
+
+    Each template is read once, however many files use it.
+
+    \b
+    Parameters
+    ----------
+    filenames : str
+        Pick lists, each paired with the template in the same position of
+        --templates
+    """
+    pairs = []
+    if filenames:
+        if templates is None:
+            raise click.UsageError('Give a template for each file with '
+                                   '--templates')
+        template_names = [name.strip() for name in templates.split(',')]
+        if len(template_names) != len(filenames):
+            raise click.BadParameter(
+                f'got {len(template_names)} templates for {len(filenames)} '
+                f'files', param_hint='--templates')
+        pairs.extend(zip(filenames, template_names))
+    if mapping is not None:
+        pairs.extend(_read_mapping(mapping))
+    if not pairs:
+        raise click.UsageError('No files given')
+
+    unknown = sorted({name for _, name in pairs if name not in TEMPLATES})
+    if unknown:
+        raise click.BadParameter(
+            f'{", ".join(unknown)} are not valid templates. Available '
+            f'templates are: {TEMPLATES.names_str}')
+
+    csvs = [write_samplesheet(filename, template_name, sample_id_col,
+                              output_folder)
+            for filename, template_name in pairs]
+
+    if check:
+        from .indexes import check_indexes_command
+        click.get_current_context().invoke(check_indexes_command, sheets=csvs)
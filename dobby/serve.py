@@ -0,0 +1,417 @@
+"""Run dobby commands as jobs sent to a long-running server of warm workers
+
+Starting "dobby cherrypick" imports pandas, scipy and matplotlib before it
+reads a single plate, which takes longer than cherrypicking it. "dobby serve"
+pays for this once: it starts a pool of worker processes that import
+everything up front, and keep their caches (e.g. heatmap figures) from one
+job to the next. Jobs are the arguments of any dobby command, sent as JSON
+over HTTP, on localhost or a Unix socket::
+
+    $ dobby serve --socket /tmp/dobby.sock &
+    $ curl --unix-socket /tmp/dobby.sock http://localhost/jobs \\
+        -H 'Content-Type: application/json' \\
+        -d '{"command": "cherrypick", "args": ["plate.txt", "P1", "M1"]}'
+
+Each request waits for its job and gets back a JSON result:
+
+    command, args
+        The job
+    ok, exit_code, error
+        Whether the command succeeded, its exit code, and its error message
+    stdout
+        What the command printed
+    outputs
+        Absolute paths of the files it wrote, including those written by
+        the worker processes of e.g. "dobby cherrypick-batch"
+    qc
+        For jobs cherrypicking plates, how many plates were processed,
+        passed, flagged, cached or errored, and how many failed each check
+    metrics
+        Its timers and counters, as with --metrics-json
+    seconds, queued_seconds
+        How long it ran, and how long it waited for a free worker
+
+Up to --workers jobs run at once and --queue-size more wait for a worker. A
+job sent when the queue is full is turned down with HTTP 503 rather than
+waiting. "GET /health" reports how busy the server is. If a worker dies,
+e.g. killed for running out of memory, its job fails and the pool of
+workers is started again for the next ones, as "GET /health" reports.
+
+A job can write wherever the user running the server can, so the server only
+takes jobs from programs on this machine. A Unix socket, which only users
+allowed by its file permissions can connect to, is the safest. Over HTTP,
+jobs must be sent as "Content-Type: application/json" to a local host name,
+without an "Origin", so that no web page open in a browser can send one.
+"""
+import concurrent.futures
+import concurrent.futures.process
+import contextlib
+import http.server
+import io
+import json
+import os
+import socketserver
+import stat
+import threading
+import time
+import urllib.parse
+
+import click
+
+from . import metrics
+from .util import recording_outputs
+
+HOST = '127.0.0.1'
+PORT = 8765
+QUEUE_SIZE = 16
+
+# Commands that can't be run as jobs
+NOT_JOBS = ('serve',)
+
+# Names the server can be reached by over HTTP, besides the address it listens
+# on. Any other Host header is a web page's, e.g. with DNS rebinding
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+def _warm_up():
+    """Import every command and the scientific stack in a new worker"""
+    from .cli import SUBCOMMANDS, cli
+    for name in SUBCOMMANDS:
+        cli.get_command(None, name)
+    import scipy.stats  # noqa: F401
+    from . import cherrypick, heatmap
+    cherrypick._plotting()
+    heatmap._matplotlib()
+
+
+def new_pool(n_workers):
+    """Pool of ``n_workers`` worker processes, warmed up as they start"""
+    return concurrent.futures.ProcessPoolExecutor(n_workers,
+                                                  initializer=_warm_up)
+
+
+def _qc(counters):
+    """Summary of the QC verdicts of the plates a job cherrypicked"""
+    from .cherrypick import SANITY_CHECKS
+    processed = counters.get('plates_processed', 0)
+    flagged = counters.get('plates_flagged', 0)
+    return dict(plates_processed=processed,
+                plates_passed=processed - flagged,
+                plates_flagged=flagged,
+                plates_cached=counters.get('plates_cached', 0),
+                plates_errored=counters.get('plates_errored', 0),
+                failed_checks={check: counters.get(f'flagged_{check}', 0)
+                               for check in SANITY_CHECKS})
+
+
+def run_job(command, args, cwd=None, submitted=None):
+    """Run a dobby command in this process, as the worker of a job
+
+    Parameters
+    ----------
+    command : str
+        Name of the command, e.g. "cherrypick"
+    args : list of str
+        Its arguments, as on the command line
+    cwd : str, optional
+        Folder relative paths of the job are relative to
+    submitted : float, optional
+        ``time.time()`` when the job was submitted, to report how long it
+        waited
+
+    Returns
+    -------
+    result : dict
+        See :mod:`dobby.serve`
+    """
+    from .cli import cli
+
+    start = time.time()
+    queued_seconds = 0.0 if submitted is None else start - submitted
+    stdout = io.StringIO()
+    exit_code = 0
+    error = None
+    previous_cwd = os.getcwd()
+    metrics.reset()
+    with recording_outputs() as outputs:
+        try:
+            if cwd is not None:
+                os.chdir(cwd)
+            with contextlib.redirect_stdout(stdout):
+                returned = cli.main([command] + list(args),
+                                    prog_name='dobby', standalone_mode=False)
+            # Without standalone mode, click returns the code of an exit
+            if isinstance(returned, int):
+                exit_code = returned
+        except click.ClickException as e:
+            exit_code = e.exit_code
+            error = e.format_message()
+        except click.exceptions.Exit as e:
+            exit_code = e.exit_code
+        except click.Abort:
+            exit_code = 1
+            error = 'Aborted'
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            exit_code = 1
+            error = f'{type(e).__name__}: {e}'
+        finally:
+            os.chdir(previous_cwd)
+
+    job_metrics = metrics.current().as_dict()
+    result = dict(command=command, args=list(args), ok=exit_code == 0,
+                  exit_code=exit_code, error=error,
+                  stdout=stdout.getvalue(),
+                  outputs=list(dict.fromkeys(outputs)),
+                  qc=None, metrics=job_metrics,
+                  seconds=time.time() - start, queued_seconds=queued_seconds)
+    counters = job_metrics['counters']
+    if 'plates_processed' in counters or 'plates_cached' in counters:
+        result['qc'] = _qc(counters)
+    return result
+
+
+class _JobHandler(http.server.BaseHTTPRequestHandler):
+    """POST /jobs runs a job, GET /health reports on the server"""
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _reply(self, status, body, headers=()):
+        encoded = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/health':
+            self._reply(404, dict(error=f'No such path: {self.path}'))
+            return
+        self._reply(200, dict(status='ok', workers=self.server.n_workers,
+                              max_jobs=self.server.max_jobs,
+                              jobs=self.server.n_jobs,
+                              pool_restarts=self.server.pool_restarts,
+                              last_pool_error=self.server.last_pool_error))
+
+    def _refusal(self):
+        """Why a request can't send jobs, or None if it can"""
+        if 'Origin' in self.headers:
+            return 403, 'Jobs are not taken from web pages'
+        if self.server.allowed_hosts is not None:
+            host = urllib.parse.urlsplit(
+                '//' + self.headers.get('Host', '')).hostname
+            if host not in self.server.allowed_hosts:
+                return 403, f'Jobs are not taken for the host {host!r}'
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.split(';')[0].strip().lower() != 'application/json':
+            return 415, 'Jobs must be sent as application/json'
+        return None
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self._reply(404, dict(error=f'No such path: {self.path}'))
+            return
+        refusal = self._refusal()
+        if refusal is not None:
+            status, error = refusal
+            self._reply(status, dict(error=error))
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length) or b'{}')
+            command = job['command']
+            args = job.get('args', [])
+            cwd = job.get('cwd')
+            if not isinstance(args, list) or not all(isinstance(arg, str)
+                                                     for arg in args):
+                raise ValueError('"args" must be a list of strings')
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, dict(error=f'Bad job: {e}'))
+            return
+        from .cli import SUBCOMMANDS
+        if command not in SUBCOMMANDS or command in NOT_JOBS:
+            self._reply(400, dict(error=f'{command!r} is not a command that '
+                                        f'can be run as a job'))
+            return
+
+        if not self.server.take_slot():
+            self._reply(503, dict(error='Too many jobs, try again later'),
+                        headers=[('Retry-After', '1')])
+            return
+        try:
+            result = self.server.run(command, args, cwd)
+        except Exception as e:
+            # The worker itself died, not the command
+            result = dict(command=command, args=args, ok=False, exit_code=1,
+                          error=f'{type(e).__name__}: {e}')
+        finally:
+            self.server.release_slot()
+        self._reply(200, result)
+
+
+class _JobServerMixin:
+    """Pool of workers and bounded count of jobs of a server"""
+
+    daemon_threads = True
+
+    def setup_jobs(self, pool, n_workers, queue_size, quiet=False,
+                   allowed_hosts=None, make_pool=new_pool):
+        self.pool = pool
+        self.make_pool = make_pool
+        self.n_workers = n_workers
+        self.max_jobs = n_workers + queue_size
+        self.n_jobs = 0
+        self.pool_restarts = 0
+        self.last_pool_error = None
+        self.quiet = quiet
+        self.allowed_hosts = allowed_hosts
+        self._lock = threading.Lock()
+
+    def run(self, command, args, cwd=None):
+        """Run a job in the pool, starting a new pool if a worker died"""
+        pool = self.pool
+        try:
+            future = pool.submit(run_job, command, args, cwd, time.time())
+        except concurrent.futures.process.BrokenProcessPool:
+            # Broken before the job was sent, so it can be sent again
+            pool = self._restart_pool(pool, 'a worker died between jobs')
+            future = pool.submit(run_job, command, args, cwd, time.time())
+        try:
+            return future.result()
+        except concurrent.futures.process.BrokenProcessPool as e:
+            # Other jobs of the pool fail too, but only one restarts it
+            self._restart_pool(pool, f'a worker died running {command}')
+            raise RuntimeError(f'The worker died running the job: {e}') \
+                from e
+
+    def _restart_pool(self, broken, reason):
+        with self._lock:
+            if self.pool is broken:
+                self.pool = self.make_pool(self.n_workers)
+                self.pool_restarts += 1
+                self.last_pool_error = f'{reason}, at {time.ctime()}'
+                broken.shutdown(wait=False)
+            return self.pool
+
+    def take_slot(self):
+        with self._lock:
+            if self.n_jobs >= self.max_jobs:
+                return False
+            self.n_jobs += 1
+            return True
+
+    def release_slot(self):
+        with self._lock:
+            self.n_jobs -= 1
+
+
+class HTTPJobServer(_JobServerMixin, http.server.ThreadingHTTPServer):
+    pass
+
+
+class UnixJobServer(_JobServerMixin, socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    pass
+
+
+def _is_socket(path):
+    """Whether ``path`` is a Unix socket, without following symlinks"""
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def make_server(pool, n_workers, queue_size=QUEUE_SIZE, host=HOST,
+                port=PORT, socket_path=None, quiet=False, make_pool=new_pool):
+    """Server of jobs run by ``pool``, on ``host:port`` or a Unix socket
+
+    Call ``serve_forever()`` on it to start taking jobs, e.g. in a thread.
+    A ``port`` of 0 picks a free one, see ``server_address``. If a worker of
+    the pool dies, ``make_pool(n_workers)`` makes the next one.
+
+    A socket already at ``socket_path`` is replaced, but anything else there
+    raises :class:`click.BadParameter`.
+    """
+    if socket_path is not None:
+        if _is_socket(socket_path):
+            # Left behind by a server that was killed
+            os.remove(socket_path)
+        elif os.path.lexists(socket_path):
+            raise click.BadParameter(
+                f'{socket_path} already exists and is not a socket',
+                param_hint='--socket')
+        server = UnixJobServer(socket_path, _JobHandler)
+        allowed_hosts = None
+    else:
+        server = HTTPJobServer((host, port), _JobHandler)
+        allowed_hosts = set(LOCAL_HOSTS) | {host.strip('[]').lower()}
+    server.setup_jobs(pool, n_workers, queue_size, quiet, allowed_hosts,
+                      make_pool)
+    return server
+
+
+@click.command(short_help="Keep warm workers running dobby commands sent as "
+                          "jobs over HTTP or a Unix socket")
+@click.option('--host', default=HOST,
+              help='Address to listen on. Only this machine can reach the '
+                   'default, and jobs are only taken for it, "localhost" or '
+                   'this address')
+@click.option('--port', default=PORT, type=int, help='Port to listen on')
+@click.option('--socket', 'socket_path', default=None,
+              type=click.Path(dir_okay=False),
+              help='Listen on this Unix socket instead of a port. The safest, '
+                   'as only users allowed by its permissions can send jobs')
+@click.option('--workers', default=None, type=click.IntRange(min=1),
+              help='Number of worker processes, so of jobs run at once. '
+                   'Defaults to the number of CPUs')
+@click.option('--queue-size', default=QUEUE_SIZE, type=click.IntRange(min=0),
+              help='Number of jobs that can wait for a worker. Jobs beyond '
+                   'these are turned down with HTTP 503')
+@click.option('--quiet', is_flag=True, help='Do not log every request')
+def serve(host, port, socket_path, workers, queue_size, quiet):
+    """Run dobby commands sent as JSON jobs, in warm worker processes
+
+    Example:
+    $ dobby serve --socket /tmp/dobby.sock
+    $ curl --unix-socket /tmp/dobby.sock http://localhost/jobs \
+        -H 'Content-Type: application/json' \
+        -d '{"command": "aggregate", "args": ["plate.csv"], "cwd": "/data"}'
+
+    Every worker imports the scientific stack once when the server starts,
+    so a job takes only as long as its own work. See "dobby.serve" for the
+    results sent back. Jobs can write anywhere this user can, so prefer
+    --socket to a port: over HTTP, any program on this machine can send them.
+    """
+    workers = workers or os.cpu_count() or 1
+    pool = new_pool(workers)
+    # Start and warm up every worker before taking jobs
+    list(pool.map(time.sleep, [0] * workers))
+    server = make_server(pool, workers, queue_size, host, port, socket_path,
+                         quiet)
+    if socket_path is not None:
+        where = f'unix socket {socket_path}'
+    else:
+        where = f'http://{host}:{server.server_address[1]}'
+    click.echo(f'Serving dobby jobs on {where} with {workers} workers. '
+               f'Stop with Ctrl+C')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        # A new one if a worker died
+        server.pool.shutdown()
+        if socket_path is not None and _is_socket(socket_path):
+            os.remove(socket_path)
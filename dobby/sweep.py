@@ -0,0 +1,242 @@
+"""How many plates and wells pass QC over a grid of thresholds
+
+Every plate is regressed and converted to concentrations once, with
+:mod:`dobby.platestack`. Each sanity check then only compares one number per
+plate to its threshold, so a check over all its thresholds is a
+(n_plates, n_thresholds) boolean array. The number of plates passing every
+check at every combination of thresholds is a sum over plates of the
+products of these arrays, which is one matrix product per value of the good
+cell rule. Plates are processed in chunks and their counts added up, so a
+year of plates never needs to be in memory at once.
+
+Nothing is written but the table of counts.
+"""
+import warnings
+
+import numpy as np
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import pandas as pd
+
+import click
+
+from . import platestack
+from .cherrypick import (BLANKS_COL, CONCENTRATIONS_MAXIMUM,
+                         CONCENTRATIONS_MINIMUM, R_MINIMUM, STANDARDS_COL,
+                         STANDARDS_STR, _find_plate_files)
+from .util import atomic_to_csv
+
+# Thresholds swept, in the order of the columns of the table
+THRESHOLDS = ('n_std', 'r_minimum', 'blanks_minimum',
+              'concentrations_minimum', 'concentrations_maximum')
+
+# Standard deviations above the mean of the blanks for a well to be good,
+# and smallest mean of the blanks, as cherrypick uses
+N_STD = 1
+BLANKS_MINIMUM = 0
+
+CHUNK_SIZE = 500
+
+
+def sweep(fluorescence_chunks, n_std=(N_STD,), r_minimum=(R_MINIMUM,),
+          blanks_minimum=(BLANKS_MINIMUM,),
+          concentrations_minimum=(CONCENTRATIONS_MINIMUM,),
+          concentrations_maximum=(CONCENTRATIONS_MAXIMUM,),
+          standards=STANDARDS_STR, standards_col=STANDARDS_COL,
+          blanks_col=BLANKS_COL, inner=True):
+    """Count the plates and wells passing QC at every grid point
+
+    Parameters
+    ----------
+    fluorescence_chunks : iterable of numpy.ndarray
+        (n_plates, 16, 24) fluorescence of some of the plates at a time
+    n_std : list of float
+        Good cell rule: standard deviations above the mean of the blanks
+    r_minimum, concentrations_minimum, concentrations_maximum : list of float
+        Thresholds of the regression, samples and concentration checks, as
+        for "dobby cherrypick"
+    blanks_minimum : list of float
+        Threshold of the blanks check: the mean concentration of the blanks
+        must be above it
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        One row per combination of thresholds, with the number of plates,
+        how many pass each check and all of them, the number of good wells
+        on all plates, and on passing plates ("wells_picked")
+    """
+    grid = [np.asarray(values, dtype=np.float64) for values in
+            (n_std, r_minimum, blanks_minimum, concentrations_minimum,
+             concentrations_maximum)]
+    n_std, r_minimum, blanks_minimum, c_minimum, c_maximum = grid
+    n_k, n_r, n_b, n_s, n_c = map(len, grid)
+
+    n_plates = 0
+    plates_passed = np.zeros((n_k, n_r * n_b, n_s * n_c))
+    wells_picked = np.zeros((n_k, n_r * n_b, n_s * n_c))
+    wells_good = np.zeros(n_k)
+    passed_regression = np.zeros(n_r)
+    passed_blanks = np.zeros(n_b)
+    passed_samples = np.zeros((n_k, n_s))
+    passed_concentration = np.zeros(n_c)
+
+    for fluorescence in fluorescence_chunks:
+        n = len(fluorescence)
+        if n == 0:
+            continue
+        n_plates += n
+        curves = platestack.fit_standard_curves(fluorescence, standards,
+                                                standards_col, inner)
+        concentrations = platestack.to_concentrations(fluorescence, curves)
+        blanks_mean, blanks_std = platestack.blank_stats(concentrations,
+                                                         blanks_col)
+        # Over every well, standards and blanks included, as
+        # cherrypick._sanity_check_concentration does. NaN, like any value
+        # above the maximum, fails the check
+        highest = concentrations.max(axis=(1, 2))
+
+        regression = curves.rvalue[:, np.newaxis] >= r_minimum
+        blanks = blanks_mean[:, np.newaxis] > blanks_minimum
+        concentration = highest[:, np.newaxis] <= c_maximum
+        passed_regression += regression.sum(axis=0)
+        passed_blanks += blanks.sum(axis=0)
+        passed_concentration += concentration.sum(axis=0)
+        regression_and_blanks = (regression[:, :, np.newaxis]
+                                 & blanks[:, np.newaxis, :]).reshape(n, -1)
+
+        for k, n_std_k in enumerate(n_std):
+            is_good = platestack.good_cells(concentrations, blanks_mean,
+                                            blanks_std, blanks_col, n_std_k)
+            good_mean, good_std = platestack.good_cells_stats(concentrations,
+                                                              is_good)
+            n_good = is_good.sum(axis=(1, 2))
+            with np.errstate(invalid='ignore'):
+                samples = (good_mean + good_std)[:, np.newaxis] > c_minimum
+            passed_samples[k] += samples.sum(axis=0)
+            wells_good[k] += n_good.sum()
+
+            samples_and_concentration = (
+                samples[:, :, np.newaxis]
+                & concentration[:, np.newaxis, :]).reshape(n, -1)
+            first = regression_and_blanks.astype(np.float64)
+            second = samples_and_concentration.astype(np.float64)
+            plates_passed[k] += first.T @ second
+            wells_picked[k] += (first * n_good[:, np.newaxis]).T @ second
+
+    shape = (n_k, n_r, n_b, n_s, n_c)
+    values = np.meshgrid(*grid, indexing='ij')
+    k, r, b, s, c = (i.ravel() for i in np.indices(shape))
+    table = pd.DataFrame({name: grid_values.ravel()
+                          for name, grid_values in zip(THRESHOLDS, values)})
+    table['plates'] = n_plates
+    table['passed_regression'] = passed_regression[r]
+    table['passed_blanks'] = passed_blanks[b]
+    table['passed_samples'] = passed_samples[k, s]
+    table['passed_concentration'] = passed_concentration[c]
+    table['plates_passed'] = plates_passed.reshape(shape).ravel()
+    table['wells_good'] = wells_good[k]
+    table['wells_picked'] = wells_picked.reshape(shape).ravel()
+    counts = table.columns[len(THRESHOLDS):]
+    table[counts] = table[counts].astype(np.int64)
+    return table
+
+
+def _file_chunks(filenames, chunk_size=CHUNK_SIZE):
+    for start in range(0, len(filenames), chunk_size):
+        yield platestack.read_plates(filenames[start:start + chunk_size])
+
+
+def _archive_chunks(plates, chunk_size=CHUNK_SIZE):
+    fluorescence = plates.fluorescence
+    for start in range(0, len(plates), chunk_size):
+        yield np.asarray(fluorescence[start:start + chunk_size])
+
+
+def _floats(ctx, param, value):
+    try:
+        return [float(x) for x in value.split(',')]
+    except ValueError:
+        raise click.BadParameter('must be comma-separated numbers')
+
+
+@click.command('qc-sweep',
+               short_help="Count the plates and wells passing QC over a grid "
+                          "of thresholds, without writing any outputs")
+@click.argument('inputs', nargs=-1,
+                type=click.Path(exists=True, readable=True))
+@click.option('--archive', 'archive_folder', default=None,
+              type=click.Path(exists=True, file_okay=False),
+              help='Also sweep the plates of an archive made by "dobby '
+                   'archive"')
+@click.option('--pattern', default='*.txt',
+              help='Pattern of plate reader files to use from folders given '
+                   'as inputs')
+@click.option('--r-minimum', default=str(R_MINIMUM), callback=_floats,
+              help='Comma-separated minimum correlations of the regression')
+@click.option('--concentrations-minimum', default=str(CONCENTRATIONS_MINIMUM),
+              callback=_floats,
+              help='Comma-separated minimum (mean + std) concentrations of '
+                   'the good cells of a plate')
+@click.option('--concentrations-maximum', default=str(CONCENTRATIONS_MAXIMUM),
+              callback=_floats,
+              help='Comma-separated maximum concentrations of any well')
+@click.option('--blanks-minimum', default=str(BLANKS_MINIMUM),
+              callback=_floats,
+              help='Comma-separated minimum mean concentrations of the '
+                   'blanks')
+@click.option('--n-std', default=str(N_STD), callback=_floats,
+              help='Comma-separated numbers of standard deviations above the '
+                   'mean of the blanks for a well to be good')
+@click.option('--standards', default=STANDARDS_STR,
+              help='Concentration of the standard in each row')
+@click.option('--standards-col', default=STANDARDS_COL, type=int,
+              help='Column containing concentration standards')
+@click.option('--blanks-col', default=BLANKS_COL, type=int,
+              help='Column number containing blanks aka empty wells')
+@click.option('--inner-standards', default=True, type=bool)
+@click.option('--output', default=None, type=click.Path(dir_okay=False),
+              help='CSV to write the table to. By default it is printed')
+def qc_sweep(inputs, archive_folder, pattern, r_minimum,
+             concentrations_minimum, concentrations_maximum, blanks_minimum,
+             n_std, standards, standards_col, blanks_col, inner_standards,
+             output):
+    """Try out QC thresholds on many plates at once
+
+    Example:
+    $ dobby qc-sweep raw_plate_reader_output/ --r-minimum 0.95,0.98,0.99 \
+        --concentrations-minimum 0.5,0.7,0.9
+
+    Prints one row per combination of thresholds with how many plates pass
+    each sanity check and all of them, and how many wells are good and
+    would be picked. No plate is flagged and no pick list or plot is
+    written.
+
+    \b
+    Parameters
+    ----------
+    inputs : str
+        Plate reader files, or folders containing them
+    """
+    chunks = []
+    if inputs:
+        chunks.append(_file_chunks(_find_plate_files(inputs, pattern)))
+    if archive_folder is not None:
+        from .archive import PlateArchive
+        chunks.append(_archive_chunks(PlateArchive(archive_folder)))
+    if not chunks:
+        raise click.UsageError('Give plate reader files or an --archive')
+
+    table = sweep((chunk for source in chunks for chunk in source),
+                  n_std=n_std, r_minimum=r_minimum,
+                  blanks_minimum=blanks_minimum,
+                  concentrations_minimum=concentrations_minimum,
+                  concentrations_maximum=concentrations_maximum,
+                  standards=standards, standards_col=standards_col,
+                  blanks_col=blanks_col, inner=inner_standards)
+    if output is None:
+        click.echo(table.to_string(index=False))
+    else:
+        atomic_to_csv(table, output, index=False)
+        click.echo(f'Wrote {len(table)} settings to {output}')
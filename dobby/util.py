@@ -1,4 +1,11 @@
+import contextlib
+import functools
 import os
+import tempfile
+import warnings
+
+# Filenames written by atomic_open and atomic_path, while recording_outputs
+_outputs = None
 
 
 def maybe_make_directory(filename):
@@ -6,4 +13,161 @@ def maybe_make_directory(filename):
     try:
         os.makedirs(directory)
     except FileExistsError:
-        pass
\ No newline at end of file
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def _file_mode():
+    """Permissions open() gives new files, that is 0o666 less the umask
+
+    Found by creating a file rather than with ``os.umask``, which can only
+    read the umask by changing it, for every thread of the process.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        fd = os.open(os.path.join(directory, 'mode'),
+                     os.O_CREAT | os.O_WRONLY, 0o666)
+        try:
+            return os.fstat(fd).st_mode & 0o777
+        finally:
+            os.close(fd)
+
+
+def _temporary_file(filename):
+    """Create a hidden temporary file next to ``filename``, with its
+    extension so that writers guessing the format from it still can"""
+    directory, basename = os.path.split(os.path.abspath(filename))
+    _, extension = os.path.splitext(basename)
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix=f'.{basename}.',
+                                     suffix=f'.tmp{extension}')
+    # Temporary files are only readable by their owner
+    os.chmod(temporary, _file_mode())
+    return fd, temporary
+
+
+@contextlib.contextmanager
+def atomic_open(filename, mode='w', **kwargs):
+    """Open a temporary file that is moved to ``filename`` once closed
+
+    Readers of ``filename`` never see a half-written file: they see either
+    the old contents or the new ones. If writing fails, ``filename`` is left
+    untouched.
+    """
+    fd, temporary = _temporary_file(filename)
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+        _replace(temporary, filename)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+@contextlib.contextmanager
+def atomic_path(filename):
+    """Path of a temporary file that is moved to ``filename`` once written
+
+    For writers that take a path rather than a file, such as
+    ``DataFrame.to_parquet`` or ``Figure.savefig``::
+
+        with atomic_path(pdf) as temporary:
+            fig.savefig(temporary)
+
+    Like :func:`atomic_open`, ``filename`` is only ever replaced whole.
+    """
+    fd, temporary = _temporary_file(filename)
+    os.close(fd)
+    try:
+        yield temporary
+        _replace(temporary, filename)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def _replace(temporary, filename):
+    os.replace(temporary, filename)
+    if _outputs is not None:
+        _outputs.append(os.path.abspath(filename))
+
+
+@contextlib.contextmanager
+def recording_outputs():
+    """Collect the files written with :func:`atomic_open` and
+    :func:`atomic_path` in the block, e.g. to report what a job wrote
+
+    Yields
+    ------
+    outputs : list of str
+        Absolute paths of the files written so far, in order, filled in as
+        the block runs
+    """
+    global _outputs
+    outer, _outputs = _outputs, []
+    try:
+        yield _outputs
+    finally:
+        _outputs = outer
+
+
+def record_outputs(filenames):
+    """Add files written elsewhere, e.g. by a worker process, to those
+    collected by :func:`recording_outputs`, if any"""
+    if _outputs is not None:
+        _outputs.extend(filenames)
+
+
+def atomic_to_csv(dataframe, filename, **kwargs):
+    """Write a DataFrame to a CSV with :func:`atomic_open`"""
+    with atomic_open(filename, newline='') as f:
+        dataframe.to_csv(f, **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def _warn_unlocked():
+    warnings.warn('fcntl is not available, so dobby runs sharing an output '
+                  'folder are not kept from writing it at the same time',
+                  RuntimeWarning, stacklevel=4)
+
+
+@contextlib.contextmanager
+def exclusive_lock(filename):
+    """Hold an exclusive lock on ``filename``, waiting for other processes
+    holding it to let go
+
+    The lock is released when the block ends, or when the process dies, so
+    a crash never leaves a folder locked. Only where ``fcntl`` exists, i.e.
+    not on Windows, where the block runs without a lock and a
+    ``RuntimeWarning`` says so, once per process.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        _warn_unlocked()
+        yield
+        return
+    with open(filename, 'a') as f:
+        fcntl.lockf(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(f, fcntl.LOCK_UN)
+
+
+def reserve_file(filename):
+    """Create an empty ``filename``, if and only if it doesn't exist yet
+
+    Creating with ``O_EXCL`` is atomic, so of several processes reserving the
+    same file, exactly one does.
+
+    Returns
+    -------
+    reserved : bool
+        Whether this call created the file
+    """
+    try:
+        fd = os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+    except FileExistsError:
+        return False
+    os.close(fd)
+    return True
@@ -14,7 +14,9 @@ setup(
     author_email='olga.botvinnik@gmail.com',
     url='https://github.com/czbiohub/dobby',
     packages=['dobby'],
+    package_data={'dobby': ['samplesheet_templates/*.csv']},
     install_requires=required,
+    extras_require={'columnar': ['pyarrow']},
     long_description='See ' + 'https://github.com/czbiohub/dobby',
     license='MIT',
     entry_points={"console_scripts": ['dobby = dobby.cli:cli']}
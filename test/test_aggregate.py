@@ -1,14 +1,25 @@
 # SAMPLE RUN OF A SINGLE TEST: python -m unittest test_aggregate.TestAggregate.test_last_echopicklist_number
 import unittest
-from dobby import aggregate
+from dobby import aggregate, util
+from dobby.manifest import JOURNAL, AggregateManifest
 from click.testing import CliRunner
+import glob
 import os
 import shutil
+import sys
+import tempfile
+from unittest import mock
+import warnings
+
+import pandas as pd
 
 parent_dir = os.path.split(os.path.dirname(aggregate.__file__))[0]
 aggregate_test_dir = 'test/data/aggregate'
 CHERRYPICK_PLATE = os.path.join(parent_dir, aggregate_test_dir, 'input/1.csv')
 OUTPUT_FOLDER = os.path.join(parent_dir, aggregate_test_dir, 'output_folder')
+CHERRYPICK_PLATES = sorted(glob.glob(os.path.join(parent_dir,
+                                                  aggregate_test_dir,
+                                                  'input/*.csv')))
 
 
 class TestAggregate(unittest.TestCase):
@@ -25,3 +36,220 @@ class TestAggregate(unittest.TestCase):
         self.assertTrue(largest_index == int(2))
 
     #dobby aggregate test/data/aggregate/input/* --output-folder test/data/aggregate/output_folder
+
+    def test_dataframes_ofsize(self):
+        dataframes = [pd.DataFrame({'well': [f'A{i}' for i in range(n)],
+                                    'concentration': range(n)})
+                      for n in (5, 12, 0, 4)]
+        sizes = [(len(dataframe), is_lessthan_desired_size)
+                 for dataframe, is_lessthan_desired_size, _, _ in
+                 aggregate.dataframes_ofsize_generator(iter(dataframes), 4)]
+        assert sizes == [(4, False)] * 5 + [(1, True)]
+
+    def test_read_tidy_csv(self):
+        columns = aggregate.read_tidy_csv(CHERRYPICK_PLATE, should_sort=True)
+        expected = pd.read_csv(CHERRYPICK_PLATE).sort_values(
+            ['row_letter', 'column_number'])
+        assert list(columns['well']) == list(expected['well'])
+        assert columns['concentration'].dtype.kind == 'f'
+
+    def test_aggregate_tops_up_incomplete(self):
+        output_folder = tempfile.mkdtemp()
+        incomplete_folder = tempfile.mkdtemp()
+        runner = CliRunner()
+        result = runner.invoke(aggregate.aggregate, [
+            CHERRYPICK_PLATE, '--output-folder', incomplete_folder])
+        assert result.exit_code == 0, result.output
+
+        result = runner.invoke(aggregate.aggregate, CHERRYPICK_PLATES + [
+            '--output-folder', output_folder,
+            '--incomplete-echopicklists-folder', incomplete_folder])
+        assert result.exit_code == 0, result.output
+
+        picklists = sorted(f for f in os.listdir(output_folder)
+                           if f != aggregate.MANIFEST
+                           and not f.startswith('.'))
+        assert picklists == ['echo_picklist_00001.csv',
+                             'echo_picklist_00002.csv',
+                             'echo_picklist_00003_incomplete.csv']
+        first = pd.read_csv(os.path.join(output_folder, picklists[0]))
+        assert first['Destination well'].is_unique
+        assert list(first['Destination well']) == aggregate.DESTINATIONS
+
+        shutil.rmtree(output_folder)
+        shutil.rmtree(incomplete_folder)
+
+    def test_aggregate_rerun_packs_only_new_files(self):
+        output_folder = tempfile.mkdtemp()
+        runner = CliRunner()
+        result = runner.invoke(aggregate.aggregate, CHERRYPICK_PLATES[:1] + [
+            '--output-folder', output_folder])
+        assert result.exit_code == 0, result.output
+        incomplete = os.path.join(output_folder,
+                                  'echo_picklist_00001_incomplete.csv')
+        n_open = len(pd.read_csv(incomplete))
+
+        # Nothing new, nothing written
+        result = runner.invoke(aggregate.aggregate, CHERRYPICK_PLATES[:1] + [
+            '--output-folder', output_folder])
+        assert result.exit_code == 0, result.output
+        assert 'already packed' in result.output
+        assert 'No new files' in result.output
+
+        result = runner.invoke(aggregate.aggregate, CHERRYPICK_PLATES + [
+            '--output-folder', output_folder])
+        assert result.exit_code == 0, result.output
+        assert not os.path.exists(incomplete)
+
+        rerun = pd.concat([
+            pd.read_csv(f) for f in
+            sorted(glob.glob(os.path.join(output_folder, 'echo_picklist_*')))])
+        once = pd.concat([pd.read_csv(f) for f in CHERRYPICK_PLATES])
+        assert len(rerun) == len(once)
+        first = pd.read_csv(os.path.join(output_folder,
+                                         'echo_picklist_00001.csv'))
+        assert list(first['Destination well']) == aggregate.DESTINATIONS
+        assert n_open < len(first)
+
+        shutil.rmtree(output_folder)
+
+    def test_manifest_journal(self):
+        output_folder = tempfile.mkdtemp()
+        result = CliRunner().invoke(aggregate.aggregate, CHERRYPICK_PLATES + [
+            '--output-folder', output_folder])
+        assert result.exit_code == 0, result.output
+        saved = AggregateManifest(output_folder)
+        # The journal is part of the manifest once the run is over
+        assert not os.path.exists(os.path.join(output_folder, JOURNAL))
+
+        # A run that crashed before saving is picked up from its journal
+        os.remove(os.path.join(output_folder, aggregate.MANIFEST))
+        crashed = AggregateManifest(output_folder)
+        plate = pd.read_csv(CHERRYPICK_PLATE)
+        crashed.add_picklist(1, [(CHERRYPICK_PLATE, 'digest')])
+        crashed.add_picklist(2, [(CHERRYPICK_PLATE, 'digest')], plate)
+        with open(os.path.join(output_folder, JOURNAL), 'a') as f:
+            f.write('{"number": 3, "inp')
+
+        resumed = AggregateManifest(output_folder)
+        record = resumed.inputs[os.path.abspath(CHERRYPICK_PLATE)]
+        assert record['picklists'] == [1, 2]
+        assert resumed.open_plate['number'] == 2
+        assert len(resumed.open_plate['columns']['plate']) == len(plate)
+        assert not os.path.exists(os.path.join(output_folder, JOURNAL))
+        assert AggregateManifest(output_folder).inputs == resumed.inputs
+        assert len(saved.inputs) == len(CHERRYPICK_PLATES)
+
+        shutil.rmtree(output_folder)
+
+    def test_aggregate_fewest_sources(self):
+        folder = tempfile.mkdtemp()
+        plate = pd.read_csv(CHERRYPICK_PLATE)
+        plate = pd.concat([plate, pd.read_csv(CHERRYPICK_PLATES[1])])
+        filenames = []
+        for i, size in enumerate([300, 100, 84, 200, 184]):
+            filename = os.path.join(folder, f'plate{i}.csv')
+            plate.head(size).assign(plate=f'plate{i}').to_csv(filename,
+                                                              index=False)
+            filenames.append(filename)
+        output_folder = os.path.join(folder, 'output')
+        runner = CliRunner()
+        result = runner.invoke(aggregate.aggregate, filenames + [
+            '--output-folder', output_folder, '--packing', 'fewest-sources'])
+        assert result.exit_code == 0, result.output
+
+        picklists = [pd.read_csv(f) for f in sorted(
+            glob.glob(os.path.join(output_folder, 'echo_picklist_*')))]
+        assert [list(picklist['Plate number'].unique())
+                for picklist in picklists] == [['plate0', 'plate2'],
+                                               ['plate3', 'plate4'],
+                                               ['plate1']]
+        assert list(picklists[0]['Destination well']) == \
+            aggregate.DESTINATIONS
+        assert sum(map(len, picklists)) == 868
+
+        shutil.rmtree(folder)
+
+    def test_aggregate_prefetch(self):
+        folders = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        runner = CliRunner()
+        for folder, prefetch in zip(folders, ['0', '3']):
+            for filenames in (CHERRYPICK_PLATES[:1], CHERRYPICK_PLATES):
+                result = runner.invoke(aggregate.aggregate, filenames + [
+                    '--output-folder', folder, '--prefetch', prefetch])
+                assert result.exit_code == 0, result.output
+
+        # Same pick lists, numbered the same, with or without threads
+        picklists = [sorted(f for f in os.listdir(folder)
+                            if f.startswith('echo_picklist_'))
+                     for folder in folders]
+        assert picklists[0] == picklists[1]
+        for filename in picklists[0]:
+            pd.testing.assert_frame_equal(
+                pd.read_csv(os.path.join(folders[0], filename)),
+                pd.read_csv(os.path.join(folders[1], filename)))
+
+        for folder in folders:
+            shutil.rmtree(folder)
+
+    def test_reserve_picklist_number(self):
+        output_folder = tempfile.mkdtemp()
+        open(aggregate.picklist_filename(2, output_folder, True), 'w').close()
+        numbers = [aggregate.reserve_picklist_number(output_folder, 1)
+                   for _ in range(3)]
+        # Never the same number twice, nor one of a pick list in the folder
+        assert numbers == [1, 3, 4]
+        assert aggregate.largest_enumeration_in_outputfolder(
+            output_folder) == 2
+
+        # Numbers of pick lists that were never written are given back,
+        # and those of pick lists written stay taken by the pick list
+        open(aggregate.picklist_filename(3, output_folder), 'w').close()
+        aggregate.release_picklist_numbers(output_folder, [3, 4])
+        assert aggregate.reserve_picklist_number(output_folder, 3) == 4
+        assert sorted(os.listdir(os.path.join(
+            output_folder, aggregate.RESERVED_NUMBERS))) == ['00001', '00004']
+
+        shutil.rmtree(output_folder)
+
+    def test_lock_without_fcntl(self):
+        output_folder = tempfile.mkdtemp()
+        lock = os.path.join(output_folder, aggregate.MANIFEST_LOCK)
+        util._warn_unlocked.cache_clear()
+        with mock.patch.dict(sys.modules, {'fcntl': None}):
+            # Said once, not for every lock taken
+            with self.assertWarns(RuntimeWarning):
+                with util.exclusive_lock(lock):
+                    pass
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                with util.exclusive_lock(lock):
+                    pass
+        util._warn_unlocked.cache_clear()
+
+        shutil.rmtree(output_folder)
+
+    def test_failed_write_releases_numbers(self):
+        output_folder = tempfile.mkdtemp()
+        write = aggregate.write_csv_from_dataframe
+
+        def fail_second(dataframe, number, *args):
+            if number == 2:
+                raise OSError('disk full')
+            write(dataframe, number, *args)
+
+        with mock.patch.object(aggregate, 'write_csv_from_dataframe',
+                               fail_second):
+            result = CliRunner().invoke(aggregate.aggregate,
+                                        CHERRYPICK_PLATES + [
+                                            '--output-folder', output_folder,
+                                            '--prefetch', '2'])
+        assert isinstance(result.exception, OSError)
+        # Written or not, no pick list keeps its reservation
+        assert os.path.exists(aggregate.picklist_filename(1, output_folder))
+        assert os.listdir(os.path.join(output_folder,
+                                       aggregate.RESERVED_NUMBERS)) == []
+        # The next run numbers on without a gap
+        assert aggregate.reserve_picklist_number(output_folder, 2) == 2
+
+        shutil.rmtree(output_folder)
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from click.testing import CliRunner
+
+from dobby import archive, platestack
+
+parent_dir = os.path.split(os.path.dirname(archive.__file__))[0]
+cherrypick_test_dir = os.path.join(parent_dir, 'test/data/cherrypick/input')
+PLATES = [os.path.join(cherrypick_test_dir, f'{name}.txt') for name in
+          ('good_plate', 'bad_plate', 'bad_plate_MAA000321')]
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.archive = os.path.join(self.folder, 'plates.archive')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_archive_matches_platestack(self):
+        metadata = os.path.join(self.folder, 'metadata.csv')
+        with open(metadata, 'w') as f:
+            f.write('plate,mouse.id\ngood_plate,good_mouse\n')
+
+        runner = CliRunner()
+        result = runner.invoke(archive.archive, PLATES[:2] + [
+            '--archive', self.archive, '--metadata', metadata])
+        assert result.exit_code == 0, result.output
+        # Archiving again only adds the new plate
+        result = runner.invoke(archive.archive, PLATES + [
+            '--archive', self.archive])
+        assert result.exit_code == 0, result.output
+        assert 'Archived 1 plates, skipped 2' in result.output
+
+        plates = archive.PlateArchive(self.archive)
+        assert plates.names == ['good_plate', 'bad_plate',
+                                'bad_plate_MAA000321']
+        assert plates.index.loc['good_plate', 'mouse_id'] == 'good_mouse'
+        assert isinstance(plates.fluorescence, np.memmap)
+
+        fluorescence = platestack.read_plates(PLATES)
+        expected = platestack.analyze(fluorescence)
+        np.testing.assert_array_equal(plates.fluorescence, fluorescence)
+        np.testing.assert_allclose(plates.concentrations,
+                                   expected.concentrations)
+        np.testing.assert_allclose(plates.fits[:, 0], expected.curves.slope)
+
+        # Reanalyzing a slice of the archive
+        positions = plates.positions(['bad_plate'])
+        result = platestack.analyze(plates.fluorescence[positions])
+        assert result.passed[0] == expected.passed[1]
+
+    def test_add_replaces_and_ignores_interrupted_appends(self):
+        plates = archive.PlateArchive(self.archive, shape=(2, 3))
+        ones = np.ones((2, 2, 3))
+        plates.add(['a', 'b'], ones, ones * 2, np.ones((2, 3)))
+
+        # Bytes of an append that never made it to the index
+        with open(os.path.join(self.archive, 'fluorescence.f8'), 'ab') as f:
+            f.write(b'\0' * 17)
+
+        plates = archive.PlateArchive(self.archive)
+        plates.add(['b', 'c'], ones * 3, ones * 4, np.zeros((2, 3)))
+        plates = archive.PlateArchive(self.archive)
+        assert plates.names == ['a', 'b', 'c']
+        np.testing.assert_array_equal(plates.fluorescence[:, 0, 0],
+                                      [1, 3, 3])
+        np.testing.assert_array_equal(plates.concentrations[:, 1, 2],
+                                      [2, 4, 4])
+        np.testing.assert_array_equal(plates.fits[:, 0], [1, 0, 0])
@@ -1,8 +1,9 @@
 import unittest
-from dobby import cherrypick
+from dobby import cherrypick, metrics
 from click.testing import CliRunner
 import os
 import shutil
+import pandas as pd
 
 parent_dir = os.path.split(os.path.dirname(cherrypick.__file__))[0]
 cherrypick_test_dir = 'test/data/cherrypick'
@@ -100,6 +101,132 @@ class TestCherrypick(unittest.TestCase):
     def test_2_failed_then_pass(self):
         pass
 
+    def test_batch(self):
+        output_folder = os.path.join(OUTPUT_FOLDER, 'batch_test_output')
+        metadata = os.path.join(OUTPUT_FOLDER, 'batch_metadata.csv')
+        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+        with open(metadata, 'w') as f:
+            f.write('plate,mouse.id\ngood_plate,good_mouse\n'
+                    'bad_plate,bad_mouse\n')
+
+        runner = CliRunner()
+        result = runner.invoke(cherrypick.cherrypick_batch, [
+            GOOD_PLATE, BAD_PLATE, '--metadata', metadata, '--workers', '2',
+            '--render-workers', '1', '--output-folder', output_folder])
+
+        assert result.exit_code == 0, result.output
+        assert 'good_plate\tpassed' in result.output
+        assert 'bad_plate\tflagged' in result.output
+        assert os.path.exists(os.path.join(output_folder, 'cherrypicked',
+                                           'good_plate_echo.csv'))
+        assert os.path.exists(os.path.join(
+            output_folder, 'regression', 'good_plate_regression_lines.pdf'))
+
+        shutil.rmtree(output_folder)
+        os.remove(metadata)
+
+    def test_batch_bad_metadata(self):
+        output_folder = os.path.join(OUTPUT_FOLDER, 'bad_metadata_output')
+        metadata = os.path.join(OUTPUT_FOLDER, 'bad_metadata.csv')
+        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+        runner = CliRunner()
+        args = [GOOD_PLATE, '--metadata', metadata,
+                '--output-folder', output_folder]
+
+        # Turned down before any plate is cherrypicked
+        with open(metadata, 'w') as f:
+            f.write('plate,mouse\ngood_plate,good_mouse\n')
+        result = runner.invoke(cherrypick.cherrypick_batch, args)
+        assert result.exit_code == 2
+        assert '--mouse-id-col' in result.output
+        with open(metadata, 'w') as f:
+            f.write('plate,mouse.id\ngood_plate,good_mouse\n'
+                    'good_plate,other_mouse\n')
+        result = runner.invoke(cherrypick.cherrypick_batch, args)
+        assert result.exit_code == 2
+        assert 'more than one row in the metadata: good_plate' in result.output
+        assert not os.path.exists(output_folder)
+
+        os.remove(metadata)
+
+    def test_deferred_plots(self):
+        output_folder = os.path.join(OUTPUT_FOLDER, 'deferred_plots_output')
+        plot_jobs = []
+        cherrypick.main(GOOD_PLATE, 'good_plate', 'my_mouse_id',
+                        output_folder=output_folder, plot_jobs=plot_jobs)
+
+        assert os.path.exists(os.path.join(output_folder, 'cherrypicked'))
+        assert not os.path.exists(os.path.join(output_folder, 'regression'))
+        assert len(plot_jobs) == 4
+
+        pdfs = cherrypick.render_plots(plot_jobs)
+        assert all(os.path.exists(pdf) for pdf in pdfs)
+
+        shutil.rmtree(output_folder)
+
+    def test_cache_skips_unchanged_plates(self):
+        output_folder = os.path.join(OUTPUT_FOLDER, 'cache_output')
+        if os.path.exists(output_folder):
+            shutil.rmtree(output_folder)
+        counters = metrics.reset().counters
+        kwargs = dict(output_folder=output_folder, plot=False)
+
+        first = cherrypick.main(GOOD_PLATE, 'good_plate', 'mouse', **kwargs)
+        second = cherrypick.main(GOOD_PLATE, 'good_plate', 'mouse', **kwargs)
+        assert first == second
+        assert counters == {'plates_processed': 1, 'plates_cached': 1,
+                            'rows_written': counters['rows_written']}
+
+        # A different parameter, or a removed output, means cherrypicking
+        # the plate again, replacing its pick lists
+        picklist = os.path.join(output_folder, 'cherrypicked',
+                                'good_plate_echo.csv')
+        cherrypick.main(GOOD_PLATE, 'good_plate', 'other_mouse', **kwargs)
+        assert set(pd.read_csv(picklist)['mouse_id']) == {'other_mouse'}
+        os.remove(picklist)
+        cherrypick.main(GOOD_PLATE, 'good_plate', 'mouse', **kwargs)
+        assert set(pd.read_csv(picklist)['mouse_id']) == {'mouse'}
+        assert counters['plates_processed'] == 3
+        assert counters['plates_cached'] == 1
+
+        # Plots queued but never drawn don't count as done
+        kwargs['plot'] = True
+        plot_jobs = []
+        cherrypick.main(GOOD_PLATE, 'good_plate', 'mouse',
+                        plot_jobs=plot_jobs, **kwargs)
+        assert plot_jobs
+        cherrypick.main(GOOD_PLATE, 'good_plate', 'mouse', **kwargs)
+        assert counters['plates_processed'] == 5
+        assert counters['plates_cached'] == 1
+
+        # And bad plates aren't flagged again
+        cherrypick.main(BAD_PLATE, 'bad_plate', 'mouse', **kwargs)
+        flagged = cherrypick.main(BAD_PLATE, 'bad_plate', 'mouse', **kwargs)
+        assert flagged.endswith('flag_1')
+
+        shutil.rmtree(output_folder)
+
+    def test_pick_lists_match_unstack(self):
+        fluorescence = cherrypick._parse_fluorescence(GOOD_PLATE, 'txt')
+        standards = cherrypick._parse_standards(cherrypick.STANDARDS_STR)
+        concentrations, means, regressed = \
+            cherrypick._fluorescence_to_concentration(
+                fluorescence, cherrypick.STANDARDS_COL, standards)
+        good_cells = cherrypick._get_good_cells(
+            concentrations, cherrypick.BLANKS_COL, 'good_plate', 'mouse')
+
+        pick_lists = cherrypick._make_pick_lists(
+            concentrations, good_cells, 'good_plate', 'mouse',
+            cherrypick.BLANKS_COL)
+
+        expected = good_cells.unstack().dropna()
+        cherrypicked = pick_lists['cherrypicked']
+        assert (cherrypicked['concentration'].values == expected.values).all()
+        assert list(cherrypicked['well'])[:2] == ['A1', 'B1']
+        assert cherrypicked['name'].iloc[0] == 'A1-good_plate-mouse-1'
+        assert len(pick_lists['non_cherrypicked']) == 384
+        assert len(pick_lists['minus_blanks']) == 16 * 22
+
     def create_record(self):
         output_folder = os.path.join(OUTPUT_FOLDER, 'create_record_output')
         folder = cherrypick.record_flagged_plate_and_determine_folder(output_folder, 'my_plate')
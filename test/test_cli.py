@@ -0,0 +1,39 @@
+import subprocess
+import sys
+import unittest
+
+from click.testing import CliRunner
+
+from dobby.cli import cli, SUBCOMMANDS
+
+
+class TestCli(unittest.TestCase):
+    def test_help_lists_subcommands(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['-h'])
+        assert result.exit_code == 0
+        for name in SUBCOMMANDS:
+            assert name in result.output
+
+    def test_subcommands_load(self):
+        for name in SUBCOMMANDS:
+            assert cli.get_command(None, name).name == name
+
+    def test_help_does_not_import_subcommands(self):
+        code = ('import sys\n'
+                'from dobby.cli import cli\n'
+                'try:\n'
+                '    cli(["-h"])\n'
+                'except SystemExit:\n'
+                '    pass\n'
+                'heavy = ["dobby.cherrypick", "pandas", "matplotlib", "scipy"]\n'
+                'print("imported:" + ",".join(m for m in heavy\n'
+                '                              if m in sys.modules))\n')
+        output = subprocess.run([sys.executable, '-c', code],
+                                stdout=subprocess.PIPE, check=True,
+                                universal_newlines=True).stdout
+        assert output.strip().splitlines()[-1] == 'imported:'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import click
+import numpy as np
+from click.testing import CliRunner
+
+from dobby import aggregate, cherrypick, columnar
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+parent_dir = os.path.split(os.path.dirname(columnar.__file__))[0]
+GOOD_PLATE = os.path.join(parent_dir, 'test/data/cherrypick/input',
+                          'good_plate.txt')
+
+
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_format_of(self):
+        assert columnar.format_of('a/plate_echo.parquet') == 'parquet'
+        assert columnar.format_of('plate_echo.FEATHER') == 'feather'
+        assert columnar.format_of('plate_echo.csv') == 'csv'
+
+    @unittest.skipIf(HAS_PYARROW, 'pyarrow is installed')
+    def test_columnar_needs_pyarrow(self):
+        columnar.check_format('csv')
+        with self.assertRaises(click.BadParameter):
+            columnar.check_format('parquet')
+
+    @unittest.skipUnless(HAS_PYARROW, 'needs pyarrow')
+    def test_aggregate_columnar_like_csv(self):
+        for fmt in ('csv', 'parquet', 'feather'):
+            cherrypick.main(GOOD_PLATE, 'good_plate', 'mouse', plot=False,
+                            output_folder=os.path.join(self.folder, fmt),
+                            pick_list_format=fmt)
+            pick_list = os.path.join(self.folder, fmt, 'cherrypicked',
+                                     f'good_plate_echo.{fmt}')
+            assert os.path.exists(pick_list)
+
+            if fmt != 'csv':
+                columns = columnar.read_tidy_columnar(pick_list)
+                expected = aggregate.read_tidy_csv(
+                    os.path.join(self.folder, 'csv', 'cherrypicked',
+                                 'good_plate_echo.csv'), should_sort=True)
+                assert columns['concentration'].dtype == np.float64
+                for name, values in expected.items():
+                    np.testing.assert_array_equal(columns[name], values)
+
+            result = CliRunner().invoke(aggregate.aggregate, [
+                pick_list, '--output-folder',
+                os.path.join(self.folder, f'aggregated_{fmt}')])
+            assert result.exit_code == 0, result.output
+
+        def read(fmt):
+            picklists = glob.glob(os.path.join(
+                self.folder, f'aggregated_{fmt}', 'echo_picklist_*.csv'))
+            with open(picklists[0]) as f:
+                return f.read()
+
+        assert read('parquet') == read('csv')
+        assert read('feather') == read('csv')
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+
+from dobby import echo
+
+parent_dir = os.path.split(os.path.dirname(echo.__file__))[0]
+PICKLIST = os.path.join(parent_dir, 'test/data/aggregate/output_folder',
+                        'echo_picklist_00001.csv')
+
+
+class TestEcho(unittest.TestCase):
+    def test_sample_volumes(self):
+        volumes = echo.sample_volumes([0.6, 0.3, 0.1, 0, 1.2],
+                                      desired_concentration=0.3,
+                                      final_volume=400)
+        np.testing.assert_allclose(volumes, [200, 400, 400, 400, 100])
+
+        # One desired concentration per sample
+        volumes = echo.sample_volumes([0.6, 0.6], [0.3, 0.15], 400)
+        np.testing.assert_allclose(volumes, [200, 100])
+
+    def test_echo_transfers(self):
+        picklist = pd.read_csv(PICKLIST)
+        transfers = echo.echo_transfers(picklist, 'destination')
+
+        samples = transfers.samples
+        assert list(samples.columns) == echo.ECHO_COLUMNS
+        volumes = samples['Transfer Volume'].to_numpy()
+        np.testing.assert_allclose(volumes % echo.DROPLET_VOLUME, 0)
+
+        # Samples and buffer add up to the final volume in every well
+        total = pd.concat([samples, transfers.buffer]).groupby(
+            'Destination Well')['Transfer Volume'].sum()
+        assert len(total) == len(picklist)
+        np.testing.assert_allclose(total, echo.FINALVOLUME)
+        assert not transfers.below_target.any()
+
+    def test_echo_transfers_dead_volume(self):
+        picklist = pd.DataFrame({
+            'Source well': ['A1', 'A1', 'B1'],
+            'Plate number': ['P1', 'P1', 'P1'],
+            'C(ng/ul)': [0.6, 0.6, 0.6],
+            'Destination well': ['A1', 'A2', 'A3'],
+        })
+        transfers = echo.echo_transfers(
+            picklist, 'destination', desired_concentration=0.3,
+            source_well_volume=300, dead_volume=50)
+        # Only 250 nL can be drawn from each source well
+        assert list(transfers.samples['Transfer Volume']) == [200, 50, 200]
+        assert list(transfers.below_target) == [False, True, False]
+
+    def test_cli(self):
+        output_folder = tempfile.mkdtemp()
+        runner = CliRunner()
+        result = runner.invoke(echo.echo, [PICKLIST, '--output-folder',
+                                           output_folder])
+        assert result.exit_code == 0, result.output
+        transfers = pd.read_csv(os.path.join(
+            output_folder, 'echo_picklist_00001_echo.csv'))
+        assert list(transfers.columns) == echo.ECHO_COLUMNS
+        assert (transfers['Source Plate Name'] == echo.BUFFER_PLATE).sum() \
+            == 384
+        shutil.rmtree(output_folder)
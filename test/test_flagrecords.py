@@ -0,0 +1,81 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
+import tempfile
+import unittest
+
+from dobby.flagrecords import FlagRecordStore, deferred_exports
+
+RECORD_FILE = 'record.csv'
+
+
+def _record_many(folder, plate_name, n):
+    store = FlagRecordStore(folder, csv=RECORD_FILE)
+    return [store.record(plate_name, f'2017-09-21 18:44:{i:02d}')
+            for i in range(n)]
+
+
+class TestFlagRecordStore(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_record_and_export(self):
+        store = FlagRecordStore(self.folder, csv=RECORD_FILE)
+        assert store.record('plate_a', 't1') == 1
+        assert store.record('plate_b', 't2') == 1
+        assert store.record('plate_a', 't3') == 2
+        assert store.count('plate_a') == 2
+        assert store.timestamps('plate_a') == ['t1', 't3']
+
+        with open(os.path.join(self.folder, RECORD_FILE)) as f:
+            assert f.read() == 'plate_a,t1,t3\nplate_b,t2\n'
+
+    def test_deferred_exports(self):
+        csv = os.path.join(self.folder, RECORD_FILE)
+        store = FlagRecordStore(self.folder, csv=RECORD_FILE)
+        with deferred_exports():
+            store.record('plate_a', 't1')
+            with deferred_exports():
+                store.record('plate_b', 't2')
+            # Only written once the outermost block ends
+            assert not os.path.exists(csv)
+        with open(csv) as f:
+            assert f.read() == 'plate_a,t1\nplate_b,t2\n'
+
+        # Left to the caller, e.g. a worker's parent
+        with deferred_exports() as pending:
+            store.record('plate_a', 't3')
+            stores = list(pending.values())
+            pending.clear()
+        with open(csv) as f:
+            assert f.read() == 'plate_a,t1\nplate_b,t2\n'
+        stores[0].export_csv()
+        with open(csv) as f:
+            assert f.read() == 'plate_a,t1,t3\nplate_b,t2\n'
+
+    def test_imports_existing_csv(self):
+        with open(os.path.join(self.folder, RECORD_FILE), 'w') as f:
+            f.write('plate_a,t1,t2\nplate_b,t3\n')
+        store = FlagRecordStore(self.folder, csv=RECORD_FILE)
+        assert store.record('plate_a', 't4') == 3
+
+        # Reopening doesn't import the CSV again
+        store = FlagRecordStore(self.folder, csv=RECORD_FILE)
+        assert store.count('plate_a') == 3
+
+    def test_concurrent_records(self):
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(_record_many, self.folder, 'plate', 10)
+                       for _ in range(4)]
+            counts = sorted(n for future in futures for n in future.result())
+
+        assert counts == list(range(1, 41))
+        with open(os.path.join(self.folder, RECORD_FILE)) as f:
+            assert len(f.read().split(',')) == 41
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+
+from dobby import aggregate, geometry
+
+parent_dir = os.path.split(os.path.dirname(geometry.__file__))[0]
+CHERRYPICK_PLATE = os.path.join(parent_dir, 'test/data/aggregate/input/1.csv')
+
+
+class TestGeometry(unittest.TestCase):
+    def test_names_and_indices(self):
+        plate = geometry.PLATE_1536
+        assert plate.n_wells == 1536
+        assert list(plate.row_names[24:]) == ['Y', 'Z', 'AA', 'AB', 'AC',
+                                              'AD', 'AE', 'AF']
+        assert plate.well_names[0] == 'A1'
+        assert plate.well_names[-1] == 'AF48'
+
+        index = plate.parse(['A1', 'B2', 'AF48', 'aa01'])
+        assert index.dtype == geometry.WELL_DTYPE
+        np.testing.assert_array_equal(index, [0, 49, 1535, 26 * 48])
+        rows, columns = plate.rows_columns(index)
+        np.testing.assert_array_equal(plate.well_index(rows, columns), index)
+        assert list(plate.names(index)) == ['A1', 'B2', 'AF48', 'AA1']
+
+        with self.assertRaises(ValueError):
+            geometry.PLATE_384.parse(['Q1'])
+        with self.assertRaises(ValueError):
+            geometry.PLATE_96.parse(['A13'])
+
+    def test_column_major_and_sizes(self):
+        plate = geometry.PLATE_96
+        assert list(plate.names(plate.column_major()[:9])) == [
+            'A1', 'B1', 'C1', 'D1', 'E1', 'F1', 'G1', 'H1', 'A2']
+        assert geometry.geometry_of(384) is geometry.PLATE_384
+        with self.assertRaises(ValueError):
+            geometry.geometry_of(100)
+
+    def test_aggregate_plate_size(self):
+        folder = tempfile.mkdtemp()
+        result = CliRunner().invoke(aggregate.aggregate, [
+            CHERRYPICK_PLATE, '--plate-size', '96', '--output-folder',
+            folder])
+        assert result.exit_code == 0, result.output
+
+        first = pd.read_csv(os.path.join(folder, 'echo_picklist_00001.csv'))
+        assert list(first['Destination well']) == list(
+            geometry.PLATE_96.well_names)
+        shutil.rmtree(folder)
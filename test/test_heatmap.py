@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from dobby import cherrypick, heatmap
+from dobby.geometry import PLATE_384, PLATE_1536
+
+parent_dir = os.path.split(os.path.dirname(heatmap.__file__))[0]
+GOOD_PLATE = os.path.join(parent_dir, 'test/data/cherrypick/input',
+                          'good_plate.txt')
+
+
+def _plate(geometry, n_columns=None):
+    n_columns = geometry.n_columns if n_columns is None else n_columns
+    values = np.random.RandomState(0).uniform(
+        size=(geometry.n_rows, n_columns))
+    return pd.DataFrame(values, index=geometry.row_names,
+                        columns=range(1, n_columns + 1))
+
+
+class TestHeatmap(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_draw(self):
+        plate = _plate(PLATE_384, 23)
+        plate.iloc[2, 3] = np.nan
+        plate_heatmap = heatmap.renderer(plate.shape)
+        # One figure per shape
+        assert heatmap.renderer(plate.shape) is plate_heatmap
+
+        plate_heatmap.draw(plate, 'plate', fmt='.1f', vmin=0, vmax=1)
+        # Missing values aren't annotated
+        assert len(plate_heatmap.annotations.get_paths()) == plate.size - 1
+        assert plate_heatmap.image.get_clim() == (0, 1)
+        for extension in heatmap.PLOT_FORMATS:
+            filename = os.path.join(self.folder, f'plate.{extension}')
+            plate_heatmap.save(filename)
+            assert os.path.getsize(filename) > 0
+
+        with self.assertRaises(ValueError):
+            plate_heatmap.draw(_plate(PLATE_384), 'plate')
+
+    def test_large_plates_not_annotated(self):
+        plate_heatmap = heatmap.PlateHeatmap(PLATE_1536.shape)
+        plate_heatmap.draw(_plate(PLATE_1536), 'plate')
+        assert len(plate_heatmap.annotations.get_paths()) == 0
+
+    def test_cherrypick_png(self):
+        cherrypick.main(GOOD_PLATE, 'good_plate', 'mouse',
+                        output_folder=self.folder, plot_format='png',
+                        plot_dpi=50, cache=False)
+        for folder, suffix in [('regression', 'regression_lines'),
+                               ('fluorescence', 'fluorescence_heatmap'),
+                               ('concentrations', 'concentrations_heatmap')]:
+            assert os.path.exists(os.path.join(
+                self.folder, folder, f'good_plate_{suffix}.png'))
+
+    def test_regression_figure_reused(self):
+        fluorescence = cherrypick._parse_fluorescence(GOOD_PLATE)
+        plate = cherrypick.cherrypick_plate(fluorescence, 'good_plate',
+                                            'mouse', datatypes=())
+        for name in ('first', 'second'):
+            cherrypick._plot_regression(plate.means, plate.regressed, name,
+                                        self.folder, plot_format='png',
+                                        dpi=50)
+        fig, ax, means_line, _ = cherrypick._regression_figure()
+        assert cherrypick._regression_figure()[0] is fig
+        assert len(ax.lines) == 2
+        assert list(means_line.get_ydata()) == list(plate.means)
+        # Drawn without pyplot, so no figures are left open
+        plt, _ = cherrypick._plotting()
+        assert plt.get_fignums() == []
+        for name in ('first', 'second'):
+            assert os.path.getsize(os.path.join(
+                self.folder, 'regression',
+                f'{name}_regression_lines.png')) > 0
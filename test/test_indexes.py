@@ -0,0 +1,93 @@
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+
+from dobby import indexes, samplesheet
+
+
+def hamming_str(a, b):
+    return sum(x != y for x, y in zip(a, b))
+
+
+class TestIndexes(unittest.TestCase):
+    def test_hamming(self):
+        sequences = ['ACGTACGT', 'ACGTACGA', 'TTTTTTTT', 'ACGAACGA',
+                     'GCCACTTA']
+        packed = indexes.pack_indexes(sequences)
+        distances = indexes.hamming(packed[:, np.newaxis],
+                                    packed[np.newaxis, :])
+        for i, j in itertools.product(range(len(sequences)), repeat=2):
+            assert distances[i, j] == hamming_str(sequences[i], sequences[j])
+
+    def test_pack_invalid(self):
+        with self.assertRaises(ValueError):
+            indexes.pack_indexes(['ACGTNCGT'])
+
+    def test_close_pairs(self):
+        rng = np.random.RandomState(0)
+        i7 = [''.join(rng.choice(list('ACGT'), 6)) for _ in range(300)]
+        i5 = [''.join(rng.choice(list('ACGT'), 6)) for _ in range(300)]
+        first, second, _, _, smallest = indexes.close_pairs(
+            indexes.pack_indexes(i7), indexes.pack_indexes(i5))
+
+        expected = [(i, j) for i, j in itertools.combinations(range(300), 2)
+                    if max(hamming_str(i7[i], i7[j]),
+                           hamming_str(i5[i], i5[j])) < indexes.MIN_DISTANCE]
+        assert sorted(zip(first, second)) == expected
+        assert smallest == min(
+            max(hamming_str(i7[i], i7[j]), hamming_str(i5[i], i5[j]))
+            for i, j in itertools.combinations(range(300), 2))
+
+    def test_check_templates(self):
+        close, smallest = indexes.check_indexes(['XT-C-01', 'XT-C-02'])
+        assert close.empty
+        assert smallest >= indexes.MIN_DISTANCE
+
+        # The same template twice collides in every well
+        close, smallest = indexes.check_indexes(['XT-C-03', 'XT-C-03'])
+        assert smallest == 0
+        assert len(close) == 384
+        assert (close['well_1'] == close['well_2']).all()
+
+        runner = CliRunner()
+        result = runner.invoke(indexes.check_indexes_command,
+                               ['XT-C-03', 'XT-C-03'])
+        assert result.exit_code != 0
+        assert 'identical indexes' in result.output
+
+    def test_check_mixed_lengths(self):
+        # Indexes of the same length are compared over their whole length,
+        # even pooled with shorter ones
+        alone, _ = indexes.check_indexes(['i5_03-i7_04'])
+        assert alone.empty
+        close, smallest = indexes.check_indexes(['XT-C-04', 'i5_03-i7_04'])
+        assert not close.empty
+        assert (close['sheet_1'] != close['sheet_2']).all()
+
+        xt = indexes.read_sheet('XT-C-04').set_index('well')
+        i5_i7 = indexes.read_sheet('i5_03-i7_04').set_index('well')
+        for _, pair in close.iterrows():
+            a, b = xt.loc[pair['well_1']], i5_i7.loc[pair['well_2']]
+            assert pair['distance_i7'] == hamming_str(a['index'],
+                                                      b['index'][:8])
+            assert pair['distance_i5'] == hamming_str(a['index2'],
+                                                      b['index2'][:8])
+        assert smallest == close[['distance_i7', 'distance_i5']].max(
+            axis=1).min()
+
+    def test_read_filled_i5_i7_sheet(self):
+        template = samplesheet._get_template('i5_03-i7_04')
+        samples = pd.DataFrame({'Combined name': ['sample_1', 'sample_2']})
+        sheet = samplesheet.fill_template(samples, template)
+        filename = os.path.join(tempfile.mkdtemp(), 'sheet.csv')
+        sheet.to_csv(filename, index=False)
+
+        samples = indexes.read_sheet(filename)
+        assert list(samples['sample']) == ['sample_1', 'sample_2']
+        shutil.rmtree(os.path.dirname(filename))
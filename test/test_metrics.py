@@ -0,0 +1,79 @@
+import glob
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from click.testing import CliRunner
+
+from dobby import aggregate, metrics
+
+parent_dir = os.path.split(os.path.dirname(metrics.__file__))[0]
+CHERRYPICK_PLATES = sorted(glob.glob(os.path.join(
+    parent_dir, 'test/data/aggregate/input/*.csv')))
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        metrics.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_timer_and_count(self):
+        with metrics.timer('block'):
+            pass
+
+        @metrics.timer('function')
+        def function():
+            return 1
+
+        assert function() == 1
+        assert function() == 1
+        metrics.count('rows', 3)
+        metrics.count('rows')
+
+        report = metrics.current().as_dict()
+        assert report['timers']['block']['calls'] == 1
+        assert report['timers']['function']['calls'] == 2
+        assert report['counters'] == {'rows': 4}
+
+    def test_measured_merges_into_the_run(self):
+        def work(n):
+            metrics.count('rows', n)
+            with metrics.timer('work'):
+                return n * 2
+
+        metrics.count('rows')
+        result, worker_metrics = metrics.measured(work, 5)
+        assert result == 10
+        assert worker_metrics['counters'] == {'rows': 5}
+        # The run itself is untouched until merged
+        assert metrics.current().counters == {'rows': 1}
+
+        metrics.merge(worker_metrics)
+        metrics.merge(worker_metrics)
+        report = metrics.current().as_dict()
+        assert report['counters'] == {'rows': 11}
+        assert report['timers']['work']['calls'] == 2
+
+    def test_aggregate_metrics_json_and_profile(self):
+        metrics_json = os.path.join(self.folder, 'metrics.json')
+        profile = os.path.join(self.folder, 'aggregate.prof')
+        result = CliRunner().invoke(aggregate.aggregate, CHERRYPICK_PLATES + [
+            '--output-folder', os.path.join(self.folder, 'output'),
+            '--metrics-json', metrics_json, '--profile', profile])
+        assert result.exit_code == 0, result.output
+        assert os.path.exists(profile)
+
+        with open(metrics_json) as f:
+            report = json.load(f)
+        assert report['command'] == 'aggregate'
+        assert report['counters']['files_read'] == len(CHERRYPICK_PLATES)
+        n_picklists = report['counters']['picklists_written']
+        assert n_picklists == len(glob.glob(os.path.join(
+            self.folder, 'output', 'echo_picklist_*.csv')))
+        assert report['timers']['write_picklist']['calls'] == n_picklists
+        assert report['wall_seconds'] > 0
@@ -0,0 +1,78 @@
+import random
+import unittest
+
+from dobby import packing
+
+
+def _check_plan(plates, sizes, capacity):
+    """Every sample of every source plate is packed once, and every
+    destination plate but the last is full"""
+    ranges = {}
+    for plate in plates:
+        for source, start, stop in plate:
+            assert start < stop
+            ranges.setdefault(source, []).append((start, stop))
+    for source, size in enumerate(sizes):
+        position = 0
+        for start, stop in sorted(ranges.get(source, [])):
+            assert start == position
+            position = stop
+        assert position == size
+    fills = [sum(stop - start for _, start, stop in plate)
+             for plate in plates]
+    assert all(fill == capacity for fill in fills[:-1])
+    assert 0 < fills[-1] <= capacity
+
+
+class TestPacking(unittest.TestCase):
+    def test_plan_plates(self):
+        sizes = [300, 100, 84, 200, 184]
+        plates = packing.plan_plates(sizes, 384)
+        _check_plan(plates, sizes, 384)
+        assert plates == [[(0, 0, 300), (2, 0, 84)],
+                          [(3, 0, 200), (4, 0, 184)],
+                          [(1, 0, 100)]]
+
+    def test_plan_plates_large_and_first(self):
+        sizes = [50, 800, 10, 0, 340]
+        plates = packing.plan_plates(sizes, 384, first=0)
+        _check_plan(plates, sizes, 384)
+        # The first source plate starts the first destination plate, and
+        # larger ones fill destination plates on their own
+        assert plates[0][0] == (0, 0, 50)
+        assert [(1, 0, 384)] in plates
+        assert [(1, 384, 768)] in plates
+
+    def test_plan_plates_random(self):
+        random_state = random.Random(0)
+        for _ in range(200):
+            capacity = random_state.choice([4, 96, 384])
+            sizes = [random_state.randint(0, 2 * capacity)
+                     for _ in range(random_state.randint(1, 40))]
+            first = random_state.choice([None, 0])
+            sizes[0] = min(sizes[0], capacity)
+            if sum(sizes) == 0:
+                continue
+            plates = packing.plan_plates(sizes, capacity, first)
+            _check_plan(plates, sizes, capacity)
+            if first is not None and sizes[first]:
+                assert plates[0][0] == (first, 0, sizes[first])
+
+    def test_plan_plates_fewer_sources(self):
+        random_state = random.Random(1)
+        sizes = [random_state.randint(20, 384) for _ in range(2000)]
+        plates = packing.plan_plates(sizes, 384)
+        _check_plan(plates, sizes, 384)
+        n_sources = sum(len({source for source, _, _ in plate})
+                        for plate in plates)
+
+        in_order = 0
+        position = 0
+        starts = []
+        for size in sizes:
+            starts.append((position, position + size))
+            position += size
+        for i in range(len(plates)):
+            in_order += sum(start < (i + 1) * 384 and stop > i * 384
+                            for start, stop in starts)
+        assert n_sources < 0.8 * in_order
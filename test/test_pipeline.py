@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+from click.testing import CliRunner
+
+from dobby import aggregate, cherrypick, pipeline
+
+parent_dir = os.path.split(os.path.dirname(pipeline.__file__))[0]
+cherrypick_test_dir = os.path.join(parent_dir, 'test/data/cherrypick/input')
+GOOD_PLATE = os.path.join(cherrypick_test_dir, 'good_plate.txt')
+BAD_PLATE = os.path.join(cherrypick_test_dir, 'bad_plate.txt')
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.metadata = os.path.join(self.folder, 'metadata.csv')
+        with open(self.metadata, 'w') as f:
+            f.write('plate,mouse.id\ngood_plate,good_mouse\n'
+                    'bad_plate,bad_mouse\n')
+        self.output_folder = os.path.join(self.folder, 'output')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_run(self):
+        runner = CliRunner()
+        result = runner.invoke(pipeline.run, [
+            GOOD_PLATE, BAD_PLATE, '--metadata', self.metadata,
+            '--templates', 'XT-C-01', '--output-folder', self.output_folder])
+        assert result.exit_code == 0, result.output
+        assert 'bad_plate\tflagged' in result.output
+
+        # Only the final outputs are written, besides the hidden
+        # reservations of pick list numbers
+        assert sorted(f for f in os.listdir(self.output_folder)
+                      if not f.startswith('.')) == [
+            'echo_picklist_00001_incomplete.csv',
+            'echo_picklist_00001_incomplete_samplesheet.csv']
+
+        # Same pick list as cherrypicking to disk and aggregating
+        cherrypick.main(GOOD_PLATE, 'good_plate', 'good_mouse', plot=False,
+                        output_folder=os.path.join(self.folder, 'cherrypick'))
+        runner.invoke(aggregate.aggregate, [
+            os.path.join(self.folder, 'cherrypick', 'cherrypicked',
+                         'good_plate_echo.csv'),
+            '--output-folder', os.path.join(self.folder, 'aggregate')])
+        expected = pd.read_csv(os.path.join(
+            self.folder, 'aggregate', 'echo_picklist_00001_incomplete.csv'))
+        picklist = pd.read_csv(os.path.join(
+            self.output_folder, 'echo_picklist_00001_incomplete.csv'))
+        pd.testing.assert_frame_equal(picklist, expected)
+
+        sheet = pd.read_csv(os.path.join(
+            self.output_folder,
+            'echo_picklist_00001_incomplete_samplesheet.csv'))
+        assert sheet['Sample_ID'].notnull().sum() == len(picklist)
+
+    def test_run_intermediates(self):
+        runner = CliRunner()
+        result = runner.invoke(pipeline.run, [
+            GOOD_PLATE, '--metadata', self.metadata, '--intermediates',
+            '--output-folder', self.output_folder])
+        assert result.exit_code == 0, result.output
+        assert os.path.exists(os.path.join(
+            self.output_folder, pipeline.INTERMEDIATES_FOLDER, 'cherrypicked',
+            'good_plate_echo.csv'))
+
+    def test_run_unknown_template(self):
+        runner = CliRunner()
+        result = runner.invoke(pipeline.run, [
+            GOOD_PLATE, '--metadata', self.metadata,
+            '--templates', 'not-a-template',
+            '--output-folder', self.output_folder])
+        assert result.exit_code != 0
+        assert not os.path.exists(os.path.join(
+            self.output_folder, 'echo_picklist_00001_incomplete.csv'))
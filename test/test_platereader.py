@@ -0,0 +1,66 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from dobby import platereader
+
+parent_dir = os.path.split(os.path.dirname(platereader.__file__))[0]
+GOOD_PLATE = os.path.join(parent_dir, 'test/data/cherrypick/input/good_plate.txt')
+
+
+class TestPlateReader(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        with io.open(GOOD_PLATE, encoding='utf-16', newline='') as f:
+            self.lines = f.read().split('\r\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, lines, encoding, delimiter='\t'):
+        filename = os.path.join(self.folder, 'plate.txt')
+        text = '\r\n'.join(lines).replace('\t', delimiter)
+        with io.open(filename, 'w', encoding=encoding, newline='') as f:
+            f.write(text)
+        return filename
+
+    def test_read_softmax_export(self):
+        values = platereader.read_plate(GOOD_PLATE)
+        assert values.shape == (16, 24)
+        assert values[0, 0] == 1770390
+        assert values[15, 23] == 140793
+
+    def test_sniff_encoding_and_delimiter(self):
+        expected = platereader.read_plate(GOOD_PLATE)
+        for encoding in ('utf-8', 'utf-16-le', 'latin-1'):
+            for delimiter in ('\t', ','):
+                filename = self.write(self.lines, encoding, delimiter)
+                assert platereader.sniff_format(filename)[1] == delimiter
+                values = platereader.read_plate(filename)
+                assert (values == expected).all()
+
+    def test_truncated(self):
+        filename = self.write(self.lines[:10], 'utf-16')
+        with self.assertRaisesRegex(platereader.PlateReaderFormatError,
+                                    'only 7 of 16 rows'):
+            platereader.read_plate(filename)
+
+    def test_shifted(self):
+        lines = list(self.lines)
+        lines[5] = lines[5].replace('\t', '\t\t', 1)
+        filename = self.write(lines, 'utf-16')
+        with self.assertRaisesRegex(platereader.PlateReaderFormatError,
+                                    'row C'):
+            platereader.read_plate(filename)
+
+    def test_no_header(self):
+        filename = self.write(self.lines[3:], 'utf-16')
+        with self.assertRaisesRegex(platereader.PlateReaderFormatError,
+                                    'header row'):
+            platereader.read_plate(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import unittest
+
+import numpy as np
+
+from dobby import cherrypick, platestack
+
+parent_dir = os.path.split(os.path.dirname(platestack.__file__))[0]
+cherrypick_test_dir = os.path.join(parent_dir, 'test/data/cherrypick/input')
+PLATES = [os.path.join(cherrypick_test_dir, f'{name}.txt') for name in
+          ('good_plate', 'bad_plate', 'bad_plate_MAA000321',
+           'bad_plate_MAA000344')]
+
+
+class TestPlateStack(unittest.TestCase):
+    def test_matches_cherrypick(self):
+        fluorescence = platestack.read_plates(PLATES)
+        result = platestack.analyze(fluorescence)
+        standards = cherrypick._parse_standards(cherrypick.STANDARDS_STR)
+
+        for i, filename in enumerate(PLATES):
+            plate = cherrypick._parse_fluorescence(filename)
+            concentrations, means, regressed = \
+                cherrypick._fluorescence_to_concentration(
+                    plate, cherrypick.STANDARDS_COL, standards)
+            good_cells = cherrypick._get_good_cells(
+                concentrations, cherrypick.BLANKS_COL, 'plate', 'mouse')
+
+            np.testing.assert_allclose(result.curves.means[i], means.values)
+            np.testing.assert_allclose(result.curves.slope[i],
+                                       regressed.slope)
+            np.testing.assert_allclose(result.curves.intercept[i],
+                                       regressed.intercept)
+            np.testing.assert_allclose(result.curves.rvalue[i],
+                                       regressed.rvalue)
+            np.testing.assert_allclose(result.concentrations[i],
+                                       concentrations.values)
+            assert (result.is_good[i] == good_cells.notnull().values).all()
+
+            expected = {
+                'regression': cherrypick._sanity_check_regression(
+                    regressed, cherrypick.R_MINIMUM),
+                'blanks': cherrypick._sanity_check_blanks(
+                    concentrations, cherrypick.BLANKS_COL),
+                'samples': cherrypick._sanity_check_samples(
+                    good_cells, cherrypick.CONCENTRATIONS_MINIMUM),
+                'concentration': cherrypick._sanity_check_concentration(
+                    concentrations, cherrypick.CONCENTRATIONS_MAXIMUM),
+            }
+            for check in platestack.CHECKS:
+                assert result.checks[check][i] == bool(expected[check]), check
+
+        assert list(result.passed) == [True, False, False, False]
+
+    def test_single_plate(self):
+        fluorescence = platestack.read_plates(PLATES[:1])[0]
+        result = platestack.analyze(fluorescence)
+        assert result.concentrations.shape == (1, 16, 24)
+
+
+if __name__ == '__main__':
+    unittest.main()
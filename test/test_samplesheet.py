@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+from click.testing import CliRunner
+
+from dobby import samplesheet
+
+parent_dir = os.path.split(os.path.dirname(samplesheet.__file__))[0]
+PICKLIST = os.path.join(parent_dir, 'test/data/aggregate/output_folder',
+                        'echo_picklist_00001.csv')
+
+
+class TestSamplesheet(unittest.TestCase):
+    def test_registry(self):
+        registry = samplesheet.TemplateRegistry()
+        assert 'XT-C-01' in registry.names
+        template = registry['XT-C-01']
+        template['Sample_ID'] = 'changed'
+        # The cached template is not changed by filling in a copy
+        assert registry['XT-C-01']['Sample_ID'].isnull().all()
+        with self.assertRaises(FileNotFoundError):
+            registry['not-a-template']
+
+    def test_fill_template_by_well(self):
+        picklist = pd.read_csv(PICKLIST)
+        # Shuffled and missing samples still go to their destination wells
+        picklist = picklist.iloc[:100].sample(frac=1, random_state=0)
+        filled = samplesheet.fill_template(picklist,
+                                           samplesheet._get_template('XT-C-02'))
+        assert len(filled) == 384
+        by_well = filled.set_index('well_id')['Sample_ID']
+        for well, name in zip(picklist['Destination well'],
+                              picklist['Combined name']):
+            assert by_well[well] == name
+        assert filled['Sample_ID'].notnull().sum() == 100
+        assert 'SampleID' not in filled
+
+    def test_fill_template_i5_i7(self):
+        # These templates have no wells and call the ID column "SampleID"
+        picklist = pd.read_csv(PICKLIST)
+        template = samplesheet._get_template('i5_03-i7_04')
+        columns = list(template.columns)
+        filled = samplesheet.fill_template(picklist, template)
+        assert list(filled.columns) == columns
+        n = min(len(picklist), len(filled))
+        assert (filled['SampleID'][:n]
+                == picklist['Combined name'][:n]).all()
+        assert (filled['Sample_Name'][:n]
+                == picklist['Combined name'][:n]).all()
+
+    def test_batch(self):
+        output_folder = tempfile.mkdtemp()
+        runner = CliRunner()
+        result = runner.invoke(samplesheet.samplesheet_batch, [
+            PICKLIST, PICKLIST.replace('00001', '00002'),
+            '--templates', 'XT-C-01,XT-C-02',
+            '--output-folder', output_folder])
+        assert result.exit_code == 0, result.output
+        assert sorted(os.listdir(output_folder)) == [
+            'echo_picklist_00001_samplesheet.csv',
+            'echo_picklist_00002_samplesheet.csv']
+
+        result = runner.invoke(samplesheet.samplesheet_batch, [
+            PICKLIST, '--templates', 'XT-C-01,XT-C-02'])
+        assert result.exit_code != 0
+        shutil.rmtree(output_folder)
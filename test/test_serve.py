@@ -0,0 +1,175 @@
+import concurrent.futures
+import concurrent.futures.process
+import http.client
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+import click
+
+from dobby import serve
+
+parent_dir = os.path.split(os.path.dirname(serve.__file__))[0]
+GOOD_PLATE = os.path.join(parent_dir, 'test/data/cherrypick/input',
+                          'good_plate.txt')
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path):
+        super().__init__('localhost')
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def _request(connection, method, path, body=None, headers=None):
+    headers = {'Content-Type': 'application/json', **(headers or {})}
+    connection.request(method, path,
+                       body=None if body is None else json.dumps(body),
+                       headers=headers)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+class TestServe(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.job = dict(command='cherrypick',
+                        args=[GOOD_PLATE, 'good_plate', 'mouse', '--no-plot',
+                              '--output-folder', 'output'],
+                        cwd=self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _serve(self, **kwargs):
+        pool = concurrent.futures.ProcessPoolExecutor(1)
+        server = serve.make_server(pool, 1, quiet=True,
+                                   make_pool=concurrent.futures
+                                   .ProcessPoolExecutor, **kwargs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            server.pool.shutdown()
+        self.addCleanup(stop)
+        return server
+
+    def test_run_job(self):
+        result = serve.run_job(self.job['command'], self.job['args'],
+                               self.folder)
+        assert result['ok'], result
+        assert result['qc']['plates_passed'] == 1
+        assert os.path.join(self.folder, 'output', 'cherrypicked',
+                            'good_plate_echo.csv') in result['outputs']
+        assert 'parse' in result['metrics']['timers']
+
+        result = serve.run_job('cherrypick', ['no_such_file.txt', 'a', 'b'],
+                               self.folder)
+        assert not result['ok']
+        assert result['exit_code'] == 1
+        assert 'no_such_file.txt' in result['error']
+
+        result = serve.run_job('aggregate', ['--no-such-option'], self.folder)
+        assert result['exit_code'] == 2
+
+    def test_run_job_outputs_of_workers(self):
+        metadata = os.path.join(self.folder, 'metadata.csv')
+        with open(metadata, 'w') as f:
+            f.write('plate,mouse.id\ngood_plate,good_mouse\n')
+        result = serve.run_job('cherrypick-batch', [
+            GOOD_PLATE, '--metadata', metadata, '--workers', '2',
+            '--render-workers', '1', '--output-folder', 'output'],
+            self.folder)
+        assert result['ok'], result
+        # Written by the worker processes of the command
+        output = os.path.join(self.folder, 'output')
+        assert os.path.join(output, 'cherrypicked', 'good_plate_echo.csv') \
+            in result['outputs']
+        assert os.path.join(output, 'regression',
+                            'good_plate_regression_lines.pdf') \
+            in result['outputs']
+
+    def test_http(self):
+        server = self._serve(port=0)
+        connection = http.client.HTTPConnection(*server.server_address)
+
+        status, result = _request(connection, 'POST', '/jobs', self.job)
+        assert status == 200
+        assert result['ok'], result
+        assert result['qc']['plates_processed'] == 1
+
+        status, health = _request(connection, 'GET', '/health')
+        assert (status, health['jobs']) == (200, 0)
+
+        status, _ = _request(connection, 'POST', '/jobs',
+                             dict(command='serve'))
+        assert status == 400
+
+        # Jobs a web page could send
+        status, _ = _request(connection, 'POST', '/jobs', self.job,
+                             headers={'Content-Type': 'text/plain'})
+        assert status == 415
+        status, _ = _request(connection, 'POST', '/jobs', self.job,
+                             headers={'Origin': 'http://example.com'})
+        assert status == 403
+        status, _ = _request(connection, 'POST', '/jobs', self.job,
+                             headers={'Host': 'example.com:8765'})
+        assert status == 403
+
+        # No room for another job
+        for _ in range(server.max_jobs):
+            server.take_slot()
+        status, _ = _request(connection, 'POST', '/jobs', self.job)
+        assert status == 503
+
+    def test_restart_broken_pool(self):
+        server = self._serve(port=0)
+        connection = http.client.HTTPConnection(*server.server_address)
+        # A worker dying breaks the pool for every later job
+        broken = server.pool
+        with self.assertRaises(concurrent.futures.process.BrokenProcessPool):
+            broken.submit(os._exit, 1).result()
+
+        status, result = _request(connection, 'POST', '/jobs', self.job)
+        assert status == 200
+        assert result['ok'], result
+        assert server.pool is not broken
+        status, health = _request(connection, 'GET', '/health')
+        assert health['pool_restarts'] == 1
+        assert health['last_pool_error']
+
+    def test_unix_socket(self):
+        socket_path = os.path.join(self.folder, 'dobby.sock')
+        self._serve(socket_path=socket_path)
+        status, result = _request(_UnixConnection(socket_path), 'POST',
+                                  '/jobs', self.job)
+        assert status == 200
+        assert result['ok'], result
+
+    def test_socket_path_taken(self):
+        # Only a socket left behind is replaced, never another file
+        socket_path = os.path.join(self.folder, 'dobby.sock')
+        with open(socket_path, 'w') as f:
+            f.write('data')
+        with self.assertRaises(click.BadParameter):
+            serve.make_server(None, 1, socket_path=socket_path)
+        with open(socket_path) as f:
+            assert f.read() == 'data'
+
+        os.remove(socket_path)
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(socket_path)
+        stale.close()
+        self._serve(socket_path=socket_path)
+        status, _ = _request(_UnixConnection(socket_path), 'GET', '/health')
+        assert status == 200
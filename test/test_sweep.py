@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+
+from dobby import cherrypick, platestack, sweep
+
+parent_dir = os.path.split(os.path.dirname(sweep.__file__))[0]
+cherrypick_test_dir = os.path.join(parent_dir, 'test/data/cherrypick/input')
+PLATES = [os.path.join(cherrypick_test_dir, f'{name}.txt') for name in
+          ('good_plate', 'bad_plate', 'bad_plate_MAA000321',
+           'bad_plate_MAA000344')]
+
+
+class TestSweep(unittest.TestCase):
+    def test_matches_platestack(self):
+        fluorescence = platestack.read_plates(PLATES)
+        grid = dict(n_std=[0.5, 1], r_minimum=[0.9, 0.98, 0.999],
+                    blanks_minimum=[-1, 0],
+                    concentrations_minimum=[0.5, 0.7],
+                    concentrations_maximum=[5, 10])
+        # In chunks of one and two plates
+        table = sweep.sweep([fluorescence[:1], fluorescence[1:3],
+                             fluorescence[3:]], **grid)
+        assert len(table) == 2 * 3 * 2 * 2 * 2
+        assert (table['plates'] == len(PLATES)).all()
+
+        for row in table.itertuples():
+            result = platestack.analyze(
+                fluorescence, r_minimum=row.r_minimum,
+                concentrations_minimum=row.concentrations_minimum,
+                concentrations_maximum=row.concentrations_maximum)
+            is_good = platestack.good_cells(
+                result.concentrations, result.blanks_mean,
+                result.blanks_std, n_std=row.n_std)
+            good_mean, good_std = platestack.good_cells_stats(
+                result.concentrations, is_good)
+            checks = dict(result.checks,
+                          blanks=result.blanks_mean > row.blanks_minimum,
+                          samples=good_mean + good_std
+                          > row.concentrations_minimum)
+            passed = np.logical_and.reduce(list(checks.values()))
+            n_good = is_good.sum(axis=(1, 2))
+
+            assert row.plates_passed == passed.sum()
+            assert row.passed_regression == checks['regression'].sum()
+            assert row.passed_samples == checks['samples'].sum()
+            assert row.wells_good == n_good.sum()
+            assert row.wells_picked == n_good[passed].sum()
+
+    def test_matches_cherrypick(self):
+        # At the default thresholds, each plate passes or fails every check
+        # as "dobby cherrypick" decides
+        fluorescence = platestack.read_plates(PLATES)
+        for plate, filename in zip(fluorescence, PLATES):
+            name = os.path.basename(filename)
+            cherrypicked = cherrypick.cherrypick_plate(
+                cherrypick._parse_fluorescence(filename), name, 'mouse',
+                datatypes=())
+            row = sweep.sweep([plate[np.newaxis]]).iloc[0]
+
+            checks = dict(zip(cherrypick.SANITY_CHECKS, cherrypicked.checks))
+            assert row['passed_regression'] == checks['regression'], name
+            assert row['passed_blanks'] == checks['blanks'], name
+            assert row['passed_samples'] == checks['samples'], name
+            assert row['passed_concentration'] == checks['concentration'], \
+                name
+            assert row['plates_passed'] == all(cherrypicked.checks), name
+            assert row['wells_good'] \
+                == cherrypicked.good_cells.notnull().values.sum(), name
+        # Both verdicts are exercised
+        assert sweep.sweep([fluorescence]).iloc[0]['plates_passed'] == 1
+
+    def test_qc_sweep_writes_nothing_else(self):
+        runner = CliRunner()
+        folder = tempfile.mkdtemp()
+        output = os.path.join(folder, 'sweep.csv')
+        result = runner.invoke(sweep.qc_sweep, PLATES + [
+            '--r-minimum', '0.95,0.98', '--output', output])
+        assert result.exit_code == 0, result.output
+        assert os.listdir(folder) == ['sweep.csv']
+        assert len(pd.read_csv(output)) == 2
+        shutil.rmtree(folder)
+
+        result = runner.invoke(sweep.qc_sweep, ['--r-minimum', 'high'])
+        assert result.exit_code != 0